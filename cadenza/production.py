@@ -45,6 +45,10 @@ DEBUG = False
 
 SECRET_KEY = os.environ['SECRET_KEY']
 
+# required: without it the shared caches (sessions, throttles, OAuth handshakes) would be
+# LocMemCache, one per process; settings.py builds CACHES from the same variable
+REDIS_URL = os.environ['REDIS_URL']
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -59,6 +63,9 @@ MIDDLEWARE = [
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# the App Service front end appends the client address to X-Forwarded-For
+REST_FRAMEWORK = dict(REST_FRAMEWORK, NUM_PROXIES=int(os.getenv('NUM_PROXIES', 1)))
+
 STORAGES = {
     "default": {
         "BACKEND": "storages.backends.azure_storage.AzureStorage",
@@ -114,6 +121,22 @@ AZURE_STORAGE_MEDIA_CONTAINER_NAME = 'django-media-prod'
 AZURE_STORAGE_RAG_CONNECTION_STRING = os.environ['AZURE_STORAGE_RAG_CONNECTION_STRING']
 AZURE_STORAGE_RAG_CONTAINER_NAME = 'sync-storage-prod'
 
+REPORT_STORES = {
+    alias: {
+        "BACKEND": "core.report_store.AzureReportStore",
+        "OPTIONS": {
+            "container_setting": container_setting,
+            "connection_string_setting": connection_string_setting,
+        },
+    }
+    for alias, container_setting, connection_string_setting in (
+        ('report', 'AZURE_STORAGE_REPORT_CONTAINER_NAME', 'AZURE_STORAGE_CONNECTION_STRING'),
+        ('chat_bot', 'AZURE_STORAGE_CHAT_BOT_CONTAINER_NAME', 'AZURE_STORAGE_CONNECTION_STRING'),
+        ('media', 'AZURE_STORAGE_MEDIA_CONTAINER_NAME', 'AZURE_STORAGE_CONNECTION_STRING'),
+        ('rag', 'AZURE_STORAGE_RAG_CONTAINER_NAME', 'AZURE_STORAGE_RAG_CONNECTION_STRING'),
+    )
+}
+
 AZURE_COMMUNICATION_CONNECTION_STRING = os.environ['AZURE_COMMUNICATION_CONNECTION_STRING']
 
 SLACK_WEBHOOK_URL = os.environ['SLACK_WEBHOOK_URL']
@@ -113,13 +113,44 @@ DATABASES = {
     }
 }
 
+# Redis in production (e.g. redis://localhost:6379/0), local memory of the process without it
+REDIS_URL = os.getenv('REDIS_URL')
+SHARED_CACHE_BACKEND = (
+    "django.core.cache.backends.redis.RedisCache" if REDIS_URL
+    else "django.core.cache.backends.locmem.LocMemCache"
+)
+
 CACHES = {
+    # content (news feed, base templates, story room configurations): a short-lived LRU of the
+    # process in front of Redis, see core/tiered_cache.py
     "default": {
-        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
-        "LOCATION": "cache_table",
-    }
+        "BACKEND": "core.tiered_cache.TieredCache",
+        "LOCATION": "default",
+        "OPTIONS": {"REMOTE": "redis", "LOCAL_TIMEOUT": 5, "LOCAL_MAX_ENTRIES": 1000},
+    },
+    # values every process must see at once: locks, counters, throttles
+    "redis": {
+        "BACKEND": SHARED_CACHE_BACKEND,
+        "LOCATION": REDIS_URL or "redis",
+    },
+    "sessions": {
+        "BACKEND": SHARED_CACHE_BACKEND,
+        "LOCATION": REDIS_URL or "sessions",
+        "KEY_PREFIX": "session",
+    },
+    # state and client secrets of the OAuth data sync handshakes, never kept in a process
+    "handshake": {
+        "BACKEND": SHARED_CACHE_BACKEND,
+        "LOCATION": REDIS_URL or "handshake",
+        "KEY_PREFIX": "oauth",
+        "TIMEOUT": 900,
+    },
 }
 
+# sessions are read from Redis, written through to the database
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+SESSION_CACHE_ALIAS = "sessions"
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -182,7 +213,15 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
         'rest_framework.filters.SearchFilter',
-    ]
+    ],
+    # proxies in front of the app, the client IP of the throttles is the address they saw, not
+    # the X-Forwarded-For sent by the client (0: REMOTE_ADDR)
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 0)),
+    # token buckets of core/throttling.py, capacity / refill period
+    'DEFAULT_THROTTLE_RATES': {
+        'story_room_ip': '30/min',
+        'story_room_tenant': '600/min',
+    },
 }
 
 SIMPLE_JWT = {
@@ -249,7 +288,7 @@ LOGGING = {
 
 ASGI_APPLICATION = "cadenza.asgi.application"
 
-API_DOMAIN = 'http://localhost:8000'
+API_DOMAIN = 'http://localhost:8000'  # address the converters fetch the html of exports from, see core/exports.py
 PDF_FUNC_DOMAIN = 'http://localhost:8080' # run it in docker(README.md)
 PPT_FUNC_DOMAIN = 'http://localhost:7071/api/generate_ppt?code=code'
 DOC_FUNC_DOMAIN = 'http://localhost:7071/api/generate_doc?code=code'
@@ -258,6 +297,12 @@ OAUTH_REDIRECT_URI = 'http://localhost:3000/tenant-admin/connectors/{route_slug}
 # OAUTH_REDIRECT_URI = 'https://app.getcadenza.com/tenant-admin/connectors/{route_slug}/callback/{application_slug}'
 
 RECAPTCHA_V3_SECRET_KEY = os.getenv('RECAPTCHA_V3_SECRET_KEY')
+RECAPTCHA_TIMEOUT = (3, 5)  # (connect, read) seconds of the reCAPTCHA verification
+
+# throttles of the anonymous story room endpoints, see core/throttling.py
+THROTTLE_CACHE = 'redis'  # cache alias of the shared token buckets
+THROTTLE_LOCAL_MAX_KEYS = 10000  # token buckets kept per process
+STORY_ROOM_CONFIG_CACHE_TIMEOUT = 300  # seconds of the cached StoryRoomVerify lookups, see core/story_rooms.py
 
 FRONTEND_DOMAIN = 'http://127.0.0.1:3000'
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
@@ -270,3 +315,112 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 SLACK_WEBHOOK_URL = os.getenv('SLACK_WEBHOOK_URL')
 EXA_API_KEY = os.getenv('EXA_API_KEY')
+
+# shared Azure Blob clients, see core/blob_clients.py
+AZURE_STORAGE_POOL_CONNECTIONS = int(os.getenv('AZURE_STORAGE_POOL_CONNECTIONS', 10))
+AZURE_STORAGE_POOL_MAXSIZE = int(os.getenv('AZURE_STORAGE_POOL_MAXSIZE', 32))
+AZURE_STORAGE_CONNECTION_TIMEOUT = 10
+AZURE_STORAGE_READ_TIMEOUT = 60
+AZURE_STORAGE_AIO_CONNECTION_LIMIT = int(os.getenv('AZURE_STORAGE_AIO_CONNECTION_LIMIT', 256))
+AZURE_STORAGE_AIO_KEEPALIVE_TIMEOUT = 30
+# bytes of the first and of every following GET of a download, bounds the memory of a streamed blob
+AZURE_STORAGE_MAX_SINGLE_GET_SIZE = 4 * 1024 * 1024
+AZURE_STORAGE_MAX_CHUNK_GET_SIZE = 4 * 1024 * 1024
+AZURE_STORAGE_COPY_POLL_INTERVAL = 0.5  # seconds between status checks of a pending server side copy
+
+# blob stores of core/report_store.py, one per alias, production uses Azure containers
+REPORT_STORES = {
+    alias: {
+        "BACKEND": "core.report_store.LocalReportStore",
+        "OPTIONS": {
+            "location": os.path.join(BASE_DIR, 'report_store', alias),
+            "latency": float(os.getenv('REPORT_STORE_LATENCY', 0)),
+        },
+    }
+    for alias in ('report', 'chat_bot', 'rag', 'media')
+}
+
+# core/report_documents.py, 'gzip' or 'zstd' (needs the zstandard package)
+REPORT_DOCUMENT_COMPRESSION = os.getenv('REPORT_DOCUMENT_COMPRESSION', 'gzip')
+REPORT_DOCUMENT_COMPRESSION_LEVEL = 6
+REPORT_CHUNK_PAGE_SIZE = 25  # research_chunks per blob
+REPORT_CHUNK_MAX_LIMIT = 200  # max chunks_limit of FetchReportView
+REPORT_GENERATION_GRACE = 3600  # seconds a replaced report generation stays readable
+
+# Cache-Control of report, image and download responses, clients revalidate with the ETag
+BLOB_RESPONSE_CACHE_CONTROL = {'private': True, 'no_cache': True}
+BLOB_STREAM_CHUNK_SIZE = 64 * 1024  # bytes per chunk of streamed local files and converter output
+
+# local copies of report images served by FetchReportImageView, see core/blob_cache.py
+BLOB_CACHE_LOCATION = os.path.join(MEDIA_ROOT, 'portfolio_assets')
+BLOB_CACHE_MAX_BYTES = int(os.getenv('BLOB_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+BLOB_CACHE_REVALIDATE_AFTER = 300  # seconds an entry is served without asking Azure
+
+# report image variants, see core/image_variants.py
+IMAGE_VARIANT_WIDTHS = (320, 800, 1600)
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_VARIANT_WEBP = True  # serve WebP to clients that accept it
+IMAGE_VARIANT_STORE = 'report'  # alias of REPORT_STORES the variants are written to, under image-variants/
+
+# PDF/PPT/DOC exports run in background threads, see core/exports.py
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', 4))
+EXPORT_CONVERTER_TIMEOUT = (10, 300)  # (connect, read) seconds of a converter call
+EXPORT_JOB_STALE_AFTER = 900  # seconds after which a running job is considered lost
+EXPORT_ARTIFACT_RETENTION = 86400  # seconds a replaced artifact stays downloadable from the jobs that produced it
+EXPORT_PRUNE_INTERVAL = 3600  # seconds between sweeps of replaced artifacts by run_export_jobs --loop
+# seconds a conversion holds its lock: the converter call and the upload of its output,
+# longer than the converter read timeout
+EXPORT_LOCK_TIMEOUTS = {'PDF': 360, 'PPT': 360, 'DOC': 360}
+EXPORT_LOCK_POLL_INTERVAL = 1  # seconds between checks of requests waiting for a conversion
+EXPORT_PREWARM = True  # saving a report queues the regeneration of its stale exports
+EXPORT_BULK_CONCURRENCY = 4  # parallel conversions of one bulk download
+EXPORT_BULK_MAX_ITEMS = 100  # exports (portfolios x file types) of one bulk download
+
+# compiled base HTML templates of show_html, see core/template_cache.py
+BASE_TEMPLATE_CACHE_SIZE = 32  # compiled templates kept per process
+BASE_TEMPLATE_REVALIDATE_AFTER = 60  # seconds a compiled template is used without checking its blob etag
+BASE_TEMPLATE_CACHE_TIMEOUT = 24 * 3600  # seconds of the resolved templates and sources in the shared cache
+
+REPORT_LIST_MAX_LIMIT = 500  # max `limit` of ReportListView, see core/report_index.py
+STORY_LIST_MAX_LIMIT = 500  # max `limit` of StoryList, see core/story_index.py
+
+# StoryRoomUpload queues the stories, see core/story_ingestion.py
+# drain the queue on a thread of the web process after each submission, and again when a retry is
+# due; stories left by a restarted process wait for the next submission or `run_story_uploads`
+STORY_INGEST_IN_PROCESS = True
+STORY_INGEST_BATCH_SIZE = 50  # stories claimed at once by a worker
+STORY_INGEST_CONCURRENCY = 8  # parallel blob uploads of a batch
+STORY_INGEST_MAX_ATTEMPTS = 8
+STORY_INGEST_RETRY_DELAY = 5  # seconds before the first retry, doubled at every attempt
+STORY_INGEST_MAX_RETRY_DELAY = 3600
+STORY_INGEST_STALE_AFTER = 600  # seconds after which an uploading story is considered lost
+
+# full-text search over reports and stories, see core/search.py
+SEARCH_MAX_LIMIT = 100  # max `limit` of SearchView
+SEARCH_MAX_BODY_CHARS = 500_000  # indexed characters of a document, a PostgreSQL tsvector is limited to 1MB
+
+# Visit rows of UserVisitsMiddleware are buffered, see user_activity/recorder.py
+# False saves them in the request, e.g. in tests that read them back
+VISIT_BUFFERED = True
+VISIT_FLUSH_INTERVAL = 5  # seconds between writes of the buffer
+VISIT_FLUSH_SIZE = 500  # visits written at once, a full batch is written without waiting
+VISIT_BUFFER_MAX_SIZE = 50000  # visits kept while the database is unavailable
+VISIT_SAMPLE_RATE = float(os.getenv('VISIT_SAMPLE_RATE', 1.0))  # fraction of the requests logged
+VISIT_INCLUDE_PATHS = []  # regular expressions, when set only matching paths are logged
+VISIT_EXCLUDE_PATHS = [r'/static/', r'/media/', r'/favicon\.ico', r'/admin/jsi18n/']
+# clients without a session or a JWT are identified by a signed cookie, see user_activity/identity.py
+VISIT_COOKIE_NAME = 'visitor'
+VISIT_COOKIE_AGE = 365 * 24 * 3600
+
+# visit counts of the activity overview, see user_activity/rollups.py
+VISIT_ROLLUP_BATCH_SIZE = 100000  # visits counted per transaction
+VISIT_ROLLUP_SETTLE = 60  # seconds before a visit is counted
+VISIT_ROLLUP_HOURLY_RETENTION_DAYS = 90
+
+# monthly Visit partitions (PostgreSQL) and their retention, see user_activity/partitions.py
+VISIT_PARTITIONS_AHEAD = 3  # months of partitions created in advance
+VISIT_RETENTION_MONTHS = 6  # full months kept before the current one
+VISIT_RETENTION_DELETE_BATCH = 10000  # rows per DELETE without partitions
+VISIT_ARCHIVE = True  # write expired months to blob before dropping them
+VISIT_ARCHIVE_STORE = 'report'  # alias of REPORT_STORES, under visit-archive/
+VISIT_ARCHIVE_PART_ROWS = 500000  # rows per gzipped CSV part
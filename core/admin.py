@@ -108,6 +108,39 @@ class ReleaseNoteAdmin(admin.ModelAdmin):
     model = models.ReleaseNote
 
 
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('uuid', 'portfolio', 'file_type', 'status', 'created_at', 'finished_at')
+    list_filter = ["status", "file_type"]
+    model = models.ExportJob
+
+
+class ReportIndexAdmin(admin.ModelAdmin):
+    list_display = ('report_id', 'title', 'tenant', 'created_by', 'last_modified', 'size')
+    search_fields = ["report_id", "title", "tenant__name"]
+    model = models.ReportIndex
+
+
+class StorySubmissionAdmin(admin.ModelAdmin):
+    list_display = ('blob_name', 'tenant', 'category', 'created_by', 'created_at', 'size')
+    list_filter = ["category"]
+    search_fields = ["blob_name", "created_by", "tenant__name"]
+    model = models.StorySubmission
+
+
+class StoryUploadAdmin(admin.ModelAdmin):
+    list_display = ('blob_name', 'tenant', 'status', 'attempts', 'next_attempt_at', 'submitted_at')
+    list_filter = ["status"]
+    search_fields = ["blob_name", "tenant__name"]
+    model = models.StoryUpload
+
+
+class SearchDocumentAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'key', 'title', 'tenant', 'updated_at')
+    list_filter = ["kind"]
+    search_fields = ["key", "title", "tenant__name"]
+    model = models.SearchDocument
+
+
 admin.site.register(models.Tenant, TenantAdmin)
 admin.site.register(models.StoryRoom, StoryRoomAdmin)
 admin.site.register(models.Donation, DonationAdmin)
@@ -116,3 +149,8 @@ admin.site.register(models.ReportBaseTemplate, ReportBaseTemplateAdmin)
 admin.site.register(models.DataSource, DataSourceAdmin)
 admin.site.register(models.DataConnection, DataConnectionAdmin)
 admin.site.register(models.ReleaseNote, ReleaseNoteAdmin)
+admin.site.register(models.ExportJob, ExportJobAdmin)
+admin.site.register(models.ReportIndex, ReportIndexAdmin)
+admin.site.register(models.StorySubmission, StorySubmissionAdmin)
+admin.site.register(models.StoryUpload, StoryUploadAdmin)
+admin.site.register(models.SearchDocument, SearchDocumentAdmin)
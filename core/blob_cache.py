@@ -0,0 +1,211 @@
+"""bounded local disk cache of blobs, e.g. the report images of FetchReportImageView
+
+    cache = get_blob_cache()
+    cache.fetch(get_report_store('report'), image_key)  # local copy, validated by etag
+    return stream_blob(request, cache, image_key)
+
+A cache is a LocalReportStore, every file has its `.properties` JSON with the etag of the
+source blob, so served validators are those of the blob. On top of that:
+
+- entries younger than `revalidate_after` seconds are served without asking the source,
+  older ones are revalidated with a conditional download (no body when unchanged)
+- writes go to a temporary file renamed into place, concurrent fetches of the same blob
+  (threads or processes) never see a partial file
+- once the cached bytes exceed `max_bytes`, the least recently used entries are removed
+  down to `low_watermark * max_bytes`; the mtime of the properties file is the last use
+- hit / miss / revalidation / eviction counters of this process, see `stats()`
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from core.report_store import BlobNotFound, BlobNotModified, LocalReportStore, StoredBlob
+
+logger = logging.getLogger(__name__)
+
+
+class BlobCache(LocalReportStore):
+
+    def __init__(self, location, max_bytes, revalidate_after=60, low_watermark=0.9):
+        super().__init__(location)
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self.low_watermark = low_watermark
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._size = None  # bytes on disk, counted on first use
+        self._counters = {'hits': 0, 'misses': 0, 'revalidations': 0, 'evictions': 0}
+
+    def _count(self, counter, value=1):
+        with self._lock:
+            self._counters[counter] += value
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, size=self._size, max_bytes=self.max_bytes)
+
+    def _read_entry(self, name):
+        """stored properties of a complete entry or None"""
+        if not os.path.isfile(self._path(name)):
+            return None
+        try:
+            with open(self._properties_path(name)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None  # written before the cache existed, or a concurrent write
+
+    def _write_properties(self, name, properties):
+        entry = {
+            'etag': properties.etag,
+            'content_type': properties.content_type,
+            'metadata': properties.metadata,
+            'validated_at': time.time(),
+        }
+        self._write_atomic(self._properties_path(name), json.dumps(entry).encode('utf-8'))
+
+    def _write(self, name, chunks, properties):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        old_size = os.path.getsize(path) if os.path.isfile(path) else 0
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._write_properties(name, properties)
+        self._grow(size - old_size)
+
+    def fetch(self, source, name, key=None):
+        """make sure the local copy of `name` of `source` is current, raise BlobNotFound
+
+        the copy is stored as `key` (default `name`), e.g. to keep several sources apart
+        """
+        key = key or name
+        entry = self._read_entry(key)
+        if entry and time.time() - entry.get('validated_at', 0) < self.revalidate_after:
+            self._count('hits')
+            now = time.time()  # explicit, the kernel clock of os.utime(path) is too coarse to order hits
+            os.utime(self._properties_path(key), (now, now))
+            return
+        try:
+            chunks, properties = source.open(name, if_none_match=entry and entry.get('etag'))
+        except BlobNotModified:
+            self._count('revalidations')
+            entry['validated_at'] = time.time()
+            self._write_atomic(self._properties_path(key), json.dumps(entry).encode('utf-8'))
+            return
+        except BlobNotFound:
+            self.invalidate(key)
+            raise
+        self._count('misses')
+        self._write(key, chunks, properties)
+
+    def put(self, name, data, metadata=None, content_type=None, etag=None):
+        """write-through of a blob just uploaded to the source, `etag` is the source etag"""
+        properties = StoredBlob(name=name, etag=etag, content_type=content_type, metadata=dict(metadata or {}))
+        self._write(name, [data], properties)
+
+    def invalidate(self, name):
+        path = self._path(name)
+        size = os.path.getsize(path) if os.path.isfile(path) else 0
+        try:
+            self.delete(name)
+        except BlobNotFound:
+            return
+        self._grow(-size)
+
+    def _entries(self):
+        """`(last_use, size, name)` of every complete entry"""
+        entries = []
+        for root, dirs, files in os.walk(self.location):
+            if root == self.location:
+                dirs[:] = [d for d in dirs if d != '.properties']
+            for file_name in files:
+                if file_name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, file_name)
+                name = os.path.relpath(path, self.location).replace(os.sep, '/')
+                try:
+                    size = os.path.getsize(path)
+                except FileNotFoundError:
+                    continue  # removed by a concurrent eviction
+                try:
+                    last_use = os.path.getmtime(self._properties_path(name))
+                except FileNotFoundError:
+                    last_use = 0  # no properties, first to go
+                entries.append((last_use, size, name))
+        return entries
+
+    def _grow(self, delta):
+        with self._lock:
+            if self._size is not None:
+                self._size += delta
+            over_budget = self._size is None or self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """remove least recently used entries until the cache fits its budget"""
+        # the scan runs outside of `_lock`, hits are not blocked meanwhile
+        with self._evict_lock:
+            entries = self._entries()
+            size = sum(entry[1] for entry in entries)
+            evicted = 0
+            if size > self.max_bytes:
+                target = self.max_bytes * self.low_watermark
+                for last_use, entry_size, name in sorted(entries):
+                    if size <= target:
+                        break
+                    try:
+                        self.delete(name)
+                    except BlobNotFound:
+                        pass
+                    size -= entry_size
+                    evicted += 1
+            with self._lock:
+                self._size = size
+                self._counters['evictions'] += evicted
+        if evicted:
+            logger.info(f"blob cache {self.location}: evicted {evicted} entries, {size} bytes left")
+        return evicted
+
+
+_blob_cache = None
+_blob_cache_lock = threading.Lock()
+
+
+def get_blob_cache():
+    """the shared cache configured by `settings.BLOB_CACHE_*`"""
+    global _blob_cache
+    if _blob_cache is None:
+        with _blob_cache_lock:
+            if _blob_cache is None:
+                _blob_cache = BlobCache(
+                    settings.BLOB_CACHE_LOCATION,
+                    max_bytes=settings.BLOB_CACHE_MAX_BYTES,
+                    revalidate_after=settings.BLOB_CACHE_REVALIDATE_AFTER,
+                )
+    return _blob_cache
+
+
+@receiver(setting_changed)
+def reset_blob_cache(setting, **kwargs):
+    """tests point the cache to a temporary directory with override_settings"""
+    global _blob_cache
+    if setting.startswith('BLOB_CACHE_'):
+        with _blob_cache_lock:
+            _blob_cache = None
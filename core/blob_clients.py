@@ -0,0 +1,91 @@
+"""process-wide Azure Blob clients
+
+`BlobServiceClient.from_connection_string` parses the connection string and opens a new
+HTTP connection pool every time it is called. The clients here are created once per
+connection string and shared by every request (the azure clients are thread-safe), so
+TLS connections to the storage account are kept alive and reused.
+"""
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobServiceClient
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_service_clients = {}
+_container_clients = {}
+_sessions = []
+
+
+def _build_transport():
+    """one pooled keep-alive session per service client"""
+    session = requests.Session()
+    # retries are handled by the azure pipeline, the adapter must not retry on its own
+    adapter = HTTPAdapter(
+        pool_connections=settings.AZURE_STORAGE_POOL_CONNECTIONS,
+        pool_maxsize=settings.AZURE_STORAGE_POOL_MAXSIZE,
+        max_retries=Retry(total=False, redirect=False, raise_on_status=False),
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Connection'] = 'keep-alive'
+    _sessions.append(session)
+    return RequestsTransport(
+        session=session,
+        session_owner=False,
+        connection_timeout=settings.AZURE_STORAGE_CONNECTION_TIMEOUT,
+        read_timeout=settings.AZURE_STORAGE_READ_TIMEOUT,
+    )
+
+
+def get_blob_service_client(connection_string):
+    """return the shared BlobServiceClient of the connection string"""
+    client = _service_clients.get(connection_string)
+    if client is not None:
+        return client
+    with _lock:
+        client = _service_clients.get(connection_string)
+        if client is None:
+            client = BlobServiceClient.from_connection_string(
+                connection_string,
+                transport=_build_transport(),
+                max_single_get_size=settings.AZURE_STORAGE_MAX_SINGLE_GET_SIZE,
+                max_chunk_get_size=settings.AZURE_STORAGE_MAX_CHUNK_GET_SIZE,
+            )
+            _service_clients[connection_string] = client
+            logger.info(f"created pooled BlobServiceClient for {client.account_name}")
+    return client
+
+
+def get_container_client(container_name, connection_string=None):
+    """return the shared ContainerClient, default to the main storage account"""
+    connection_string = connection_string or settings.AZURE_STORAGE_CONNECTION_STRING
+    key = (connection_string, container_name)
+    client = _container_clients.get(key)
+    if client is not None:
+        return client
+    service_client = get_blob_service_client(connection_string)
+    with _lock:
+        client = _container_clients.get(key)
+        if client is None:
+            client = service_client.get_container_client(container_name)
+            _container_clients[key] = client
+    return client
+
+
+def close_all():
+    """close pooled connections, e.g. on worker shutdown"""
+    with _lock:
+        for client in _service_clients.values():
+            client.close()
+        for session in _sessions:
+            session.close()
+        _service_clients.clear()
+        _sessions.clear()
+        _container_clients.clear()
@@ -0,0 +1,73 @@
+"""asyncio Azure Blob clients for the async views, see core/views_async.py
+
+aiohttp sessions are bound to the event loop that created them, so the shared clients
+are kept per running loop (daphne runs a single loop per process).
+"""
+import asyncio
+import logging
+
+import aiohttp
+from django.conf import settings
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.storage.blob.aio import BlobServiceClient
+
+logger = logging.getLogger(__name__)
+
+_service_clients = {}
+_container_clients = {}
+_sessions = {}
+
+
+def _build_transport(loop):
+    connector = aiohttp.TCPConnector(
+        limit=settings.AZURE_STORAGE_AIO_CONNECTION_LIMIT,
+        keepalive_timeout=settings.AZURE_STORAGE_AIO_KEEPALIVE_TIMEOUT,
+    )
+    session = aiohttp.ClientSession(connector=connector)
+    _sessions.setdefault(loop, []).append(session)
+    return AioHttpTransport(
+        session=session,
+        session_owner=False,
+        connection_timeout=settings.AZURE_STORAGE_CONNECTION_TIMEOUT,
+        read_timeout=settings.AZURE_STORAGE_READ_TIMEOUT,
+    )
+
+
+def get_blob_service_client(connection_string):
+    """return the async BlobServiceClient of the connection string for the running loop"""
+    loop = asyncio.get_running_loop()
+    key = (loop, connection_string)
+    client = _service_clients.get(key)
+    if client is None:
+        # no await between lookup and insert, so this cannot race within the loop
+        client = BlobServiceClient.from_connection_string(
+            connection_string,
+            transport=_build_transport(loop),
+            max_single_get_size=settings.AZURE_STORAGE_MAX_SINGLE_GET_SIZE,
+            max_chunk_get_size=settings.AZURE_STORAGE_MAX_CHUNK_GET_SIZE,
+        )
+        _service_clients[key] = client
+        logger.info(f"created async BlobServiceClient for {client.account_name}")
+    return client
+
+
+def get_container_client(container_name, connection_string=None):
+    connection_string = connection_string or settings.AZURE_STORAGE_CONNECTION_STRING
+    loop = asyncio.get_running_loop()
+    key = (loop, connection_string, container_name)
+    client = _container_clients.get(key)
+    if client is None:
+        client = get_blob_service_client(connection_string).get_container_client(container_name)
+        _container_clients[key] = client
+    return client
+
+
+async def close_all():
+    """close the clients of the running loop"""
+    loop = asyncio.get_running_loop()
+    for key in [key for key in _container_clients if key[0] is loop]:
+        del _container_clients[key]
+    for key in [key for key in _service_clients if key[0] is loop]:
+        await _service_clients.pop(key).close()
+    for session in _sessions.pop(loop, []):
+        await session.close()
@@ -0,0 +1,188 @@
+"""streamed responses of blobs
+
+Blob bodies are piped to the client chunk by chunk (see ReportStore.open) instead of
+being read into memory, with Content-Length, validators and single range requests:
+
+    return stream_blob(request, get_report_store('rag'), name, filename='story.txt')
+
+daphne serves the app, Django's ASGI handler would collect a sync iterator into a list
+before sending it, so on ASGI the chunks are handed over as an async iterator.
+"""
+import codecs
+import json
+
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags
+
+from core import http_cache
+from core.report_store import BlobNotFound, BlobNotModified, aiter_chunks
+
+
+def parse_range(header, size):
+    """`(start, end)` of a single `bytes=` range, None to send the whole blob
+
+    raise ValueError when the range cannot be satisfied
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None  # multiple ranges are answered with the whole blob
+    start, _, end = header[len('bytes='):].strip().partition('-')
+    try:
+        if not start:  # suffix, the last `end` bytes
+            start, end = max(size - int(end), 0), size - 1
+        else:
+            start, end = int(start), int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise ValueError(f"range {header} not satisfiable for {size} bytes")
+    return start, min(end, size - 1)
+
+
+def streaming_content(request, chunks):
+    """`chunks` in the form the server streams without buffering"""
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        return aiter_chunks(chunks)
+    return chunks
+
+
+def streaming_attachment(request, chunks, size, content_type, filename):
+    response = StreamingHttpResponse(streaming_content(request, chunks), content_type=content_type)
+    if size is not None:
+        response['Content-Length'] = size
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def json_string_chunks(chunks):
+    """stream UTF-8 `chunks` as one JSON string, like Response(text) renders it"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    yield b'"'
+    for chunk in chunks:
+        yield json.dumps(decoder.decode(chunk), ensure_ascii=False)[1:-1].encode('utf-8')
+    yield json.dumps(decoder.decode(b'', final=True), ensure_ascii=False)[1:-1].encode('utf-8') + b'"'
+
+
+def _etag_matches(request_header, properties):
+    """whether a header of etags (If-None-Match, If-Range) names the stored version of the blob"""
+    etags = parse_etags(request_header or '')
+    return bool(properties.etag) and ('*' in etags or properties.etag in etags)
+
+
+def requested_range(request, properties):
+    """the requested range, None for the whole blob, raise ValueError"""
+    if_range = request.headers.get('If-Range')
+    if if_range and not _etag_matches(if_range, properties):
+        return None  # the client copy is outdated, it gets the whole blob
+    return parse_range(request.headers.get('Range'), properties.size)
+
+
+def _not_modified(request, properties):
+    """304 with the validators when the client copy is current, else None"""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        # If-Modified-Since is ignored with If-None-Match
+        if not _etag_matches(if_none_match, properties):
+            return None
+        response = HttpResponseNotModified()
+    else:
+        response = http_cache.not_modified(request, properties.etag, properties.last_modified)
+        if response is None:
+            return None
+    return http_cache.set_validators(response, properties.etag, properties.last_modified)
+
+
+def _check_range(request, properties):
+    """`(response, byte_range)` of a Range request, `response` is a 304 or 416 to send instead"""
+    response = _not_modified(request, properties)
+    if response is not None:
+        return response, None
+    try:
+        return None, requested_range(request, properties)
+    except ValueError:
+        return range_not_satisfiable(properties.size), None
+
+
+def _range_options(byte_range):
+    if not byte_range:
+        return {}
+    start, end = byte_range
+    return {'offset': start, 'length': end - start + 1}
+
+
+def stream_blob(request, store, name, content_type=None, filename=None):
+    """StreamingHttpResponse of `name`, raise BlobNotFound
+
+    `content_type` defaults to the one of the blob, with `filename` the blob is sent as
+    an attachment
+    """
+    byte_range = None
+    if request.headers.get('Range'):
+        # the size is needed to resolve the range before downloading
+        properties = store.get_properties(name)
+        if properties is None:
+            raise BlobNotFound(name)
+        response, byte_range = _check_range(request, properties)
+        if response is not None:
+            return response
+        chunks, properties = store.open(name, **_range_options(byte_range))
+    else:
+        if_none_match = http_cache.if_none_match(request)
+        try:
+            chunks, properties = store.open(name, if_none_match=if_none_match)
+        except BlobNotModified:
+            return http_cache.set_validators(HttpResponseNotModified(), if_none_match)
+        response = _not_modified(request, properties)
+        if response is not None:
+            return response
+
+    return blob_response(streaming_content(request, chunks), properties, byte_range,
+                         content_type=content_type, filename=filename)
+
+
+async def astream_blob(request, store, name, content_type=None, filename=None):
+    """stream_blob of the async views, the chunks are awaited by the ASGI handler"""
+    byte_range = None
+    if request.headers.get('Range'):
+        properties = await store.aget_properties(name)
+        if properties is None:
+            raise BlobNotFound(name)
+        response, byte_range = _check_range(request, properties)
+        if response is not None:
+            return response
+        chunks, properties = await store.aopen(name, **_range_options(byte_range))
+    else:
+        if_none_match = http_cache.if_none_match(request)
+        try:
+            chunks, properties = await store.aopen(name, if_none_match=if_none_match)
+        except BlobNotModified:
+            return http_cache.set_validators(HttpResponseNotModified(), if_none_match)
+        response = _not_modified(request, properties)
+        if response is not None:
+            return response
+
+    return blob_response(chunks, properties, byte_range, content_type=content_type, filename=filename)
+
+
+def range_not_satisfiable(size):
+    response = HttpResponse(status=416)
+    response['Content-Range'] = f'bytes */{size}'
+    return response
+
+
+def blob_response(content, properties, byte_range=None, content_type=None, filename=None):
+    """StreamingHttpResponse of the (async) iterator `content`, `properties.size` is the
+    size of the whole blob
+    """
+    response = StreamingHttpResponse(content, content_type=content_type or properties.content_type)
+    response['Accept-Ranges'] = 'bytes'
+    if byte_range:
+        start, end = byte_range
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {start}-{end}/{properties.size}'
+        response['Content-Length'] = end - start + 1
+    else:
+        response['Content-Length'] = properties.size
+    if filename:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return http_cache.set_validators(response, properties.etag, properties.last_modified)
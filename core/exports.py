@@ -0,0 +1,478 @@
+"""PDF/PPT/DOC exports of portfolios
+
+The converters (PDF_FUNC_DOMAIN, PPT_FUNC_DOMAIN, DOC_FUNC_DOMAIN) take tens of seconds.
+Instead of holding a request worker, an ExportJob is queued and run by a small pool of
+background threads; the client polls the job and downloads the artifact from blob:
+
+    POST /api/core/portfolios/{uuid}/exports/ {"fileType": "PDF"}   -> 202, job
+    GET  /api/core/export-jobs/{uuid}/                                -> status, download_url
+    GET  /api/core/export-jobs/{uuid}/download/                       -> the file
+
+Jobs left over by a restarted process are picked up by `manage.py run_export_jobs`.
+
+Converted artifacts are stored next to their report, named by a fingerprint of the source
+content (etag of the html file or report) and of the template it is rendered with,
+
+    {directory}/exports/{stem}-{fingerprint}.{pdf,pptx,docx}
+
+so an artifact is converted once and reused by every later download. Concurrent requests
+for the same artifact are single-flighted with a lock in the shared cache.
+
+Next to it, `{stem}.{ext}.manifest.json` records the content etag and template uuid the
+last export was produced from. A new export replaces the previous artifact, which stays
+downloadable from its jobs for EXPORT_ARTIFACT_RETENTION seconds (`prune_artifacts`, run by
+`manage.py run_export_jobs`), and saving a report queues the regeneration of its stale
+exports (`prewarm_exports`).
+
+Several exports are downloaded as one ZIP with `bulk_export_chunks`, converted in parallel
+and streamed entry by entry as they complete.
+"""
+import hashlib
+import io
+import json
+import logging
+import posixpath
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import timedelta
+from urllib.parse import quote
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connections, transaction
+from django.db.models import Max
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from core import models, report_documents
+from core.report_store import BlobNotFound, get_report_store
+
+logger = logging.getLogger(__name__)
+
+# file type -> (extension of the artifact, content type, download file name)
+FILE_TYPES = {
+    'PDF': ('.pdf', 'application/pdf', 'report.pdf'),
+    'PPT': ('.pptx', 'application/vnd.openxmlformats-officedocument.presentationml.presentation', 'report.ppt'),
+    'DOC': ('.docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'report.docx'),
+}
+
+
+class ExportError(Exception):
+    pass
+
+
+def is_impact_export(file_type, is_impact_report):
+    # impact reports have their own PDF and DOC, PPT is always built from the html file
+    return is_impact_report and file_type in ('PDF', 'DOC')
+
+
+def _export_stem(portfolio, file_type, is_impact_report):
+    """`(directory, file name without extension)` of the exports of a portfolio"""
+    if is_impact_export(file_type, is_impact_report):
+        return portfolio.report_id, portfolio.report_id
+    directory, html_name = posixpath.split(portfolio.html_file_key)
+    return directory, posixpath.splitext(html_name)[0]
+
+
+def converter_output_name(portfolio, file_type, is_impact_report):
+    """where the converters read and write their files, e.g. the DOC converter reads the PDF"""
+    directory, stem = _export_stem(portfolio, file_type, is_impact_report)
+    return f"{directory}/{stem}{FILE_TYPES[file_type][0]}"
+
+
+def artifact_name(portfolio, file_type, is_impact_report, fingerprint):
+    directory, stem = _export_stem(portfolio, file_type, is_impact_report)
+    return f"{directory}/exports/{stem}-{fingerprint}{FILE_TYPES[file_type][0]}"
+
+
+def report_template(tenant, category, template_category):
+    """the default template of the tenant, the official one of `category` otherwise"""
+    template = models.ReportBaseTemplate.objects.filter(
+        tenant=tenant, is_approved=True, is_default=True, category=template_category).first()
+    if template is None:
+        # NOTE: official template don't use is_approved field, MUST CONTAIN THE CATEGORY
+        template = models.ReportBaseTemplate.objects.get(title__icontains=category, is_official=True, category=template_category)
+    return template
+
+
+def _template_file(template):
+    return template.template_file.url.split('/')[-1]
+
+
+def export_template(portfolio, file_type, is_impact_report, user):
+    """the ReportBaseTemplate an export is rendered with, None for impact reports"""
+    if is_impact_export(file_type, is_impact_report):
+        return None
+    # DOC is converted from the PDF
+    return report_template(user.tenant, portfolio.category, 'PPT' if file_type == 'PPT' else 'PDF')
+
+
+def source_etag(portfolio, file_type, is_impact_report):
+    """etag of the report or html file an export is converted from, raise ExportError"""
+    store = get_report_store('report')
+    if is_impact_export(file_type, is_impact_report):
+        properties = report_documents.get_report_properties(store, portfolio.report_id)
+    else:
+        properties = store.get_properties(portfolio.html_file_key)
+    if properties is None:
+        raise ExportError("The report of the portfolio does not exist")
+    return properties.etag
+
+
+def export_sources(portfolio, file_type, is_impact_report, user):
+    """what an export is produced from: content etag, template uuid and template file"""
+    template = export_template(portfolio, file_type, is_impact_report, user)
+    return {
+        'content_etag': source_etag(portfolio, file_type, is_impact_report),
+        'template': str(template.pk) if template else None,
+        'template_file': template.template_file.name if template else None,
+    }
+
+
+def fingerprint(file_type, sources):
+    """digest of the sources of an export, artifacts are stored under it"""
+    parts = [file_type] + [sources[key] or '' for key in ('content_etag', 'template', 'template_file')]
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def export_fingerprint(portfolio, file_type, is_impact_report, user):
+    return fingerprint(file_type, export_sources(portfolio, file_type, is_impact_report, user))
+
+
+def manifest_name(portfolio, file_type, is_impact_report):
+    directory, stem = _export_stem(portfolio, file_type, is_impact_report)
+    return f"{directory}/exports/{stem}{FILE_TYPES[file_type][0]}.manifest.json"
+
+
+def read_export_manifest(portfolio, file_type, is_impact_report):
+    """the manifest of the last stored export of this type or None"""
+    try:
+        return json.loads(get_report_store('report').get(manifest_name(portfolio, file_type, is_impact_report)))
+    except BlobNotFound:
+        return None
+
+
+def is_stale(manifest, sources):
+    """True when the content or template changed since the export was produced"""
+    return any(manifest.get(key) != value for key, value in sources.items())
+
+
+def _record_export(portfolio, file_type, is_impact_report, name, sources):
+    """write the manifest of a new export, remove the export it replaces unless a job refers to it"""
+    store = get_report_store('report')
+    previous = read_export_manifest(portfolio, file_type, is_impact_report)
+    manifest = dict(sources, artifact=name, file_type=file_type, created_at=timezone.now().isoformat())
+    store.put(manifest_name(portfolio, file_type, is_impact_report), json.dumps(manifest).encode('utf-8'),
+              content_type='application/json')
+    if previous and previous['artifact'] != name:
+        # finished jobs keep their download until prune_artifacts removes it
+        referenced = models.ExportJob.objects.filter(status='done', artifact_name=previous['artifact']).exists()
+        if not referenced:
+            try:
+                store.delete(previous['artifact'])
+            except BlobNotFound:
+                pass
+
+
+def prune_artifacts(retention=None):
+    """delete the replaced artifacts no job finished in the last `retention` seconds
+    (EXPORT_ARTIFACT_RETENTION) refers to, return their number
+
+    the jobs of a deleted artifact lose their download
+    """
+    retention = settings.EXPORT_ARTIFACT_RETENTION if retention is None else retention
+    cutoff = timezone.now() - timedelta(seconds=retention)
+    unused = (models.ExportJob.objects.filter(status='done', artifact_name__isnull=False)
+              .values('portfolio', 'file_type', 'is_impact_report', 'artifact_name')
+              .annotate(last_finished_at=Max('finished_at'))
+              .filter(last_finished_at__lt=cutoff))
+    portfolios = models.Portfolio.objects.in_bulk({row['portfolio'] for row in unused})
+    store = get_report_store('report')
+    deleted = 0
+    for row in unused:
+        portfolio, name = portfolios[row['portfolio']], row['artifact_name']
+        manifest = read_export_manifest(portfolio, row['file_type'], row['is_impact_report'])
+        if manifest and manifest['artifact'] == name:
+            continue  # still the current export
+        try:
+            store.delete(name)
+            deleted += 1
+        except BlobNotFound:
+            pass
+        models.ExportJob.objects.filter(artifact_name=name).update(artifact_name=None)
+    return deleted
+
+
+def converter_url(portfolio, file_type, is_impact_report, user):
+    """url of the converter call; the converters fetch the html from API_DOMAIN
+
+    jobs run without a request, so the impact report PDF no longer uses the host of the
+    request (build_absolute_uri) like the download view did: API_DOMAIN has to be the
+    address the converters reach this API at
+    """
+    if is_impact_export(file_type, is_impact_report):
+        report_id = portfolio.report_id
+        if file_type == 'PDF':
+            report_url = f"{settings.API_DOMAIN}{reverse('fetch-report-as-html')}?report_id={report_id}"
+            return f"{settings.PDF_FUNC_DOMAIN}/api/convert-html-to-pdf?url={report_url}"
+        return f"{settings.DOC_FUNC_DOMAIN}&path_name={report_id}&html_name={report_id}.html"
+
+    html_file_key = portfolio.html_file_key
+    path_name, html_name = html_file_key.split('/')[:2]
+    if file_type == 'PDF':
+        original_url = f"{settings.API_DOMAIN}/api/core/download/{html_file_key}/?show_html=true&category={portfolio.category}&is_portfolio_page=true&user_id={user.id}"
+        escaped_url = quote(original_url, safe='')
+        return f"{settings.PDF_FUNC_DOMAIN}/api/convert-html-to-pdf?url={escaped_url}"
+    elif file_type == 'PPT':
+        template_file = _template_file(export_template(portfolio, file_type, is_impact_report, user))
+        return f"{settings.PPT_FUNC_DOMAIN}&path_name={path_name}&html_name={html_name}&template_file={template_file}"
+    return f"{settings.DOC_FUNC_DOMAIN}&path_name={path_name}&html_name={html_name}"
+
+
+def convert(portfolio, file_type, is_impact_report, user):
+    """call the converter, return its streamed response, raise ExportError"""
+    url = converter_url(portfolio, file_type, is_impact_report, user)
+    try:
+        response = requests.get(url, stream=True, timeout=settings.EXPORT_CONVERTER_TIMEOUT)
+    except requests.RequestException as e:
+        raise ExportError(f"Failed to reach the converter: {e}")
+    if response.status_code != 200:
+        response.close()
+        raise ExportError("Failed to retrieve data from the converter")
+    return response
+
+
+def _build_prerequisites(portfolio, file_type, is_impact_report, user):
+    if file_type == 'DOC':
+        # the DOC converter reads the PDF next to the html file, it has to be the current one
+        store = get_report_store('report')
+        pdf_name = build_artifact(portfolio, 'PDF', is_impact_report, user)
+        store.copy(store, pdf_name, converter_output_name(portfolio, 'PDF', is_impact_report))
+
+
+@contextmanager
+def single_flight(name, file_type):
+    """hold the lock of the conversion of `name`, yield False when it was stored meanwhile
+
+    the lock is an entry of the shared cache, so one conversion per artifact runs across
+    all processes and instances; the others wait for its result. It expires after
+    EXPORT_LOCK_TIMEOUTS[file_type] seconds, a holder only releases its own lock
+    """
+    store = get_report_store('report')
+    key = f"export-lock:{name}"
+    token = uuid.uuid4().hex
+    timeout = settings.EXPORT_LOCK_TIMEOUTS[file_type]
+    deadline = time.monotonic() + timeout
+    while not cache.add(key, token, timeout):
+        if time.monotonic() > deadline:
+            raise ExportError("Timed out waiting for the conversion of the export")
+        time.sleep(settings.EXPORT_LOCK_POLL_INTERVAL)
+        if store.exists(name):
+            yield False
+            return
+    try:
+        # finished by the holder of the lock between our check and the lock
+        yield not store.exists(name)
+    finally:
+        # expired and taken by another conversion otherwise
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+def build_artifact(portfolio, file_type, is_impact_report, user):
+    """make sure the current export is stored in the report store, return its blob name"""
+    store = get_report_store('report')
+    sources = export_sources(portfolio, file_type, is_impact_report, user)
+    name = artifact_name(portfolio, file_type, is_impact_report, fingerprint(file_type, sources))
+    if store.exists(name):
+        return name
+    # outside of the lock, the PDF of a DOC has a conversion and a lock of its own
+    _build_prerequisites(portfolio, file_type, is_impact_report, user)
+    with single_flight(name, file_type) as convert_it:
+        if convert_it:
+            with convert(portfolio, file_type, is_impact_report, user) as response:
+                chunks = response.iter_content(chunk_size=settings.BLOB_STREAM_CHUNK_SIZE)
+                store.put(name, chunks, content_type=FILE_TYPES[file_type][1])
+            _record_export(portfolio, file_type, is_impact_report, name, sources)
+            logger.info(f"stored export {name}")
+    return name
+
+
+def stored_export(portfolio, file_type, is_impact_report, user):
+    """blob name of the current export when it is already stored, else None (never converts)"""
+    name = artifact_name(portfolio, file_type, is_impact_report,
+                         export_fingerprint(portfolio, file_type, is_impact_report, user))
+    return name if get_report_store('report').exists(name) else None
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.EXPORT_WORKERS, thread_name_prefix='export')
+    return _executor
+
+
+def start_export(portfolio, file_type, is_impact_report, user):
+    """create the ExportJob, done at once when the artifact is already stored"""
+    name = stored_export(portfolio, file_type, is_impact_report, user)
+    if name:
+        now = timezone.now()
+        return models.ExportJob.objects.create(
+            portfolio=portfolio, user=user, file_type=file_type, is_impact_report=is_impact_report,
+            status='done', artifact_name=name, started_at=now, finished_at=now,
+        )
+    job = models.ExportJob.objects.create(
+        portfolio=portfolio, user=user, file_type=file_type, is_impact_report=is_impact_report,
+    )
+    transaction.on_commit(lambda: get_executor().submit(run_job, job.pk))
+    return job
+
+
+def export_states(portfolio, is_impact_report, user):
+    """manifest of the last export of every type, with `stale`, None when never exported"""
+    states = {}
+    for file_type in FILE_TYPES:
+        if is_impact_report and not is_impact_export(file_type, is_impact_report):
+            continue  # PPT is built from the html file, impact reports have none
+        manifest = read_export_manifest(portfolio, file_type, is_impact_report)
+        if manifest is not None:
+            manifest['stale'] = is_stale(manifest, export_sources(portfolio, file_type, is_impact_report, user))
+        states[file_type] = manifest
+    return states
+
+
+def prewarm_exports(portfolio, is_impact_report, user):
+    """queue the exports of a portfolio that went stale, e.g. after the report was saved
+
+    only the types exported before are regenerated, at most one job per type is pending
+    """
+    jobs = []
+    for file_type, manifest in export_states(portfolio, is_impact_report, user).items():
+        if not manifest or not manifest['stale']:
+            continue
+        pending = models.ExportJob.objects.filter(
+            portfolio=portfolio, file_type=file_type, is_impact_report=is_impact_report, status='pending')
+        if not pending.exists():
+            jobs.append(start_export(portfolio, file_type, is_impact_report, user))
+    return jobs
+
+
+def run_job(job_id):
+    """claim and run a pending job, return False when another worker has it"""
+    close_old_connections()
+    try:
+        claimed = models.ExportJob.objects.filter(pk=job_id, status='pending').update(
+            status='running', started_at=timezone.now())
+        if not claimed:
+            return False
+        job = models.ExportJob.objects.select_related('portfolio', 'user__tenant').get(pk=job_id)
+        try:
+            name = build_artifact(job.portfolio, job.file_type, job.is_impact_report, job.user)
+        except Exception as e:
+            logger.exception(f"export job {job_id} failed")
+            models.ExportJob.objects.filter(pk=job_id).update(
+                status='failed', error=str(e), finished_at=timezone.now())
+        else:
+            models.ExportJob.objects.filter(pk=job_id).update(
+                status='done', artifact_name=name, finished_at=timezone.now())
+        return True
+    finally:
+        close_old_connections()
+
+
+def requeue_stale_jobs():
+    """running jobs of a process that died are pending again, return their number"""
+    stale_before = timezone.now() - timedelta(seconds=settings.EXPORT_JOB_STALE_AFTER)
+    return models.ExportJob.objects.filter(status='running', started_at__lt=stale_before).update(
+        status='pending', started_at=None)
+
+
+class _ZipSink(io.RawIOBase):
+    """unseekable file ZipFile writes to, the written bytes are taken out with `pop()`"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._buffer += b
+        return len(b)
+
+    def pop(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def zip_entry_names(items):
+    """unique file names of the exports `(portfolio, file_type, is_impact_report)` in the ZIP"""
+    names, seen = [], set()
+    for portfolio, file_type, is_impact_report in items:
+        stem = get_valid_filename(portfolio.title or '') or str(portfolio.pk)
+        extension = FILE_TYPES[file_type][0]
+        name, count = f"{stem}{extension}", 1
+        while name in seen:
+            count += 1
+            name = f"{stem} ({count}){extension}"
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def _build_in_thread(portfolio, file_type, is_impact_report, user):
+    try:
+        return build_artifact(portfolio, file_type, is_impact_report, user)
+    finally:
+        connections.close_all()
+
+
+def bulk_export_chunks(items, user):
+    """ZIP of the exports `(portfolio, file_type, is_impact_report)`, as a stream of bytes
+
+    at most EXPORT_BULK_CONCURRENCY conversions run at once, every export is added as soon
+    as it is available, only one chunk of it is held in memory; failed exports are listed
+    in `errors.txt` at the end (the response has started already)
+    """
+    store = get_report_store('report')
+    sink = _ZipSink()
+    executor = ThreadPoolExecutor(max_workers=settings.EXPORT_BULK_CONCURRENCY, thread_name_prefix='bulk-export')
+    try:
+        futures = {
+            executor.submit(_build_in_thread, portfolio, file_type, is_impact_report, user): entry_name
+            for (portfolio, file_type, is_impact_report), entry_name in zip(items, zip_entry_names(items))
+        }
+        errors = []
+        # documents are compressed already
+        with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for future in as_completed(futures):
+                entry_name = futures[future]
+                try:
+                    chunks, properties = store.open(future.result())
+                except Exception as e:
+                    logger.warning(f"bulk export of {entry_name} failed: {e}")
+                    errors.append(f"{entry_name}: {e}")
+                    continue
+                with archive.open(entry_name, 'w', force_zip64=properties.size > zipfile.ZIP64_LIMIT) as entry:
+                    for chunk in chunks:
+                        entry.write(chunk)
+                        yield sink.pop()
+            if errors:
+                archive.writestr('errors.txt', '\n'.join(errors))
+        yield sink.pop()
+    finally:
+        # the client may go away before the end, pending conversions are dropped
+        executor.shutdown(wait=False, cancel_futures=True)
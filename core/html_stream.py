@@ -0,0 +1,180 @@
+"""single-pass HTML processing without building a DOM
+
+BeautifulSoup used to build the tree of a whole report only to read its first heading.
+These helpers run html.parser over the text, or over blob chunks as they are downloaded,
+exactly once:
+
+    title = find_title(chunks, tags=('h4',))      # stops reading at the end of the heading
+    html = rewrite_html(chunks, replace_img)      # every `<img>` start tag rewritten
+    text = html_to_text(content)                  # text of the markup, e.g. to index it
+
+Markup is echoed as it was read, except for the case and spacing of end tags.
+"""
+import codecs
+import html
+from html.parser import HTMLParser
+
+PIECE_SIZE = 64 * 1024
+
+
+class HTMLProcessor(HTMLParser):
+    """echo the fed HTML with `<img>` start tags passed through `replace_img(tag text)` and
+    record the text of the first heading of `title_tags` in `title`
+    """
+
+    def __init__(self, title_tags=(), replace_img=None, echo=True):
+        super().__init__(convert_charrefs=False)  # entities are echoed as written
+        self.title_tags = title_tags
+        self.replace_img = replace_img
+        self.echo = echo
+        self.title = None
+        self._title_tag = None
+        self._title_parts = None  # text of the heading being read
+        self._output = []
+
+    def feed(self, data):
+        """process `data`, return the output it completes"""
+        super().feed(data)
+        return self.pop()
+
+    def close(self):
+        super().close()
+        if self._title_parts is not None:  # the heading is never closed
+            self.title = ''.join(self._title_parts)
+            self._title_parts = None
+        return self.pop()
+
+    def pop(self):
+        output = ''.join(self._output)
+        self._output.clear()
+        return output
+
+    def _write(self, text):
+        if self.echo:
+            self._output.append(text)
+
+    def _text(self, text):
+        if self._title_parts is not None:
+            self._title_parts.append(text)
+
+    def _start_tag_text(self, tag):
+        text = self.get_starttag_text()
+        if tag == 'img' and self.replace_img:
+            text = self.replace_img(text)
+        return text
+
+    def handle_starttag(self, tag, attrs):
+        self._write(self._start_tag_text(tag))
+        if self.title is None and self._title_parts is None and tag in self.title_tags:
+            self._title_tag, self._title_parts = tag, []
+
+    def handle_startendtag(self, tag, attrs):
+        self._write(self._start_tag_text(tag))
+
+    def handle_endtag(self, tag):
+        self._write(f'</{tag}>')
+        if self._title_parts is not None and tag == self._title_tag:
+            self.title = ''.join(self._title_parts)
+            self._title_parts = None
+
+    def handle_data(self, data):
+        self._write(data)
+        self._text(data)
+
+    def handle_entityref(self, name):
+        self._write(f'&{name};')
+        self._text(html.unescape(f'&{name};'))
+
+    def handle_charref(self, name):
+        self._write(f'&#{name};')
+        self._text(html.unescape(f'&#{name};'))
+
+    def handle_comment(self, data):
+        self._write(f'<!--{data}-->')
+
+    def handle_decl(self, decl):
+        self._write(f'<!{decl}>')
+
+    def handle_pi(self, data):
+        self._write(f'<?{data}>')
+
+    def unknown_decl(self, data):
+        self._write(f'<![{data}]>')
+
+
+class TextExtractor(HTMLParser):
+    """text of the fed HTML, without scripts and styles, blocks separated by newlines"""
+    BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'section', 'article', 'table'}
+    SKIPPED_TAGS = {'script', 'style'}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skipped = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self._skipped += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS:
+            self._skipped = max(self._skipped - 1, 0)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skipped:
+            self.parts.append(data)
+
+
+def iter_text(content):
+    """pieces of `content`, a str, UTF-8 bytes or an iterable of UTF-8 byte chunks"""
+    if isinstance(content, str):
+        for start in range(0, len(content), PIECE_SIZE):
+            yield content[start:start + PIECE_SIZE]
+        return
+    if isinstance(content, bytes):
+        content = [content]
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in content:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+def find_title(content, tags=('h1',)):
+    """text of the first heading of `tags` in `content` or None
+
+    `content` is read only up to the end of the heading, an iterator of chunks is closed
+    """
+    processor = HTMLProcessor(title_tags=tags, echo=False)
+    try:
+        for piece in iter_text(content):
+            processor.feed(piece)
+            if processor.title is not None:
+                return processor.title
+        processor.close()
+        return processor.title
+    finally:
+        close = getattr(content, 'close', None)
+        if close:
+            close()
+
+
+def rewrite_html(content, replace_img):
+    """`content` as str, with every `<img>` start tag passed through `replace_img(tag text)`"""
+    processor = HTMLProcessor(replace_img=replace_img)
+    output = [processor.feed(piece) for piece in iter_text(content)]
+    output.append(processor.close())
+    return ''.join(output)
+
+
+def html_to_text(content):
+    """text of `content` (see iter_text), whitespace collapsed within lines"""
+    extractor = TextExtractor()
+    for piece in iter_text(content):
+        extractor.feed(piece)
+    extractor.close()
+    lines = (' '.join(line.split()) for line in ''.join(extractor.parts).splitlines())
+    return '\n'.join(line for line in lines if line)
@@ -0,0 +1,47 @@
+"""HTTP validators (ETag / Last-Modified) of responses built from blobs
+
+The etag and last-modified of a blob come with its properties, a view answers a
+conditional request after a properties call only:
+
+    properties = store.get_properties(name)
+    response = not_modified(request, properties.etag, properties.last_modified)
+    if response is None:
+        response = HttpResponse(store.get(name))
+    return set_validators(response, properties.etag, properties.last_modified)
+"""
+import hashlib
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_etags
+
+
+def derived_etag(etag, *variant):
+    """etag of a response that depends on the blob `etag` and on `variant`, e.g. query params"""
+    if not variant:
+        return etag
+    value = '|'.join(str(part) for part in (etag, *variant))
+    return f'"{hashlib.md5(value.encode("utf-8")).hexdigest()}"'
+
+
+def if_none_match(request):
+    """the single etag of If-None-Match, passed on to conditional blob downloads"""
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    return etags[0] if len(etags) == 1 and etags[0] != '*' else None
+
+
+def not_modified(request, etag, last_modified=None):
+    """return a 304 (or 412) response when the client copy is current, else None"""
+    last_modified = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def set_validators(response, etag, last_modified=None):
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, **settings.BLOB_RESPONSE_CACHE_CONTROL)
+    # the same URL returns tenant specific data depending on the JWT
+    patch_vary_headers(response, ('Authorization',))
+    return response
@@ -0,0 +1,138 @@
+"""report images served in their real format and as width-bounded / WebP variants
+
+    return image_response(request, 'report', image_key)             # original
+    /fetch-image-report/?image_key=...&w=320                          # variant
+
+The source image is kept in the local blob cache. A variant is generated once per source
+etag with Pillow and stored in the IMAGE_VARIANT_STORE store, away from the source
+container (the rag and chat_bot containers are read by other services),
+
+    image-variants/{source store alias}/{source name}/{digest of the source etag}-w{width}.{ext}
+
+so other instances download it instead of resizing again, and it is never stale: a new
+upload has a new etag and thus new variant names. Widths are snapped to
+`IMAGE_VARIANT_WIDTHS` to bound the number of variants per image.
+"""
+import hashlib
+import io
+import logging
+import posixpath
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from core.blob_cache import get_blob_cache
+from core.blob_responses import stream_blob
+from core.report_store import BlobNotFound, get_report_store
+
+logger = logging.getLogger(__name__)
+
+# formats variants are written in, `(extension, content type)`
+FORMATS = {
+    'JPEG': ('jpg', 'image/jpeg'),
+    'PNG': ('png', 'image/png'),
+    'GIF': ('gif', 'image/gif'),
+    'WEBP': ('webp', 'image/webp'),
+}
+
+
+def cache_key(alias, name):
+    """name of the local copy of `name` of the store `alias` in the blob cache"""
+    return f"{alias}/{name}"
+
+
+def sniff_image(path):
+    """`(format, width, animated)` of the image at `path` (reads the header only) or None"""
+    try:
+        with Image.open(path) as image:
+            return image.format, image.width, getattr(image, 'is_animated', False)
+    except (UnidentifiedImageError, OSError):
+        return None
+
+
+def parse_width(value):
+    """`w` snapped up to the next configured width, raise ValueError"""
+    if not value:
+        return None
+    width = int(value)
+    if width <= 0:
+        raise ValueError("w must be positive")
+    widths = sorted(settings.IMAGE_VARIANT_WIDTHS)
+    return next((allowed for allowed in widths if allowed >= width), widths[-1])
+
+
+def accepts_webp(request):
+    return settings.IMAGE_VARIANT_WEBP and 'image/webp' in request.headers.get('Accept', '')
+
+
+def variant_name(alias, name, etag, width, image_format):
+    digest = hashlib.md5((etag or '').encode('utf-8')).hexdigest()[:16]
+    return f"image-variants/{alias}/{name}/{digest}-w{width or 0}.{FORMATS[image_format][0]}"
+
+
+def needs_variant(sniffed, width, image_format):
+    source_format, source_width, animated = sniffed
+    if animated or source_format not in FORMATS:
+        return False
+    return image_format != source_format or (width is not None and source_width > width)
+
+
+def render_variant(path, width, image_format):
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        if width and image.width > width:
+            image.thumbnail((width, image.height * width // image.width + 1), Image.Resampling.LANCZOS)
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif image_format == 'WEBP' and image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        output = io.BytesIO()
+        image.save(output, format=image_format, quality=settings.IMAGE_VARIANT_QUALITY, optimize=True)
+        return output.getvalue()
+
+
+def _variant_filename(filename, image_format):
+    if not filename:
+        return None
+    return f"{posixpath.splitext(filename)[0]}.{FORMATS[image_format][0]}"
+
+
+def image_response(request, alias, name, filename=None):
+    """stream the image `name` of the store `alias`, the variant asked by `w` and Accept
+
+    raise BlobNotFound, ValueError for an invalid `w`
+    """
+    width = parse_width(request.GET.get('w'))
+    store = get_report_store(alias)
+    cache = get_blob_cache()
+    key = cache_key(alias, name)
+    cache.fetch(store, name, key=key)
+
+    sniffed = sniff_image(cache.path(key))
+    image_format = 'WEBP' if accepts_webp(request) else sniffed and sniffed[0]
+    if sniffed and needs_variant(sniffed, width, image_format):
+        response = _variant_response(request, alias, cache, name, key, width, image_format, filename)
+    else:
+        # the real type of the image, None (type of the blob) for what Pillow cannot read, e.g. SVG
+        content_type = Image.MIME.get(sniffed[0]) if sniffed else None
+        response = stream_blob(request, cache, key, content_type=content_type, filename=filename)
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def _variant_response(request, alias, cache, name, key, width, image_format, filename):
+    source = cache.get_properties(key)
+    variant = variant_name(alias, name, source.etag, width, image_format)
+    variant_store = get_report_store(settings.IMAGE_VARIANT_STORE)
+    variant_key = cache_key(settings.IMAGE_VARIANT_STORE, variant)
+    content_type = FORMATS[image_format][1]
+    try:
+        cache.fetch(variant_store, variant, key=variant_key)
+    except BlobNotFound:
+        data = render_variant(cache.path(key), width, image_format)
+        blob = variant_store.put(variant, data, content_type=content_type)
+        cache.put(variant_key, data, content_type=content_type, etag=blob.etag)
+        logger.info(f"created image variant {variant} ({len(data)} bytes)")
+    return stream_blob(request, cache, variant_key, content_type=content_type,
+                       filename=_variant_filename(filename, image_format))
@@ -0,0 +1,166 @@
+"""compare sync and async report views against a local fake blob server
+
+    python manage.py benchmark_blob_io --latency 0.05 --concurrency 1 10 50 200
+
+Under daphne, sync views run through `sync_to_async(thread_sensitive=True)`, i.e. one
+blocking thread per process; `--sync-workers` simulates that pool.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+
+ACCOUNT_NAME = 'devstoreaccount1'
+# well-known key of the Azure storage emulator, the fake server does not check signatures
+ACCOUNT_KEY = 'Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=='
+CONTAINER_NAME = 'benchmark'
+
+
+class FakeBlobHandler(BaseHTTPRequestHandler):
+    """serves GET/HEAD of blobs from `server.blobs` after `server.latency` seconds"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _blob(self):
+        path = self.path.split('?')[0]
+        prefix = f'/{ACCOUNT_NAME}/{CONTAINER_NAME}/'
+        if not path.startswith(prefix):
+            return None
+        return self.server.blobs.get(path[len(prefix):])
+
+    def _send_headers(self, status, length, extra=None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('ETag', '"0x8DC0000000000"')
+        self.send_header('Last-Modified', formatdate(usegmt=True))
+        self.send_header('x-ms-blob-type', 'BlockBlob')
+        self.send_header('x-ms-version', '2023-11-03')
+        for name, value in (extra or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def do_HEAD(self):
+        time.sleep(self.server.latency)
+        blob = self._blob()
+        if blob is None:
+            self._send_headers(404, 0)
+            return
+        self._send_headers(200, len(blob))
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        blob = self._blob()
+        if blob is None:
+            body = b'<?xml version="1.0" encoding="utf-8"?><Error><Code>BlobNotFound</Code></Error>'
+            self._send_headers(404, len(body), {'x-ms-error-code': 'BlobNotFound'})
+            self.wfile.write(body)
+            return
+        byte_range = self.headers.get('x-ms-range') or self.headers.get('Range')
+        if byte_range:
+            start, end = byte_range.split('=')[1].split('-')
+            start, end = int(start), min(int(end), len(blob) - 1)
+            body = blob[start:end + 1]
+            self._send_headers(206, len(body), {'Content-Range': f'bytes {start}-{end}/{len(blob)}'})
+        else:
+            body = blob
+            self._send_headers(200, len(body))
+        self.wfile.write(body)
+
+
+def start_fake_blob_server(blobs, latency):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBlobHandler)
+    server.daemon_threads = True
+    server.blobs = blobs
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection_string = (
+        f"DefaultEndpointsProtocol=http;AccountName={ACCOUNT_NAME};AccountKey={ACCOUNT_KEY};"
+        f"BlobEndpoint=http://127.0.0.1:{server.server_port}/{ACCOUNT_NAME};"
+    )
+    return server, connection_string
+
+
+class Command(BaseCommand):
+    help = 'Benchmark FetchReportAsHtmlView against AsyncFetchReportAsHtmlView on a local fake blob server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every blob request')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 200])
+        parser.add_argument('--requests', type=int, default=200, help='requests per concurrency level')
+        parser.add_argument('--sync-workers', type=int, default=1, help='threads serving the sync view')
+        parser.add_argument('--report-size', type=int, default=20_000, help='bytes of report_content')
+
+    def handle(self, *args, **options):
+        from core import views_editor, views_async, blob_clients_aio, report_documents
+        from core.report_store import InMemoryReportStore
+
+        report_id = 'benchmark'
+        report = {
+            'report_content': '<h1>Benchmark</h1>' + 'x' * options['report_size'],
+            'report_citations': [],
+            'research_chunks': [],
+        }
+        staging = InMemoryReportStore()
+        report_documents.write_report(staging, report_id, report, metadata={'Report_ID': report_id})
+        blobs = {blob.name: staging.get(blob.name) for blob in staging.list('', page_size=1000)[0]}
+        server, connection_string = start_fake_blob_server(blobs, options['latency'])
+        factory = RequestFactory()
+        sync_view = views_editor.FetchReportAsHtmlView.as_view()
+        async_view = views_async.AsyncFetchReportAsHtmlView.as_view()
+        url = f'/api/core/fetch-report-as-html/?report_id={report_id}'
+
+        def run_sync(concurrency, total):
+            def call(_):
+                return sync_view(factory.get(url)).status_code
+            with ThreadPoolExecutor(max_workers=min(concurrency, options['sync_workers'])) as executor:
+                return list(executor.map(call, range(total)))
+
+        async def run_async(concurrency, total):
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def call():
+                async with semaphore:
+                    response = await async_view(factory.get(url))
+                    return response.status_code
+            return await asyncio.gather(*(call() for _ in range(total)))
+
+        try:
+            report_stores = {
+                'report': {
+                    'BACKEND': 'core.report_store.AzureReportStore',
+                    'OPTIONS': {'container_setting': 'AZURE_STORAGE_REPORT_CONTAINER_NAME'},
+                },
+            }
+            with override_settings(AZURE_STORAGE_CONNECTION_STRING=connection_string,
+                                   AZURE_STORAGE_REPORT_CONTAINER_NAME=CONTAINER_NAME,
+                                   REPORT_STORES=report_stores):
+                self.stdout.write(f"latency={options['latency']}s requests={options['requests']} "
+                                  f"sync_workers={options['sync_workers']}")
+                self.stdout.write(f"{'concurrency':>12} {'sync req/s':>12} {'async req/s':>12} {'speedup':>8}")
+                loop = asyncio.new_event_loop()
+                for concurrency in options['concurrency']:
+                    total = options['requests']
+                    started = time.perf_counter()
+                    statuses = run_sync(concurrency, total)
+                    sync_rate = total / (time.perf_counter() - started)
+                    assert set(statuses) == {200}, statuses
+
+                    started = time.perf_counter()
+                    statuses = loop.run_until_complete(run_async(concurrency, total))
+                    async_rate = total / (time.perf_counter() - started)
+                    assert set(statuses) == {200}, statuses
+
+                    self.stdout.write(f"{concurrency:>12} {sync_rate:>12.1f} {async_rate:>12.1f} "
+                                      f"{async_rate / sync_rate:>7.1f}x")
+                loop.run_until_complete(blob_clients_aio.close_all())
+                loop.close()
+        finally:
+            server.shutdown()
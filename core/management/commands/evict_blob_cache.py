@@ -0,0 +1,25 @@
+"""trim the local blob cache to its byte budget
+
+    python manage.py evict_blob_cache [--max-bytes 0]
+
+Files written before the cache had a budget have no properties and are removed first.
+"""
+from django.core.management.base import BaseCommand
+
+from core.blob_cache import get_blob_cache
+
+
+class Command(BaseCommand):
+    help = 'Remove least recently used entries of the local blob cache until it fits BLOB_CACHE_MAX_BYTES'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-bytes', type=int, help='budget to trim to, 0 empties the cache')
+
+    def handle(self, *args, **options):
+        cache = get_blob_cache()
+        if options['max_bytes'] is not None:
+            cache.max_bytes = options['max_bytes']
+            cache.low_watermark = 1
+        evicted = cache.evict()
+        stats = cache.stats()
+        self.stdout.write(f"evicted {evicted} entries, {stats['size']} of {stats['max_bytes']} bytes used")
@@ -0,0 +1,68 @@
+"""rebuild the full-text search documents from the report and story blobs
+
+    python manage.py rebuild_search_index [--tenant UUID] [--kind report|story]
+
+Reports are read from the report index (run reindex_reports first), stories are listed from
+the storyRoom prefix of every tenant. Documents of deleted blobs are removed.
+"""
+from django.core.management.base import BaseCommand
+
+from core import models, report_documents, search
+from core.report_store import BlobNotFound, get_report_store
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of reports and stories'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenant', help='uuid of the only tenant to reindex')
+        parser.add_argument('--kind', choices=search.KINDS, help='only reindex this kind of document')
+
+    def handle(self, *args, **options):
+        tenants = models.Tenant.objects.all()
+        if options['tenant']:
+            tenants = tenants.filter(uuid=options['tenant'])
+        kinds = [options['kind']] if options['kind'] else search.KINDS
+
+        for tenant in tenants:
+            if 'report' in kinds:
+                self.stdout.write(f"{tenant.name}: {self.index_reports(tenant)} reports")
+            if 'story' in kinds:
+                self.stdout.write(f"{tenant.name}: {self.index_stories(tenant)} stories")
+
+    def index_reports(self, tenant):
+        store = get_report_store('report')
+        indexed = set()
+        for entry in models.ReportIndex.objects.filter(tenant=tenant).iterator():
+            try:
+                content = report_documents.read_report(store, entry.report_id, parts=('content',))
+            except BlobNotFound:
+                continue
+            search.index_report(tenant, entry.report_id, entry.title, content['report_content'])
+            indexed.add(entry.report_id)
+        self.prune(tenant, 'report', indexed)
+        return len(indexed)
+
+    def index_stories(self, tenant):
+        store = get_report_store('rag')
+        indexed = set()
+        continuation_token = None
+        while True:
+            blobs, continuation_token = store.list(f"{tenant.uuid}/storyRoom/", page_size=1000,
+                                                   continuation_token=continuation_token)
+            for blob in blobs:
+                text = store.get(blob.name).decode('utf-8')
+                story = text.split('Story: ', 1)[-1].strip()  # text written by StoryRoomUpload
+                metadata = blob.metadata or {}
+                title = f"{metadata.get('Created_By_Display_Name')} - {metadata.get('Category')}"
+                search.index_story(tenant, blob.name, title, story)
+                indexed.add(blob.name)
+            if not continuation_token:
+                break
+        self.prune(tenant, 'story', indexed)
+        return len(indexed)
+
+    def prune(self, tenant, kind, indexed):
+        documents = models.SearchDocument.objects.filter(tenant=tenant, kind=kind)
+        for key in set(documents.values_list('key', flat=True)) - indexed:
+            search.remove_document(kind, key)
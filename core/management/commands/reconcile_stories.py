@@ -0,0 +1,47 @@
+"""rebuild the StorySubmission catalogue from the story room blobs of the RAG container
+
+    python manage.py reconcile_stories [--tenant UUID] [--prune]
+
+Stories whose etag changed or that are missing from the table are recorded, with `--prune`
+rows of stories that are no longer in blob are removed.
+"""
+from django.core.management.base import BaseCommand
+
+from core import models, story_index
+from core.report_store import get_report_store
+
+
+class Command(BaseCommand):
+    help = 'Reconcile the story catalogue with the story room blobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenant', help='uuid of the only tenant to reconcile')
+        parser.add_argument('--prune', action='store_true', help='remove rows of deleted stories')
+
+    def handle(self, *args, **options):
+        store = get_report_store('rag')
+        tenants = models.Tenant.objects.all()
+        if options['tenant']:
+            tenants = tenants.filter(uuid=options['tenant'])
+
+        for tenant in tenants:
+            etags = dict(models.StorySubmission.objects.filter(tenant=tenant).values_list('blob_name', 'etag'))
+            seen, recorded = set(), 0
+            continuation_token = None
+            while True:
+                blobs, continuation_token = store.list(story_index.story_prefix(tenant), page_size=1000,
+                                                       continuation_token=continuation_token)
+                for blob in blobs:
+                    seen.add(blob.name)
+                    if etags.get(blob.name) != blob.etag:
+                        story_index.record_story(blob, tenant)  # listings include the metadata
+                        recorded += 1
+                if not continuation_token:
+                    break
+
+            pruned = 0
+            if options['prune']:
+                for blob_name in set(etags) - seen:
+                    story_index.remove_story(blob_name)
+                    pruned += 1
+            self.stdout.write(f"{tenant.name}: {len(seen)} stories, {recorded} recorded, {pruned} pruned")
@@ -0,0 +1,54 @@
+"""backfill and reconcile the ReportIndex table with the report documents in blob
+
+    python manage.py reindex_reports [--tenant UUID] [--prune]
+
+Reports whose etag changed or that are missing from the index are synced, with `--prune`
+index rows of reports that are no longer in blob are removed. The report generations
+replaced more than REPORT_GENERATION_GRACE seconds ago are deleted (report_documents.prune_report).
+"""
+from django.core.management.base import BaseCommand
+
+from core import models, report_documents, report_index
+from core.report_store import get_report_store
+
+
+class Command(BaseCommand):
+    help = 'Backfill and reconcile the report index from the report container'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenant', help='uuid of the only tenant to reindex')
+        parser.add_argument('--prune', action='store_true', help='remove index rows of deleted reports')
+
+    def handle(self, *args, **options):
+        store = get_report_store('report')
+        tenants = models.Tenant.objects.all()
+        if options['tenant']:
+            tenants = tenants.filter(uuid=options['tenant'])
+
+        for tenant in tenants:
+            etags = dict(models.ReportIndex.objects.filter(tenant=tenant).values_list('report_id', 'etag'))
+            seen, synced, deleted_blobs = set(), 0, 0
+            continuation_token = None
+            while True:
+                blobs, continuation_token = store.list(f"{tenant.uuid}/", page_size=1000,
+                                                       continuation_token=continuation_token)
+                for blob in blobs:
+                    if not report_documents.is_report_document(blob):
+                        continue
+                    report_id = blob.metadata['Report_ID']
+                    seen.add(report_id)
+                    if etags.get(report_id) != blob.etag:
+                        report_index.sync_report(store, report_id, tenant)
+                        synced += 1
+                if not continuation_token:
+                    break
+            for report_id in seen:
+                deleted_blobs += report_documents.prune_report(store, report_id)
+
+            pruned = 0
+            if options['prune']:
+                pruned = len(set(etags) - seen)
+                for report_id in set(etags) - seen:
+                    report_index.remove_report(report_id)
+            self.stdout.write(f"{tenant.name}: {len(seen)} reports, {synced} synced, {pruned} pruned, "
+                              f"{deleted_blobs} replaced blobs deleted")
@@ -0,0 +1,44 @@
+"""run the pending export jobs, e.g. those of a restarted process
+
+    python manage.py run_export_jobs [--loop]
+
+Running jobs older than EXPORT_JOB_STALE_AFTER are requeued first, replaced artifacts past
+EXPORT_ARTIFACT_RETENTION are deleted. With `--loop` the command keeps polling and works as a
+dedicated export worker, sweeping artifacts every EXPORT_PRUNE_INTERVAL seconds.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import exports, models
+
+
+class Command(BaseCommand):
+    help = 'Run pending PDF/PPT/DOC export jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='keep polling for new jobs')
+        parser.add_argument('--interval', type=int, default=5, help='seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        next_prune = time.monotonic()
+        with ThreadPoolExecutor(max_workers=settings.EXPORT_WORKERS) as executor:
+            while True:
+                requeued = exports.requeue_stale_jobs()
+                if requeued:
+                    self.stdout.write(f"requeued {requeued} stale jobs")
+                if time.monotonic() >= next_prune:
+                    pruned = exports.prune_artifacts()
+                    if pruned:
+                        self.stdout.write(f"deleted {pruned} replaced artifacts")
+                    next_prune = time.monotonic() + settings.EXPORT_PRUNE_INTERVAL
+                job_ids = list(models.ExportJob.objects.filter(status='pending')
+                               .order_by('created_at').values_list('pk', flat=True))
+                ran = sum(executor.map(exports.run_job, job_ids))
+                if job_ids:
+                    self.stdout.write(f"ran {ran} of {len(job_ids)} pending jobs")
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
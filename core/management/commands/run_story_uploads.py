@@ -0,0 +1,33 @@
+"""upload the queued story room submissions to the RAG container
+
+    python manage.py run_story_uploads [--loop]
+
+Uploading stories older than STORY_INGEST_STALE_AFTER are requeued first. With `--loop` the
+command keeps polling and works as a dedicated ingestion worker, set
+STORY_INGEST_IN_PROCESS = False to leave the queue to it.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import story_ingestion
+
+
+class Command(BaseCommand):
+    help = 'Upload queued story room submissions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='keep polling for new stories')
+        parser.add_argument('--interval', type=int, default=5, help='seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            requeued = story_ingestion.requeue_stale_uploads()
+            if requeued:
+                self.stdout.write(f"requeued {requeued} stale uploads")
+            claimed = story_ingestion.drain()
+            if claimed:
+                self.stdout.write(f"processed {claimed} stories")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
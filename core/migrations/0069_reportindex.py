@@ -0,0 +1,32 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0068_exportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportIndex',
+            fields=[
+                ('report_id', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(help_text='blob of the manifest or legacy JSON', max_length=512)),
+                ('title', models.CharField(blank=True, max_length=512, null=True)),
+                ('created_by', models.CharField(blank=True, max_length=255, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('last_modified', models.DateTimeField()),
+                ('size', models.BigIntegerField(default=0, help_text='bytes of the report parts in blob')),
+                ('etag', models.CharField(blank=True, max_length=128, null=True)),
+                ('tenant', models.ForeignKey(db_column='tenant_uuid', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reports', to='core.tenant')),
+            ],
+            options={
+                'verbose_name_plural': 'Report index',
+                'indexes': [models.Index(fields=['tenant', 'created_at', 'report_id'], name='core_report_tenant__6cd44e_idx'), models.Index(fields=['tenant', 'last_modified', 'report_id'], name='core_report_tenant__aa8ebd_idx')],
+            },
+        ),
+    ]
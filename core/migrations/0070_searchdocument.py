@@ -0,0 +1,94 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# the text search configuration is fixed in the generated column, core/search.py queries with the same one
+POSTGRESQL_FORWARD = [
+    """
+    ALTER TABLE core_searchdocument ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english'::regconfig, coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english'::regconfig, coalesce(body, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX core_searchdocument_search_vector ON core_searchdocument USING GIN (search_vector)",
+]
+POSTGRESQL_REVERSE = [
+    "DROP INDEX IF EXISTS core_searchdocument_search_vector",
+    "ALTER TABLE core_searchdocument DROP COLUMN IF EXISTS search_vector",
+]
+
+# external content FTS5 table, the rows stay in core_searchdocument
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE core_searchdocument_fts USING fts5(
+        title, body, content='core_searchdocument', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER core_searchdocument_fts_insert AFTER INSERT ON core_searchdocument BEGIN
+        INSERT INTO core_searchdocument_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER core_searchdocument_fts_delete AFTER DELETE ON core_searchdocument BEGIN
+        INSERT INTO core_searchdocument_fts(core_searchdocument_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER core_searchdocument_fts_update AFTER UPDATE ON core_searchdocument BEGIN
+        INSERT INTO core_searchdocument_fts(core_searchdocument_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO core_searchdocument_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    """,
+]
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS core_searchdocument_fts_insert",
+    "DROP TRIGGER IF EXISTS core_searchdocument_fts_delete",
+    "DROP TRIGGER IF EXISTS core_searchdocument_fts_update",
+    "DROP TABLE IF EXISTS core_searchdocument_fts",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, ()):
+            schema_editor.execute(sql)
+    return run
+
+
+create_full_text_index = _run({'postgresql': POSTGRESQL_FORWARD, 'sqlite': SQLITE_FORWARD})
+drop_full_text_index = _run({'postgresql': POSTGRESQL_REVERSE, 'sqlite': SQLITE_REVERSE})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0069_reportindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('report', 'Report'), ('story', 'Story')], max_length=16)),
+                ('key', models.CharField(help_text='report_id or blob name of the story', max_length=512)),
+                ('title', models.CharField(blank=True, default='', max_length=512)),
+                ('body', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('tenant', models.ForeignKey(db_column='tenant_uuid', on_delete=django.db.models.deletion.CASCADE, related_name='search_documents', to='core.tenant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tenant', 'kind'], name='core_search_tenant__a8d91b_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='searchdocument',
+            constraint=models.UniqueConstraint(fields=('kind', 'key'), name='unique_search_document'),
+        ),
+        migrations.RunPython(create_full_text_index, drop_full_text_index),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0070_searchdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorySubmission',
+            fields=[
+                ('blob_name', models.CharField(max_length=512, primary_key=True, serialize=False)),
+                ('category', models.CharField(blank=True, max_length=255, null=True)),
+                ('created_by', models.CharField(blank=True, help_text='display name of the author', max_length=255, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('summary', models.CharField(blank=True, max_length=255, null=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('etag', models.CharField(blank=True, max_length=128, null=True)),
+                ('tenant', models.ForeignKey(db_column='tenant_uuid', on_delete=django.db.models.deletion.CASCADE, related_name='stories', to='core.tenant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tenant', 'created_at', 'blob_name'], name='core_storys_tenant__56fc99_idx'), models.Index(fields=['tenant', 'category', 'created_at', 'blob_name'], name='core_storys_tenant__8e793e_idx')],
+            },
+        ),
+    ]
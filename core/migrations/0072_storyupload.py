@@ -0,0 +1,37 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:31
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0071_storysubmission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoryUpload',
+            fields=[
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('blob_name', models.CharField(max_length=512)),
+                ('name', models.CharField(max_length=255)),
+                ('category', models.CharField(max_length=255)),
+                ('story', models.TextField()),
+                ('submitted_at', models.DateTimeField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('uploading', 'Uploading'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claimed_by', models.UUIDField(blank=True, help_text='batch of the worker uploading the story', null=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('tenant', models.ForeignKey(db_column='tenant_uuid', on_delete=django.db.models.deletion.CASCADE, related_name='story_uploads', to='core.tenant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='core_storyu_status_b133af_idx'), models.Index(fields=['claimed_by'], name='core_storyu_claimed_859206_idx')],
+            },
+        ),
+    ]
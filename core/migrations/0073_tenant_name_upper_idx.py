@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:33
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0072_storyupload'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tenant',
+            index=models.Index(django.db.models.functions.text.Upper('name'), name='core_tenant_name_upper_idx'),
+        ),
+    ]
@@ -3,7 +3,9 @@ import logging
 import requests
 
 from django.db import models
+from django.db.models.functions import Upper
 from django.conf import settings
+from django.utils import timezone
 
 PORTFOLIO_CATEGORIES = (
     ('impactReport', 'Impact Report'),
@@ -21,6 +23,25 @@ REPORT_BASE_TEMPLATE_CATEGORY = (
     ('PPT', 'PPT'),
 )
 
+EXPORT_FILE_TYPES = (
+    ('PDF', 'PDF'),
+    ('PPT', 'PPT'),
+    ('DOC', 'DOC'),
+)
+
+EXPORT_JOB_STATUSES = (
+    ('pending', 'Pending'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+)
+
+STORY_UPLOAD_STATUSES = (
+    ('pending', 'Pending'),
+    ('uploading', 'Uploading'),
+    ('failed', 'Failed'),
+)
+
 logger = logging.getLogger(__name__)
 
 
@@ -42,6 +63,12 @@ class Tenant(models.Model):
     ai_search_service_name = models.CharField(max_length=128, null=True, blank=True)
     ai_search_index_name = models.CharField(max_length=128, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # name__iexact of StoryRoomVerify, PostgreSQL compares UPPER(name)
+            models.Index(Upper("name"), name="core_tenant_name_upper_idx"),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -251,3 +278,134 @@ class ReleaseNote(models.Model):
     description = models.TextField(max_length=768, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+
+class ExportJob(models.Model):
+    """PDF/PPT/DOC export of a portfolio, converted in the background (core/exports.py)"""
+    uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    portfolio = models.ForeignKey("Portfolio", on_delete=models.CASCADE, related_name="export_jobs")
+    user = models.ForeignKey("authentication.User", db_column="user_uuid", to_field='uuid', on_delete=models.CASCADE)
+    file_type = models.CharField(max_length=8, choices=EXPORT_FILE_TYPES)
+    is_impact_report = models.BooleanField(default=False)
+    status = models.CharField(max_length=16, choices=EXPORT_JOB_STATUSES, default='pending')
+    artifact_name = models.CharField(max_length=255, null=True, blank=True, help_text='blob of the finished export')
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.pk} {self.file_type} {self.status}"
+
+
+class ReportIndex(models.Model):
+    """one row per editor report in blob, lists reports without listing the container (core/report_index.py)"""
+    report_id = models.CharField(max_length=255, primary_key=True)
+    tenant = models.ForeignKey("Tenant", db_column="tenant_uuid", on_delete=models.CASCADE, null=True, related_name="reports")
+    file_name = models.CharField(max_length=512, help_text='blob of the manifest or legacy JSON')
+    title = models.CharField(max_length=512, null=True, blank=True)
+    created_by = models.CharField(max_length=255, null=True, blank=True)
+    created_at = models.DateTimeField()
+    last_modified = models.DateTimeField()
+    size = models.BigIntegerField(default=0, help_text='bytes of the report parts in blob')
+    etag = models.CharField(max_length=128, null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = "Report index"
+        indexes = [
+            # keyset pagination, `(value, report_id)` of the last row is the cursor
+            models.Index(fields=["tenant", "created_at", "report_id"]),
+            models.Index(fields=["tenant", "last_modified", "report_id"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.report_id} {self.title}"
+
+
+class StorySubmission(models.Model):
+    """one row per story room submission in the RAG container, lists stories without listing blobs (core/story_index.py)"""
+    blob_name = models.CharField(max_length=512, primary_key=True)
+    tenant = models.ForeignKey("Tenant", db_column="tenant_uuid", on_delete=models.CASCADE, related_name="stories")
+    category = models.CharField(max_length=255, null=True, blank=True)
+    created_by = models.CharField(max_length=255, null=True, blank=True, help_text='display name of the author')
+    created_at = models.DateTimeField()
+    summary = models.CharField(max_length=255, null=True, blank=True)
+    size = models.BigIntegerField(default=0)
+    etag = models.CharField(max_length=128, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # keyset pagination, `(created_at, blob_name)` of the last row is the cursor
+            models.Index(fields=["tenant", "created_at", "blob_name"]),
+            models.Index(fields=["tenant", "category", "created_at", "blob_name"]),
+        ]
+
+    def __str__(self) -> str:
+        return self.blob_name
+
+
+class StoryUpload(models.Model):
+    """story room submission waiting for its upload to the RAG container (core/story_ingestion.py)
+
+    the row is deleted once the blob is written, failed rows stay for inspection
+    """
+    uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    tenant = models.ForeignKey("Tenant", db_column="tenant_uuid", on_delete=models.CASCADE, related_name="story_uploads")
+    blob_name = models.CharField(max_length=512)
+    name = models.CharField(max_length=255)
+    category = models.CharField(max_length=255)
+    story = models.TextField()
+    submitted_at = models.DateTimeField()
+    status = models.CharField(max_length=16, choices=STORY_UPLOAD_STATUSES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.UUIDField(null=True, blank=True, help_text='batch of the worker uploading the story')
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+            models.Index(fields=["claimed_by"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.blob_name} {self.status}"
+
+
+SEARCH_DOCUMENT_KINDS = (
+    ('report', 'Report'),
+    ('story', 'Story'),
+)
+
+
+class SearchDocument(models.Model):
+    """plain text of a report or story room submission, full-text indexed by the database (core/search.py)
+
+    PostgreSQL adds a generated `search_vector` tsvector column with a GIN index, SQLite an FTS5
+    table kept in sync by triggers, see migration 0070.
+    """
+    tenant = models.ForeignKey("Tenant", db_column="tenant_uuid", on_delete=models.CASCADE, related_name="search_documents")
+    kind = models.CharField(max_length=16, choices=SEARCH_DOCUMENT_KINDS)
+    key = models.CharField(max_length=512, help_text='report_id or blob name of the story')
+    title = models.CharField(max_length=512, blank=True, default='')
+    body = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "key"], name="unique_search_document"),
+        ]
+        indexes = [
+            models.Index(fields=["tenant", "kind"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.kind} {self.key}"
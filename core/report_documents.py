@@ -0,0 +1,262 @@
+"""on-blob layout of an editor report
+
+version 1 (legacy), a single JSON document:
+
+    {report_id}/{report_id}.json    {"report_content", "report_citations", "research_chunks"}
+
+version 2, every part is a separately addressable compressed object, so a reader only
+downloads what it needs (the HTML view only needs the content):
+
+    {report_id}/report/manifest.json              parts, encoding, report metadata
+    {report_id}/report/{generation}/content.json.gz
+    {report_id}/report/{generation}/citations.json.gz
+    {report_id}/report/{generation}/chunks.json.gz
+
+version 3 splits research_chunks into pages of `REPORT_CHUNK_PAGE_SIZE` chunks and keeps
+an index of the pages in the manifest, so paging through chunks downloads only the pages
+that overlap the requested window:
+
+    {report_id}/report/{generation}/chunks/00000.json.gz
+
+The manifest is written last and points to the parts of its generation, readers never
+see a half-written report. Readers fall back to version 1 when there is no manifest.
+A rewrite leaves the previous generation (and the legacy JSON) in place for the readers
+that loaded the old manifest, `prune_report` (run by `manage.py reindex_reports`) deletes
+them REPORT_GENERATION_GRACE seconds later.
+"""
+import datetime
+import gzip
+import json
+import logging
+import uuid
+
+from django.conf import settings
+
+from core.report_store import BlobNotFound
+
+try:
+    import zstandard
+except ImportError:  # optional, gzip is always available
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+VERSION = 3
+
+# part name -> key of the report JSON
+PARTS = {
+    'content': 'report_content',
+    'citations': 'report_citations',
+    'chunks': 'research_chunks',
+}
+
+EXTENSIONS = {
+    'gzip': 'json.gz',
+    'zstd': 'json.zst',
+}
+
+
+def manifest_name(report_id):
+    return f"{report_id}/report/manifest.json"
+
+
+def legacy_name(report_id):
+    return f"{report_id}/{report_id}.json"
+
+
+def get_encoding():
+    encoding = settings.REPORT_DOCUMENT_COMPRESSION
+    if encoding == 'zstd' and zstandard is None:
+        logger.warning("zstandard is not installed, report documents fall back to gzip")
+        return 'gzip'
+    return encoding
+
+
+def encode_part(value, encoding):
+    data = json.dumps(value).encode('utf-8')
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=settings.REPORT_DOCUMENT_COMPRESSION_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=settings.REPORT_DOCUMENT_COMPRESSION_LEVEL)
+
+
+def decode_part(data, encoding):
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read this report")
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    else:
+        data = gzip.decompress(data)
+    return json.loads(data.decode('utf-8'))
+
+
+def parse_manifest(data):
+    return json.loads(data.decode('utf-8'))
+
+
+def _slice(chunks, chunks_offset, chunks_limit):
+    if chunks_limit is None:
+        return chunks[chunks_offset:]
+    return chunks[chunks_offset:chunks_offset + chunks_limit]
+
+
+def parse_legacy(data, parts, chunks_offset=0, chunks_limit=None):
+    content = json.loads(data.decode('utf-8'))
+    result = {PARTS[part]: content[PARTS[part]] for part in parts}
+    if 'chunks' in parts:
+        chunks = content['research_chunks'] or []
+        result['research_chunks'] = _slice(chunks, chunks_offset, chunks_limit)
+        result['research_chunks_total'] = len(chunks)
+    return result
+
+
+def write_report(store, report_id, report, metadata, title=None):
+    """write `report` (dict of report_content, report_citations, research_chunks)
+
+    return the StoredBlob of the manifest
+    """
+    encoding = get_encoding()
+    extension = EXTENSIONS[encoding]
+    generation = uuid.uuid4().hex[:12]
+
+    manifest = {'version': VERSION, 'encoding': encoding, 'generation': generation, 'title': title, 'parts': {}}
+    for part in ('content', 'citations'):
+        name = f"{report_id}/report/{generation}/{part}.{extension}"
+        data = encode_part(report.get(PARTS[part]), encoding)
+        store.put(name, data, content_type='application/octet-stream')
+        manifest['parts'][part] = {'name': name, 'stored_size': len(data)}
+
+    chunks = report.get('research_chunks') or []
+    page_size = settings.REPORT_CHUNK_PAGE_SIZE
+    pages = []
+    for offset in range(0, len(chunks), page_size):
+        name = f"{report_id}/report/{generation}/chunks/{offset // page_size:05d}.{extension}"
+        page = chunks[offset:offset + page_size]
+        data = encode_part(page, encoding)
+        store.put(name, data, content_type='application/octet-stream')
+        pages.append({'name': name, 'offset': offset, 'count': len(page), 'stored_size': len(data)})
+    manifest['chunks'] = {'count': len(chunks), 'page_size': page_size, 'pages': pages}
+
+    # what this manifest replaces is left to prune_report, readers may still follow the old one
+    return store.put(manifest_name(report_id), json.dumps(manifest).encode('utf-8'),
+                     metadata=metadata, content_type='application/json')
+
+
+def prune_report(store, report_id, grace=None):
+    """delete the generations and legacy JSON the manifest replaced, return their number
+
+    nothing is deleted before the manifest is `grace` seconds old (REPORT_GENERATION_GRACE),
+    nor parts younger than that, they may belong to an upload still writing its parts
+    """
+    grace = settings.REPORT_GENERATION_GRACE if grace is None else grace
+    try:
+        data, properties = store.download(manifest_name(report_id))
+    except BlobNotFound:
+        return 0
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=grace)
+    if properties.last_modified and properties.last_modified > cutoff:
+        return 0
+    current = f"{report_id}/report/{parse_manifest(data)['generation']}/"
+
+    stale = [legacy_name(report_id)] if store.exists(legacy_name(report_id)) else []
+    token = None
+    while True:
+        blobs, token = store.list(f"{report_id}/report/", page_size=1000, continuation_token=token)
+        stale.extend(
+            blob.name for blob in blobs
+            if blob.name != manifest_name(report_id) and not blob.name.startswith(current)
+            and not (blob.last_modified and blob.last_modified > cutoff)
+        )
+        if not token:
+            break
+    deleted = 0
+    for name in stale:
+        try:
+            store.delete(name)
+            deleted += 1
+        except BlobNotFound:
+            pass
+    return deleted
+
+
+def read_manifest(store, report_id):
+    """the manifest of a report or None (legacy or missing report)"""
+    try:
+        return parse_manifest(store.get(manifest_name(report_id)))
+    except BlobNotFound:
+        return None
+
+
+def _chunk_pages(manifest, chunks_offset, chunks_limit):
+    end = None if chunks_limit is None else chunks_offset + chunks_limit
+    return [
+        page for page in manifest['chunks']['pages']
+        if page['offset'] + page['count'] > chunks_offset and (end is None or page['offset'] < end)
+    ]
+
+
+def blobs_to_read(manifest, parts, chunks_offset=0, chunks_limit=None):
+    """names of the blobs a reader has to download for `parts` of a manifest"""
+    names = []
+    for part in parts:
+        if part == 'chunks' and 'chunks' in manifest:
+            names.extend(page['name'] for page in _chunk_pages(manifest, chunks_offset, chunks_limit))
+        else:
+            names.append(manifest['parts'][part]['name'])
+    return names
+
+
+def assemble(manifest, parts, contents, chunks_offset=0, chunks_limit=None):
+    """build the result of `read_report` from the downloaded `contents` (blob name -> bytes)"""
+    encoding = manifest['encoding']
+    result = {}
+    for part in parts:
+        if part != 'chunks':
+            result[PARTS[part]] = decode_part(contents[manifest['parts'][part]['name']], encoding)
+        elif 'chunks' in manifest:
+            chunks = []
+            pages = _chunk_pages(manifest, chunks_offset, chunks_limit)
+            for page in pages:
+                chunks.extend(decode_part(contents[page['name']], encoding))
+            first_offset = pages[0]['offset'] if pages else chunks_offset
+            result['research_chunks'] = _slice(chunks, chunks_offset - first_offset, chunks_limit)
+            result['research_chunks_total'] = manifest['chunks']['count']
+        else:  # version 2, a single chunks part
+            chunks = decode_part(contents[manifest['parts']['chunks']['name']], encoding) or []
+            result['research_chunks'] = _slice(chunks, chunks_offset, chunks_limit)
+            result['research_chunks_total'] = len(chunks)
+    if manifest.get('title') is not None:
+        result['report_title'] = manifest['title']
+    return result
+
+
+def read_report(store, report_id, parts=tuple(PARTS), chunks_offset=0, chunks_limit=None):
+    """return a dict with the JSON keys of the requested parts, raise BlobNotFound
+
+    when chunks are requested, only the window `chunks_offset:chunks_offset + chunks_limit`
+    is returned and `research_chunks_total` holds the number of chunks of the report
+    """
+    manifest = read_manifest(store, report_id)
+    if manifest is None:
+        return parse_legacy(store.get(legacy_name(report_id)), parts, chunks_offset, chunks_limit)
+    names = blobs_to_read(manifest, parts, chunks_offset, chunks_limit)
+    contents = {name: store.get(name) for name in names}
+    return assemble(manifest, parts, contents, chunks_offset, chunks_limit)
+
+
+def get_report_properties(store, report_id):
+    """StoredBlob of the manifest (or legacy JSON) or None
+
+    every write replaces the manifest, its etag is the version of the whole report
+    """
+    return store.get_properties(manifest_name(report_id)) or store.get_properties(legacy_name(report_id))
+
+
+def stored_size(manifest):
+    """bytes the parts of a report take in the store"""
+    pages = manifest.get('chunks', {}).get('pages', [])
+    return sum(part.get('stored_size', 0) for part in list(manifest['parts'].values()) + pages)
+
+
+def is_report_document(blob):
+    """True for the blob carrying the report metadata (manifest or legacy JSON), used in listings"""
+    return bool(blob.metadata and blob.metadata.get('Report_ID'))
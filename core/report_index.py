@@ -0,0 +1,134 @@
+"""database index of the editor reports in blob
+
+ReportListView used to list the blobs of the tenant prefix with their metadata, one remote
+call per page and no sorting, filtering or counting. The ReportIndex table mirrors every
+report document instead:
+
+    sync_report(store, report_id, tenant)      # after a write, from UploadReportView
+    remove_report(report_id)                   # after the report is deleted
+    list_reports(tenant, ordering='-created_at', cursor=None, limit=100)
+
+Lists are keyset paginated on `(ordering field, report_id)`, a page is one indexed query
+whatever its depth. `manage.py reindex_reports` backfills and reconciles the table.
+"""
+import base64
+import datetime
+import json
+import logging
+
+from django.db.models import Q
+from django.utils import timezone
+
+from core import models, report_documents
+
+logger = logging.getLogger(__name__)
+
+ORDERINGS = ('created_at', '-created_at', 'last_modified', '-last_modified')
+
+# format of the Created_At / Last_Modified_At metadata of UploadReportView
+METADATA_TIME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+
+
+def _metadata_time(value):
+    try:
+        return timezone.make_aware(datetime.datetime.strptime(value, METADATA_TIME_FORMAT))
+    except (TypeError, ValueError):
+        return None
+
+
+def sync_report(store, report_id, tenant):
+    """make the index row of `report_id` match the store, return it (None once deleted)"""
+    properties = report_documents.get_report_properties(store, report_id)
+    if properties is None:
+        remove_report(report_id)
+        return None
+    metadata = properties.metadata or {}
+    manifest = report_documents.read_manifest(store, report_id)
+    if manifest is not None:
+        title = manifest.get('title') or metadata.get('Report_Title')
+        size = properties.size + report_documents.stored_size(manifest)
+    else:
+        title, size = metadata.get('Report_Title'), properties.size
+    last_modified = properties.last_modified or timezone.now()
+
+    fields = {
+        'tenant': tenant,
+        'file_name': properties.name,
+        'title': title,
+        'created_by': metadata.get('Created_By_User'),
+        'last_modified': last_modified,
+        'size': size,
+        'etag': properties.etag,
+    }
+    entry, _ = models.ReportIndex.objects.update_or_create(
+        report_id=report_id,
+        defaults=fields,
+        # every upload rewrites Created_At, the first one indexed is kept
+        create_defaults=dict(fields, created_at=_metadata_time(metadata.get('Created_At')) or last_modified),
+    )
+    return entry
+
+
+def remove_report(report_id):
+    models.ReportIndex.objects.filter(report_id=report_id).delete()
+
+
+def encode_cursor(value, key):
+    """cursor of the page after the row of datetime `value` and primary key `key`"""
+    return base64.urlsafe_b64encode(json.dumps([value.isoformat(), key]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """`(value, key)` of the last row of the previous page, raise ValueError"""
+    try:
+        value, key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.datetime.fromisoformat(value), key
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"invalid cursor: {e}")
+
+
+def _reports(tenant, search=None, created_by=None):
+    qs = models.ReportIndex.objects.filter(tenant=tenant)
+    if search:
+        qs = qs.filter(title__icontains=search)
+    if created_by:
+        qs = qs.filter(created_by=created_by)
+    return qs
+
+
+def list_reports(tenant, ordering='-created_at', cursor=None, limit=100, search=None, created_by=None):
+    """`(entries, next cursor)` of one page of the reports of `tenant`, raise ValueError"""
+    if ordering not in ORDERINGS:
+        raise ValueError(f"ordering must be one of {', '.join(ORDERINGS)}")
+    field = ordering.lstrip('-')
+    descending = ordering.startswith('-')
+
+    qs = _reports(tenant, search, created_by)
+    if cursor:
+        value, report_id = decode_cursor(cursor)
+        lookup = 'lt' if descending else 'gt'
+        qs = qs.filter(Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'report_id__{lookup}': report_id}))
+    direction = '-' if descending else ''
+    entries = list(qs.order_by(f'{direction}{field}', f'{direction}report_id')[:limit + 1])
+    if len(entries) > limit:
+        entries = entries[:limit]
+        return entries, encode_cursor(getattr(entries[-1], field), entries[-1].report_id)
+    return entries, None
+
+
+def count_reports(tenant, search=None, created_by=None):
+    return _reports(tenant, search, created_by).count()
+
+
+def serialize_entry(entry):
+    """same fields as the blob listing ReportListView used to return"""
+    return {
+        'file_name': entry.file_name,
+        'etag': entry.etag,
+        'report_id': entry.report_id,
+        'report_title': entry.title,
+        'created_at': timezone.localtime(entry.created_at).strftime(METADATA_TIME_FORMAT),
+        'last_modified_at': timezone.localtime(entry.last_modified).strftime(METADATA_TIME_FORMAT),
+        'created_by': entry.created_by,
+        'size': entry.size,
+    }
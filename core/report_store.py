@@ -0,0 +1,549 @@
+"""blob persistence of reports, chat bot files and stories
+
+Views never talk to a storage SDK directly, they ask for a store by alias:
+
+    store = get_report_store('report')
+    store.put(f"{report_id}/{report_id}.json", data, metadata=metadata)
+
+The backend of every alias is configured in `settings.REPORT_STORES` (same shape as
+`STORAGES`). `AzureReportStore` is used in production, `LocalReportStore` and
+`InMemoryReportStore` run the whole report pipeline offline, e.g. in tests and
+benchmarks, optionally with injected latency to mimic Azure round-trips.
+
+The async views use the `a`-prefixed methods (aget, aget_properties, aopen). Azure awaits
+azure.storage.blob.aio, the offline stores run their sync methods in a thread.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError, ResourceNotModifiedError
+from azure.storage.blob import ContentSettings
+
+from core import blob_clients
+from core import blob_clients_aio
+
+logger = logging.getLogger(__name__)
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+class BlobNotModified(Exception):
+    """raised by conditional downloads when the blob still has the given etag"""
+    pass
+
+
+async def aiter_chunks(chunks):
+    """async iterator over the sync iterator `chunks`, each chunk is read in a thread"""
+    iterator = iter(chunks)
+    next_chunk = sync_to_async(next, thread_sensitive=False)
+    try:
+        while True:
+            chunk = await next_chunk(iterator, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close:
+            close()
+
+
+@dataclass
+class StoredBlob:
+    """properties of a stored object, mirrors what Azure returns for a blob"""
+    name: str
+    size: int = 0
+    etag: str = None
+    last_modified: datetime.datetime = None
+    content_type: str = None
+    metadata: dict = field(default_factory=dict)
+
+
+class ReportStore:
+    """interface of a store, one instance per alias and shared between threads"""
+
+    def __init__(self, latency=0):
+        # seconds added to every call, only meant for benchmarks of offline stores
+        self.latency = latency
+
+    def _simulate_latency(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def put(self, name, data, metadata=None, content_type=None):
+        """create or overwrite `name` with bytes or an iterable of byte chunks, return its StoredBlob
+
+        chunks are written as they are produced, e.g. `response.iter_content()` of a
+        streamed HTTP response, without holding the whole blob in memory
+        """
+        raise NotImplementedError
+
+    def get(self, name):
+        """return the content of `name`, raise BlobNotFound"""
+        return self.download(name)[0]
+
+    def download(self, name, if_none_match=None):
+        """return `(content, StoredBlob)` of `name`, raise BlobNotFound
+
+        with `if_none_match`, raise BlobNotModified instead of downloading a blob that
+        still has this etag
+        """
+        raise NotImplementedError
+
+    def open(self, name, offset=0, length=None, if_none_match=None):
+        """return `(chunks, StoredBlob)`, `chunks` iterates over `length` bytes from `offset`
+
+        stores that can stream never hold the whole blob in memory, StoredBlob.size is
+        the size of the whole blob; raise BlobNotFound, BlobNotModified like download()
+        """
+        data, properties = self.download(name, if_none_match=if_none_match)
+        end = None if length is None else offset + length
+        return iter([data[offset:end]]), properties
+
+    def get_properties(self, name):
+        """return the StoredBlob of `name` or None"""
+        raise NotImplementedError
+
+    def exists(self, name):
+        return self.get_properties(name) is not None
+
+    def list(self, prefix, page_size=100, continuation_token=None):
+        """return `(blobs, continuation_token)` of one page of names starting with `prefix`"""
+        raise NotImplementedError
+
+    def delete(self, name):
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix):
+        """delete everything under `prefix`, return the number of deleted objects"""
+        count = 0
+        token = None
+        while True:
+            blobs, token = self.list(prefix, page_size=1000, continuation_token=token)
+            for blob in blobs:
+                self.delete(blob.name)
+                count += 1
+            if not token:
+                return count
+
+    def copy(self, source_store, source_name, name=None):
+        """copy `source_name` of `source_store` to `name` (default the same name) of this store"""
+        data, properties = source_store.download(source_name)
+        return self.put(name or source_name, data, metadata=properties.metadata,
+                        content_type=properties.content_type)
+
+    async def aget(self, name):
+        """async get()"""
+        return await sync_to_async(self.get, thread_sensitive=False)(name)
+
+    async def aget_properties(self, name):
+        """async get_properties()"""
+        return await sync_to_async(self.get_properties, thread_sensitive=False)(name)
+
+    async def aopen(self, name, offset=0, length=None, if_none_match=None):
+        """async open(), `chunks` is an async iterator"""
+        chunks, properties = await sync_to_async(self.open, thread_sensitive=False)(
+            name, offset=offset, length=length, if_none_match=if_none_match)
+        return aiter_chunks(chunks), properties
+
+
+def _etag(data):
+    return f'"{hashlib.md5(data).hexdigest()}"'
+
+
+def is_chunks(data):
+    """True when `data` given to put() is an iterable of chunks rather than bytes"""
+    return not isinstance(data, (bytes, bytearray, memoryview))
+
+
+def _page(names, page_size, continuation_token):
+    """page through sorted names, the token is the last name of the previous page"""
+    if continuation_token:
+        names = [name for name in names if name > continuation_token]
+    page = names[:page_size]
+    token = page[-1] if len(names) > page_size else None
+    return page, token
+
+
+class InMemoryReportStore(ReportStore):
+    def __init__(self, latency=0):
+        super().__init__(latency=latency)
+        self._lock = threading.Lock()
+        self._blobs = {}
+
+    def put(self, name, data, metadata=None, content_type=None):
+        self._simulate_latency()
+        if is_chunks(data):
+            data = b''.join(data)
+        properties = StoredBlob(
+            name=name,
+            size=len(data),
+            etag=_etag(data),
+            last_modified=datetime.datetime.now(datetime.timezone.utc),
+            content_type=content_type or 'application/octet-stream',
+            metadata=dict(metadata or {}),
+        )
+        with self._lock:
+            self._blobs[name] = (bytes(data), properties)
+        return properties
+
+    def download(self, name, if_none_match=None):
+        self._simulate_latency()
+        with self._lock:
+            if name not in self._blobs:
+                raise BlobNotFound(name)
+            data, properties = self._blobs[name]
+        if if_none_match and properties.etag == if_none_match:
+            raise BlobNotModified(name)
+        return data, properties
+
+    def get_properties(self, name):
+        self._simulate_latency()
+        with self._lock:
+            item = self._blobs.get(name)
+        return item[1] if item else None
+
+    def list(self, prefix, page_size=100, continuation_token=None):
+        self._simulate_latency()
+        with self._lock:
+            names = sorted(name for name in self._blobs if name.startswith(prefix))
+            page, token = _page(names, page_size, continuation_token)
+            return [self._blobs[name][1] for name in page], token
+
+    def delete(self, name):
+        self._simulate_latency()
+        with self._lock:
+            if self._blobs.pop(name, None) is None:
+                raise BlobNotFound(name)
+
+
+class LocalReportStore(ReportStore):
+    """files under `location`, properties in a `.properties` tree next to them"""
+
+    def __init__(self, location, latency=0):
+        super().__init__(latency=latency)
+        self.location = os.path.abspath(location)
+        self.properties_location = os.path.join(self.location, '.properties')
+
+    def _path(self, name):
+        path = os.path.abspath(os.path.join(self.location, name))
+        if not path.startswith(self.location + os.sep) or path.startswith(self.properties_location + os.sep):
+            raise ValueError(f"invalid name: {name}")
+        return path
+
+    def _properties_path(self, name):
+        return os.path.join(self.properties_location, f"{name}.json")
+
+    def path(self, name):
+        """local file of `name`, like Storage.path()"""
+        return self._path(name)
+
+    @staticmethod
+    def _write_atomic(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _read_properties(self, name):
+        path = self._path(name)
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        try:
+            with open(self._properties_path(name)) as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            stored = {}
+        return StoredBlob(
+            name=name,
+            size=stat.st_size,
+            etag=stored.get('etag') or f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+            last_modified=datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.timezone.utc),
+            content_type=stored.get('content_type') or 'application/octet-stream',
+            metadata=stored.get('metadata') or {},
+        )
+
+    def put(self, name, data, metadata=None, content_type=None):
+        self._simulate_latency()
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        digest = hashlib.md5()
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in (data if is_chunks(data) else [data]):
+                    digest.update(chunk)
+                    f.write(chunk)
+            properties = {
+                'etag': f'"{digest.hexdigest()}"',
+                'content_type': content_type,
+                'metadata': dict(metadata or {}),
+            }
+            self._write_atomic(self._properties_path(name), json.dumps(properties).encode('utf-8'))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return self._read_properties(name)
+
+    def download(self, name, if_none_match=None):
+        self._simulate_latency()
+        properties = self._read_properties(name)
+        if properties is None:
+            raise BlobNotFound(name)
+        if if_none_match and properties.etag == if_none_match:
+            raise BlobNotModified(name)
+        with open(self._path(name), 'rb') as f:
+            return f.read(), properties
+
+    def open(self, name, offset=0, length=None, if_none_match=None):
+        self._simulate_latency()
+        properties = self._read_properties(name)
+        if properties is None:
+            raise BlobNotFound(name)
+        if if_none_match and properties.etag == if_none_match:
+            raise BlobNotModified(name)
+        return self._read_chunks(self._path(name), offset, length), properties
+
+    @staticmethod
+    def _read_chunks(path, offset, length):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            remaining = length
+            while remaining is None or remaining > 0:
+                size = settings.BLOB_STREAM_CHUNK_SIZE
+                chunk = f.read(size if remaining is None else min(size, remaining))
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def get_properties(self, name):
+        self._simulate_latency()
+        return self._read_properties(name)
+
+    def _names(self, prefix):
+        # walk only the directory that contains the prefix
+        directory = os.path.dirname(os.path.join(self.location, prefix))
+        if not os.path.isdir(directory):
+            return []
+        names = []
+        for root, dirs, files in os.walk(directory):
+            if root == self.location:
+                dirs[:] = [d for d in dirs if d != '.properties']
+            for file_name in files:
+                if file_name.endswith('.tmp'):
+                    continue
+                name = os.path.relpath(os.path.join(root, file_name), self.location).replace(os.sep, '/')
+                if name.startswith(prefix):
+                    names.append(name)
+        return sorted(names)
+
+    def list(self, prefix, page_size=100, continuation_token=None):
+        self._simulate_latency()
+        page, token = _page(self._names(prefix), page_size, continuation_token)
+        blobs = [self._read_properties(name) for name in page]
+        return [blob for blob in blobs if blob], token
+
+    def delete(self, name):
+        self._simulate_latency()
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            raise BlobNotFound(name)
+        try:
+            os.remove(self._properties_path(name))
+        except FileNotFoundError:
+            pass
+
+
+class AzureReportStore(ReportStore):
+    """a container of a storage account, clients come from core.blob_clients
+
+    Options are names of settings, resolved on use like the views did before.
+    """
+
+    def __init__(self, container_setting, connection_string_setting='AZURE_STORAGE_CONNECTION_STRING', latency=0):
+        super().__init__(latency=latency)
+        self.container_setting = container_setting
+        self.connection_string_setting = connection_string_setting
+
+    @property
+    def container_client(self):
+        return blob_clients.get_container_client(
+            getattr(settings, self.container_setting),
+            connection_string=getattr(settings, self.connection_string_setting),
+        )
+
+    @property
+    def async_container_client(self):
+        """client of the running event loop"""
+        return blob_clients_aio.get_container_client(
+            getattr(settings, self.container_setting),
+            connection_string=getattr(settings, self.connection_string_setting),
+        )
+
+    def blob_client(self, name):
+        return self.container_client.get_blob_client(name)
+
+    @staticmethod
+    def _to_stored_blob(properties):
+        content_settings = properties.content_settings
+        return StoredBlob(
+            name=properties.name,
+            size=properties.size,
+            etag=properties.etag,
+            last_modified=properties.last_modified,
+            content_type=content_settings.content_type if content_settings else None,
+            metadata=properties.metadata or {},
+        )
+
+    def put(self, name, data, metadata=None, content_type=None):
+        content_settings = ContentSettings(content_type=content_type) if content_type else None
+        # chunks of unknown total size are uploaded as blocks while they are read
+        result = self.blob_client(name).upload_blob(data, overwrite=True, metadata=metadata,
+                                                    content_settings=content_settings)
+        if is_chunks(data):
+            return self.get_properties(name)
+        return StoredBlob(
+            name=name,
+            size=len(data),
+            etag=result.get('etag'),
+            last_modified=result.get('last_modified'),
+            content_type=content_type,
+            metadata=dict(metadata or {}),
+        )
+
+    def _downloader(self, name, if_none_match=None, **kwargs):
+        if if_none_match:
+            kwargs.update(etag=if_none_match, match_condition=MatchConditions.IfModified)
+        try:
+            return self.blob_client(name).download_blob(**kwargs)
+        except ResourceNotFoundError:
+            raise BlobNotFound(name)
+        except ResourceNotModifiedError:
+            raise BlobNotModified(name)
+
+    def download(self, name, if_none_match=None):
+        downloader = self._downloader(name, if_none_match=if_none_match)
+        return downloader.readall(), self._to_stored_blob(downloader.properties)
+
+    def open(self, name, offset=0, length=None, if_none_match=None):
+        # the first request fetches at most AZURE_STORAGE_MAX_SINGLE_GET_SIZE bytes,
+        # the rest is requested chunk by chunk while the response is consumed
+        ranged = {'offset': offset, 'length': length} if offset or length is not None else {}
+        downloader = self._downloader(name, if_none_match=if_none_match, **ranged)
+        properties = self._to_stored_blob(downloader.properties)
+        # content_range is "bytes {start}-{end}/{size of the blob}"
+        properties.size = int(downloader.properties.content_range.rsplit('/', 1)[1])
+        return downloader.chunks(), properties
+
+    def get_properties(self, name):
+        try:
+            return self._to_stored_blob(self.blob_client(name).get_blob_properties())
+        except ResourceNotFoundError:
+            return None
+
+    def exists(self, name):
+        return self.blob_client(name).exists()
+
+    async def _adownloader(self, name, if_none_match=None, **kwargs):
+        if if_none_match:
+            kwargs.update(etag=if_none_match, match_condition=MatchConditions.IfModified)
+        try:
+            return await self.async_container_client.get_blob_client(name).download_blob(**kwargs)
+        except ResourceNotFoundError:
+            raise BlobNotFound(name)
+        except ResourceNotModifiedError:
+            raise BlobNotModified(name)
+
+    async def aget(self, name):
+        downloader = await self._adownloader(name)
+        return await downloader.readall()
+
+    async def aget_properties(self, name):
+        try:
+            return self._to_stored_blob(await self.async_container_client.get_blob_client(name).get_blob_properties())
+        except ResourceNotFoundError:
+            return None
+
+    async def aopen(self, name, offset=0, length=None, if_none_match=None):
+        ranged = {'offset': offset, 'length': length} if offset or length is not None else {}
+        downloader = await self._adownloader(name, if_none_match=if_none_match, **ranged)
+        properties = self._to_stored_blob(downloader.properties)
+        properties.size = int(downloader.properties.content_range.rsplit('/', 1)[1])
+        return downloader.chunks(), properties
+
+    def list(self, prefix, page_size=100, continuation_token=None):
+        blob_list = self.container_client.list_blobs(
+            name_starts_with=prefix,
+            include=['metadata'],
+            results_per_page=page_size
+        )
+        pages = blob_list.by_page(continuation_token)
+        current_page = next(pages, [])
+        return [self._to_stored_blob(blob) for blob in current_page], pages.continuation_token
+
+    def delete(self, name):
+        try:
+            self.blob_client(name).delete_blob()
+        except ResourceNotFoundError:
+            raise BlobNotFound(name)
+
+    def copy(self, source_store, source_name, name=None):
+        if isinstance(source_store, AzureReportStore):
+            # server side copy, the bytes never pass through this process
+            source_url = source_store.blob_client(source_name).url
+            blob_client = self.blob_client(name or source_name)
+            copy = blob_client.start_copy_from_url(source_url)
+            status = copy['copy_status']
+            while status == 'pending':  # copies between accounts complete asynchronously
+                time.sleep(settings.AZURE_STORAGE_COPY_POLL_INTERVAL)
+                status = blob_client.get_blob_properties().copy.status
+            if status != 'success':
+                raise RuntimeError(f"copy of {source_name} to {name or source_name} ended with status {status}")
+            return self.get_properties(name or source_name)
+        return super().copy(source_store, source_name, name=name)
+
+
+_lock = threading.Lock()
+_stores = {}
+
+
+def get_report_store(alias='report'):
+    """return the shared store configured in `settings.REPORT_STORES[alias]`"""
+    store = _stores.get(alias)
+    if store is not None:
+        return store
+    with _lock:
+        store = _stores.get(alias)
+        if store is None:
+            config = settings.REPORT_STORES[alias]
+            store = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+            _stores[alias] = store
+    return store
+
+
+@receiver(setting_changed)
+def reset_report_stores(setting, **kwargs):
+    """tests swap the stores with override_settings"""
+    if setting == 'REPORT_STORES':
+        with _lock:
+            _stores.clear()
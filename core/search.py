@@ -0,0 +1,168 @@
+"""full-text search over report content and story room submissions
+
+The text of a document is indexed when it is written, searching never reads a blob:
+
+    index_report(tenant, report_id, title, report_content)   # from UploadReportView
+    index_story(tenant, blob_name, title, story)             # from StoryRoomUpload
+    remove_document('story', blob_name)                      # after the blob is deleted
+    results, next_offset = search(tenant, 'food bank', kinds=('report',), limit=20)
+
+Rows are SearchDocument, the database keeps the full-text index (migration 0070):
+
+- PostgreSQL: generated `search_vector` tsvector column (title weighted above body) with a
+  GIN index, queried with websearch_to_tsquery and ranked by ts_rank_cd
+- SQLite (development): FTS5 table `core_searchdocument_fts` kept in sync by triggers,
+  ranked by bm25. A migration that rebuilds core_searchdocument drops the triggers, it has
+  to create them again
+- other databases: unranked `icontains`
+
+Snippets are plain text with the matches between SNIPPET_START and SNIPPET_STOP, stories are
+public submissions and are never rendered as HTML.
+`manage.py rebuild_search_index` backfills the table from the blob stores.
+"""
+import logging
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from core import models
+from core.html_stream import html_to_text
+
+logger = logging.getLogger(__name__)
+
+KINDS = tuple(kind for kind, _ in models.SEARCH_DOCUMENT_KINDS)
+SEARCH_CONFIG = 'english'  # same as the generated column of migration 0070
+SNIPPET_START = '«'
+SNIPPET_STOP = '»'
+SNIPPET_WORDS = 24
+
+
+def index_document(tenant, kind, key, title, body):
+    """create or replace the indexed text of `key`"""
+    document, _ = models.SearchDocument.objects.update_or_create(
+        kind=kind,
+        key=key,
+        defaults={
+            'tenant': tenant,
+            'title': (title or '')[:512],
+            # a tsvector is limited to 1MB, text past the limit is not searchable
+            'body': (body or '')[:settings.SEARCH_MAX_BODY_CHARS],
+        },
+    )
+    return document
+
+
+def index_report(tenant, report_id, title, report_content):
+    return index_document(tenant, 'report', report_id, title, html_to_text(report_content or ''))
+
+
+def index_story(tenant, blob_name, title, story):
+    return index_document(tenant, 'story', blob_name, title, story)
+
+
+def remove_document(kind, key):
+    models.SearchDocument.objects.filter(kind=kind, key=key).delete()
+
+
+def _tenant_value(tenant):
+    field = models.SearchDocument._meta.get_field('tenant')
+    return field.get_db_prep_value(tenant.pk, connection)
+
+
+def _has_fts5():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'core_searchdocument_fts'")
+        return cursor.fetchone() is not None
+
+
+def _search_postgresql(tenant, query, kinds, limit, offset):
+    options = f'StartSel={SNIPPET_START}, StopSel={SNIPPET_STOP}, MaxWords={SNIPPET_WORDS}, MinWords=8, MaxFragments=2'
+    # ts_headline re-parses the body, only the rows of the page go through it
+    sql = f"""
+        SELECT page.id, page.rank, ts_headline('{SEARCH_CONFIG}', page.body, page.query, %s)
+        FROM (
+            SELECT d.id, d.body, q.query, ts_rank_cd(d.search_vector, q.query) AS rank
+            FROM core_searchdocument d, websearch_to_tsquery('{SEARCH_CONFIG}', %s) AS q(query)
+            WHERE d.tenant_uuid = %s AND d.kind = ANY(%s) AND d.search_vector @@ q.query
+            ORDER BY rank DESC, d.id DESC
+            LIMIT %s OFFSET %s
+        ) page
+        ORDER BY page.rank DESC, page.id DESC
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [options, query, _tenant_value(tenant), list(kinds), limit, offset])
+        return cursor.fetchall()
+
+
+def fts5_query(query):
+    """`query` as an FTS5 expression matching all its words, None without any"""
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    return ' '.join('"%s"' % word for word in words)
+
+
+def _search_sqlite(tenant, query, kinds, limit, offset):
+    match = fts5_query(query)
+    if match is None:
+        return []
+    placeholders = ', '.join(['%s'] * len(kinds))
+    sql = f"""
+        SELECT d.id, -bm25(core_searchdocument_fts, 10.0, 1.0) AS rank,
+               snippet(core_searchdocument_fts, 1, %s, %s, '…', %s)
+        FROM core_searchdocument_fts
+        JOIN core_searchdocument d ON d.id = core_searchdocument_fts.rowid
+        WHERE core_searchdocument_fts MATCH %s AND d.tenant_uuid = %s AND d.kind IN ({placeholders})
+        ORDER BY rank DESC, d.id DESC
+        LIMIT %s OFFSET %s
+    """
+    params = [SNIPPET_START, SNIPPET_STOP, SNIPPET_WORDS, match, _tenant_value(tenant), *kinds, limit, offset]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _search_unindexed(tenant, query, kinds, limit, offset):
+    qs = models.SearchDocument.objects.filter(tenant=tenant, kind__in=kinds)
+    qs = qs.filter(Q(title__icontains=query) | Q(body__icontains=query)).order_by('-updated_at', '-id')
+    return [(pk, None, None) for pk in qs.values_list('pk', flat=True)[offset:offset + limit]]
+
+
+def search(tenant, query, kinds=KINDS, limit=20, offset=0):
+    """`(results, next offset)` of the documents of `tenant` matching `query`, best first
+
+    a result is a dict of kind, key, title, snippet, rank and created_at, next offset is
+    None on the last page
+    """
+    query = (query or '').strip()
+    kinds = [kind for kind in kinds if kind in KINDS]
+    if not query or not kinds:
+        return [], None
+
+    if connection.vendor == 'postgresql':
+        rows = _search_postgresql(tenant, query, kinds, limit + 1, offset)
+    elif connection.vendor == 'sqlite' and _has_fts5():
+        rows = _search_sqlite(tenant, query, kinds, limit + 1, offset)
+    else:
+        rows = _search_unindexed(tenant, query, kinds, limit + 1, offset)
+    next_offset = offset + limit if len(rows) > limit else None
+    rows = rows[:limit]
+
+    # the body is only read by the database, the rows of the page are loaded without it
+    documents = models.SearchDocument.objects.only('kind', 'key', 'title', 'created_at').in_bulk([row[0] for row in rows])
+    results = []
+    for pk, rank, snippet in rows:
+        document = documents.get(pk)
+        if document is None:  # deleted in between
+            continue
+        results.append({
+            'kind': document.kind,
+            'key': document.key,
+            'title': document.title,
+            'snippet': snippet,
+            'rank': rank,
+            'created_at': document.created_at,
+        })
+    return results, next_offset
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 
 from django.core.exceptions import ValidationError
+from django.urls import reverse
 
 from core import models
 
@@ -40,6 +41,23 @@ class PortfolioSerializer(serializers.ModelSerializer):
         return category_mapping.get(obj.category) or ''
 
 
+class ExportJobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = models.ExportJob
+        fields = ['uuid', 'portfolio', 'file_type', 'is_impact_report', 'status', 'error',
+                  'download_url', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
+    def get_download_url(self, obj):
+        if obj.status != 'done':
+            return None
+        url = reverse('export-jobs-download', kwargs={'pk': obj.pk})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+
 class ReportBaseTemplateSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.ReportBaseTemplate
@@ -0,0 +1,134 @@
+"""database catalogue of the story room submissions in the RAG container
+
+StoryList used to page through the `{tenant_uuid}/storyRoom/` blob listing in name order,
+100 at a time, without any way to filter. The StorySubmission table mirrors every story:
+
+    record_stories([(properties, tenant), ...])   # after the ingestion worker wrote the blobs
+    sync_story(store, blob_name, tenant)          # after any other write
+    remove_story(blob_name)                       # after the blob is deleted
+    list_stories(tenant, category='Housing', created_after=date(2024, 1, 1), limit=100)
+
+Lists are keyset paginated on `(created_at, blob_name)` like report_index.list_reports.
+`manage.py reconcile_stories` rebuilds the table from the container.
+"""
+import datetime
+import logging
+
+from django.db.models import Q
+from django.utils import timezone
+
+from core import models
+from core.report_index import decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+ORDERINGS = ('created_at', '-created_at')
+
+# format of the Created_At metadata of StoryRoomUpload
+METADATA_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def story_prefix(tenant):
+    return f"{tenant.uuid}/storyRoom/"
+
+
+def _metadata_time(value):
+    try:
+        return timezone.make_aware(datetime.datetime.strptime(value, METADATA_TIME_FORMAT))
+    except (TypeError, ValueError):
+        return None
+
+
+def _fields(properties, tenant):
+    metadata = properties.metadata or {}
+    return {
+        'tenant': tenant,
+        'category': metadata.get('Category'),
+        'created_by': metadata.get('Created_By_Display_Name'),
+        'created_at': _metadata_time(metadata.get('Created_At')) or properties.last_modified or timezone.now(),
+        'summary': metadata.get('Summary'),
+        'size': properties.size,
+        'etag': properties.etag,
+    }
+
+
+def record_story(properties, tenant):
+    """create or update the row of the blob of `properties`"""
+    entry, _ = models.StorySubmission.objects.update_or_create(
+        blob_name=properties.name, defaults=_fields(properties, tenant))
+    return entry
+
+
+def record_stories(stories):
+    """record_story of every `(properties, tenant)` in one query"""
+    entries = [models.StorySubmission(blob_name=properties.name, **_fields(properties, tenant))
+               for properties, tenant in stories]
+    models.StorySubmission.objects.bulk_create(
+        entries,
+        update_conflicts=True,
+        unique_fields=['blob_name'],
+        update_fields=['tenant', 'category', 'created_by', 'created_at', 'summary', 'size', 'etag'],
+    )
+
+
+def sync_story(store, blob_name, tenant):
+    """make the row of `blob_name` match the store, return it (None once deleted)"""
+    properties = store.get_properties(blob_name)
+    if properties is None:
+        remove_story(blob_name)
+        return None
+    return record_story(properties, tenant)
+
+
+def remove_story(blob_name):
+    models.StorySubmission.objects.filter(blob_name=blob_name).delete()
+
+
+def _stories(tenant, category=None, created_by=None, created_after=None, created_before=None):
+    qs = models.StorySubmission.objects.filter(tenant=tenant)
+    if category:
+        qs = qs.filter(category=category)
+    if created_by:
+        qs = qs.filter(created_by=created_by)
+    if created_after:
+        qs = qs.filter(created_at__gte=created_after)
+    if created_before:
+        qs = qs.filter(created_at__lt=created_before)
+    return qs
+
+
+def list_stories(tenant, ordering='-created_at', cursor=None, limit=100, **filters):
+    """`(entries, next cursor)` of one page of the stories of `tenant`, raise ValueError
+
+    `filters` are category, created_by, created_after and created_before (excluded)
+    """
+    if ordering not in ORDERINGS:
+        raise ValueError(f"ordering must be one of {', '.join(ORDERINGS)}")
+    lookup, direction = ('lt', '-') if ordering.startswith('-') else ('gt', '')
+
+    qs = _stories(tenant, **filters)
+    if cursor:
+        value, blob_name = decode_cursor(cursor)
+        qs = qs.filter(Q(**{f'created_at__{lookup}': value}) | Q(created_at=value, **{f'blob_name__{lookup}': blob_name}))
+    entries = list(qs.order_by(f'{direction}created_at', f'{direction}blob_name')[:limit + 1])
+    if len(entries) > limit:
+        entries = entries[:limit]
+        return entries, encode_cursor(entries[-1].created_at, entries[-1].blob_name)
+    return entries, None
+
+
+def count_stories(tenant, **filters):
+    return _stories(tenant, **filters).count()
+
+
+def serialize_entry(entry):
+    """same fields as the blob listing StoryList used to return"""
+    return {
+        'file_name': entry.blob_name,
+        'etag': entry.etag,
+        'created_by': entry.created_by,
+        'created_at': timezone.localtime(entry.created_at).strftime(METADATA_TIME_FORMAT),
+        'category': entry.category,
+        'summary': entry.summary,
+        'size': entry.size,
+    }
@@ -0,0 +1,231 @@
+"""queue of story room submissions, uploaded to the RAG container in the background
+
+StoryRoomUpload used to write the blob inside the anonymous request, story room campaigns
+piled those requests up on the workers. The request now only stores a StoryUpload row:
+
+    upload = enqueue_story(tenant, name, category, story)   # returns at once
+    process_batch()                                          # in a worker, see below
+
+- after the request commits, a drain of the queue is scheduled on a single background
+  thread, submissions arriving meanwhile are picked up by the same drain. A drain first
+  requeues the stale uploads, then sets a timer for the next retry that is due or upload
+  that goes stale, so the queue empties without further submissions
+- a batch claims up to STORY_INGEST_BATCH_SIZE rows at once, uploads them in parallel and
+  records them in the story catalogue and the search index with a few queries
+- a failed upload is retried after STORY_INGEST_RETRY_DELAY seconds, doubled at every
+  attempt, and gives up after STORY_INGEST_MAX_ATTEMPTS
+- `manage.py run_story_uploads [--loop]` drains the queue from a dedicated process and
+  requeues the rows of a process that died while uploading
+"""
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from core import models, search, story_index
+from core.report_store import get_report_store
+from core.views_editor import sanitize_metadata_value
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+_drain_scheduled = False
+# (timer of the next drain, monotonic time it fires at)
+_wakeup = None
+
+
+def enqueue_story(tenant, name, category, story):
+    """create the StoryUpload of a submission and schedule its upload"""
+    submitted_at = timezone.localtime()
+    current = submitted_at.strftime(story_index.METADATA_TIME_FORMAT)
+    filename = sanitize_metadata_value(f"{name}-{category}-{current}.txt")
+    upload = models.StoryUpload.objects.create(
+        tenant=tenant,
+        blob_name=f"{story_index.story_prefix(tenant)}{filename}",
+        name=name,
+        category=category,
+        story=story,
+        submitted_at=submitted_at,
+    )
+    if settings.STORY_INGEST_IN_PROCESS:
+        transaction.on_commit(schedule_drain)
+    return upload
+
+
+def story_blob(upload):
+    """`(data, metadata)` of the blob of `upload`"""
+    current = timezone.localtime(upload.submitted_at).strftime(story_index.METADATA_TIME_FORMAT)
+    metadata = {
+        'Created_By_Display_Name': upload.name,
+        'Created_At': current,
+        'Last_Modified_By_Display_Name': upload.name,
+        'Last_Modified_At': current,
+        'Category': upload.category,
+        'Summary': sanitize_metadata_value(upload.story[:128])
+    }
+    text = f"""
+            StoryRoom Feedback: {upload.category}
+            Name: {upload.name}
+
+            Date: {current}
+            Story: {upload.story}
+        """
+    return text.encode('utf-8'), metadata
+
+
+def claim_batch(limit):
+    """StoryUploads due for an attempt, marked as uploading by this worker"""
+    now = timezone.now()
+    due = list(models.StoryUpload.objects.filter(status='pending', next_attempt_at__lte=now)
+               .order_by('next_attempt_at').values_list('pk', flat=True)[:limit])
+    if not due:
+        return []
+    batch_id = uuid.uuid4()
+    # rows claimed by another worker in between are no longer pending
+    models.StoryUpload.objects.filter(pk__in=due, status='pending').update(
+        status='uploading', claimed_by=batch_id, claimed_at=now)
+    return list(models.StoryUpload.objects.filter(claimed_by=batch_id).select_related('tenant'))
+
+
+def _upload(store, upload):
+    """`(properties, None)` of the written blob or `(None, error)`"""
+    try:
+        data, metadata = story_blob(upload)
+        return store.put(upload.blob_name, data, metadata=metadata, content_type='text/plain'), None
+    except Exception as e:
+        logger.warning(f"Failed to upload story {upload.blob_name}: {e}")
+        return None, e
+
+
+def retry_delay(attempts):
+    """seconds before the next attempt of an upload that failed `attempts` times"""
+    return min(settings.STORY_INGEST_RETRY_DELAY * 2 ** (attempts - 1), settings.STORY_INGEST_MAX_RETRY_DELAY)
+
+
+def process_batch(limit=None):
+    """upload one batch of due stories, return the number of stories claimed"""
+    batch = claim_batch(limit or settings.STORY_INGEST_BATCH_SIZE)
+    if not batch:
+        return 0
+    store = get_report_store('rag')
+    with ThreadPoolExecutor(max_workers=settings.STORY_INGEST_CONCURRENCY) as pool:
+        results = list(pool.map(lambda upload: _upload(store, upload), batch))
+
+    uploaded = [(upload, properties) for upload, (properties, _) in zip(batch, results) if properties is not None]
+    if uploaded:
+        story_index.record_stories([(properties, upload.tenant) for upload, properties in uploaded])
+        for upload, _ in uploaded:
+            try:
+                search.index_story(upload.tenant, upload.blob_name, f"{upload.name} - {upload.category}", upload.story)
+            except Exception as e:
+                logger.error(f"Failed to index story {upload.blob_name}: {e}")
+        models.StoryUpload.objects.filter(pk__in=[upload.pk for upload, _ in uploaded]).delete()
+
+    now = timezone.now()
+    failed = []
+    for upload, (_, error) in zip(batch, results):
+        if error is None:
+            continue
+        upload.attempts += 1
+        upload.error = str(error)
+        upload.claimed_by = upload.claimed_at = None
+        if upload.attempts >= settings.STORY_INGEST_MAX_ATTEMPTS:
+            upload.status = 'failed'
+            logger.error(f"Giving up on story {upload.blob_name} after {upload.attempts} attempts: {error}")
+        else:
+            upload.status = 'pending'
+            upload.next_attempt_at = now + timedelta(seconds=retry_delay(upload.attempts))
+        failed.append(upload)
+    if failed:
+        models.StoryUpload.objects.bulk_update(
+            failed, ['status', 'attempts', 'error', 'next_attempt_at', 'claimed_by', 'claimed_at'])
+    return len(batch)
+
+
+def drain():
+    """process batches until no story is due, return the number of stories claimed"""
+    total = 0
+    while True:
+        claimed = process_batch()
+        if not claimed:
+            return total
+        total += claimed
+
+
+def next_wakeup():
+    """seconds until a pending story is due or an uploading one goes stale, None when there is none"""
+    now = timezone.now()
+    times = models.StoryUpload.objects.aggregate(
+        due=Min('next_attempt_at', filter=Q(status='pending')),
+        claimed=Min('claimed_at', filter=Q(status='uploading')))
+    if times['claimed'] is not None:
+        times['claimed'] += timedelta(seconds=settings.STORY_INGEST_STALE_AFTER)
+    times = [value for value in times.values() if value is not None]
+    return max((min(times) - now).total_seconds(), 0) if times else None
+
+
+def _wake():
+    global _wakeup
+    with _lock:
+        _wakeup = None
+    schedule_drain()
+
+
+def _schedule_wakeup(delay):
+    """drain again in `delay` seconds, unless an earlier drain is set already"""
+    global _wakeup
+    fires_at = time.monotonic() + delay
+    with _lock:
+        if _wakeup is not None:
+            if _wakeup[1] <= fires_at:
+                return
+            _wakeup[0].cancel()
+        timer = threading.Timer(delay, _wake)
+        timer.daemon = True
+        _wakeup = (timer, fires_at)
+    timer.start()
+
+
+def _scheduled_drain():
+    global _drain_scheduled
+    with _lock:
+        _drain_scheduled = False  # stories enqueued from here on schedule another drain
+    close_old_connections()
+    try:
+        requeue_stale_uploads()
+        drain()
+        delay = next_wakeup()
+    except Exception:
+        logger.exception("story upload drain failed")
+        delay = settings.STORY_INGEST_RETRY_DELAY
+    finally:
+        close_old_connections()
+    if delay is not None:
+        _schedule_wakeup(delay)
+
+
+def schedule_drain():
+    """drain the queue on the background thread, unless a drain is already waiting to start"""
+    global _executor, _drain_scheduled
+    with _lock:
+        if _drain_scheduled:
+            return
+        _drain_scheduled = True
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='story-upload')
+    _executor.submit(_scheduled_drain)
+
+
+def requeue_stale_uploads():
+    """uploading rows of a process that died are pending again, return their number"""
+    stale_before = timezone.now() - timedelta(seconds=settings.STORY_INGEST_STALE_AFTER)
+    return models.StoryUpload.objects.filter(status='uploading', claimed_at__lt=stale_before).update(
+        status='pending', claimed_by=None, claimed_at=None)
@@ -0,0 +1,63 @@
+"""cached story room configuration of the anonymous StoryRoomVerify
+
+    config = get_story_room_config(tenant_name)   # None when there is no enabled story room
+
+Configurations, and unknown names, are kept in the shared cache for
+STORY_ROOM_CONFIG_CACHE_TIMEOUT seconds. Saving or deleting a Tenant or StoryRoom
+invalidates all of them (a version number in the cache, as in template_cache).
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core import models
+
+VERSION_KEY = 'story-room-config:version'
+MISSING = 'missing'  # cached for names without an enabled story room
+
+
+def _key(tenant_name):
+    version = cache.get_or_set(VERSION_KEY, 1, None)
+    digest = hashlib.sha256(tenant_name.strip().lower().encode('utf-8')).hexdigest()
+    return f"story-room-config:{version}:{digest}"
+
+
+def _load(tenant_name):
+    tenant = models.Tenant.objects.filter(name__iexact=tenant_name.strip()).first()
+    if tenant is None:
+        return None
+    story_room = models.StoryRoom.objects.filter(tenant=tenant, enabled=True).first()
+    if story_room is None:
+        return None
+    return {
+        'tenant_uuid': str(tenant.uuid),
+        'logo': tenant.logo.url if tenant.logo else None,
+        'categories': story_room.categories,
+        'allow_donation': story_room.allow_donation,
+    }
+
+
+def get_story_room_config(tenant_name):
+    """data StoryRoomVerify returns for `tenant_name` (any case) or None"""
+    if not isinstance(tenant_name, str) or not tenant_name.strip():
+        return None
+    key = _key(tenant_name)
+    config = cache.get(key)
+    if config is None:
+        config = _load(tenant_name) or MISSING
+        cache.set(key, config, settings.STORY_ROOM_CONFIG_CACHE_TIMEOUT)
+    return None if config == MISSING else config
+
+
+@receiver(post_save, sender=models.Tenant)
+@receiver(post_delete, sender=models.Tenant)
+@receiver(post_save, sender=models.StoryRoom)
+@receiver(post_delete, sender=models.StoryRoom)
+def invalidate_story_room_configs(sender, instance, **kwargs):
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 2, None)
@@ -0,0 +1,101 @@
+"""compiled base HTML templates of show_html (DownloadView, AsyncDownloadView)
+
+Rendering a report used to look up the ReportBaseTemplate, download its blob from the media
+container and compile it on every request, every PDF conversion calls back into it.
+
+    template = get_base_template(user, category)
+    html = template.render(Context({'blob_content': blob_content}))
+
+- the template of a tenant and category is resolved once, in the shared cache
+- the template source is kept in the shared cache, keyed by template uuid + blob etag
+- compiled templates are kept in an in-process LRU, their blob etag is checked again after
+  BASE_TEMPLATE_REVALIDATE_AFTER seconds
+- saving or deleting a ReportBaseTemplate invalidates the resolved templates of every
+  process (a version number in the shared cache) and the LRU entry of this process
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.template import Template
+
+from core import exports, models
+from core.report_store import BlobNotFound, get_report_store
+
+VERSION_KEY = 'base-template:version'
+
+# (template uuid, blob name) -> (blob etag, compiled template, monotonic time of the last check)
+_compiled = OrderedDict()
+_lock = threading.Lock()
+
+
+def _version():
+    return cache.get_or_set(VERSION_KEY, 1, None)
+
+
+def resolve_base_template(tenant, category):
+    """`(template uuid, blob name)` of the base template of the tenant and category"""
+    key = f"base-template:{_version()}:{tenant.pk if tenant else None}:{category}"
+    resolved = cache.get(key)
+    if resolved is None:
+        template = exports.report_template(tenant, category, 'PDF')
+        resolved = (str(template.pk), f"base_report_template/{template.template_file.url.split('/')[-1]}")
+        cache.set(key, resolved, settings.BASE_TEMPLATE_CACHE_TIMEOUT)
+    return tuple(resolved)
+
+
+def _source(store, template_id, blob_name, etag):
+    key = f"base-template-source:{template_id}:{etag}"
+    source = cache.get(key)
+    if source is None:
+        source = store.get(blob_name).decode('utf-8')
+        cache.set(key, source, settings.BASE_TEMPLATE_CACHE_TIMEOUT)
+    return source
+
+
+def get_compiled_template(template_id, blob_name):
+    """compiled template of the blob `blob_name` of the media store, raise BlobNotFound"""
+    key = (template_id, blob_name)
+    now = time.monotonic()
+    with _lock:
+        entry = _compiled.get(key)
+        if entry:
+            _compiled.move_to_end(key)
+    if entry and now - entry[2] < settings.BASE_TEMPLATE_REVALIDATE_AFTER:
+        return entry[1]
+
+    store = get_report_store('media')
+    properties = store.get_properties(blob_name)
+    if properties is None:
+        raise BlobNotFound(blob_name)
+    if entry and entry[0] == properties.etag:
+        template = entry[1]
+    else:
+        template = Template(_source(store, template_id, blob_name, properties.etag))
+    with _lock:
+        _compiled[key] = (properties.etag, template, now)
+        _compiled.move_to_end(key)
+        while len(_compiled) > settings.BASE_TEMPLATE_CACHE_SIZE:
+            _compiled.popitem(last=False)
+    return template
+
+
+def get_base_template(user, category):
+    """compiled base template (tenant default or official) a report of `category` is rendered in"""
+    return get_compiled_template(*resolve_base_template(user.tenant, category))
+
+
+@receiver(post_save, sender=models.ReportBaseTemplate)
+@receiver(post_delete, sender=models.ReportBaseTemplate)
+def invalidate_base_templates(sender, instance, **kwargs):
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 2, None)
+    with _lock:
+        for key in [key for key in _compiled if key[0] == str(instance.pk)]:
+            del _compiled[key]
@@ -1,3 +1,837 @@
-from django.test import TestCase
+import io
+import json
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.models import User
+from core import exports
+from core import html_stream
+from core import models
+from core import report_documents
+from core import report_index
+from core import search
+from core import story_index
+from core import story_ingestion
+from core import story_rooms
+from core import throttling
+from core.blob_cache import BlobCache
+from core.report_store import InMemoryReportStore, LocalReportStore, BlobNotFound, BlobNotModified, get_report_store
+from core.views import rewrite_img_src
+
+IN_MEMORY_REPORT_STORES = {
+    alias: {'BACKEND': 'core.report_store.InMemoryReportStore'}
+    for alias in ('report', 'chat_bot', 'rag', 'media')
+}
+
+
+class ReportStoreTestMixin:
+    def get_store(self):
+        raise NotImplementedError
+
+    def test_put_get(self):
+        store = self.get_store()
+        blob = store.put('r1/r1.json', b'{}', metadata={'Report_ID': 'r1'}, content_type='application/json')
+        self.assertEqual(blob.size, 2)
+        self.assertTrue(blob.etag)
+        self.assertEqual(store.get('r1/r1.json'), b'{}')
+        properties = store.get_properties('r1/r1.json')
+        self.assertEqual(properties.metadata, {'Report_ID': 'r1'})
+        self.assertEqual(properties.content_type, 'application/json')
+        self.assertTrue(store.exists('r1/r1.json'))
+        self.assertFalse(store.exists('r1/missing.json'))
+        with self.assertRaises(BlobNotFound):
+            store.get('r1/missing.json')
+
+    def test_list_pages_and_delete_prefix(self):
+        store = self.get_store()
+        for i in range(5):
+            store.put(f't1/r{i}.json', b'x')
+        store.put('t2/r0.json', b'x')
+
+        blobs, token = store.list('t1/', page_size=3)
+        self.assertEqual([blob.name for blob in blobs], ['t1/r0.json', 't1/r1.json', 't1/r2.json'])
+        blobs, token = store.list('t1/', page_size=3, continuation_token=token)
+        self.assertEqual([blob.name for blob in blobs], ['t1/r3.json', 't1/r4.json'])
+        self.assertIsNone(token)
+
+        self.assertEqual(store.delete_prefix('t1/'), 5)
+        self.assertEqual(store.list('t1/')[0], [])
+        self.assertTrue(store.exists('t2/r0.json'))
+
+    def test_put_chunks(self):
+        store = self.get_store()
+        blob = store.put('a/b.pdf', (chunk for chunk in [b'%PDF', b'-1.7']), content_type='application/pdf')
+        self.assertEqual((blob.size, blob.etag), (8, store.put('a/c.pdf', b'%PDF-1.7').etag))
+        self.assertEqual(store.get('a/b.pdf'), b'%PDF-1.7')
+
+    def test_conditional_download(self):
+        store = self.get_store()
+        blob = store.put('r1/r1.json', b'{}')
+        with self.assertRaises(BlobNotModified):
+            store.download('r1/r1.json', if_none_match=blob.etag)
+        self.assertEqual(store.download('r1/r1.json', if_none_match='"other"')[0], b'{}')
+
+    def test_open_range(self):
+        store = self.get_store()
+        store.put('a/b.bin', b'0123456789')
+        chunks, properties = store.open('a/b.bin', offset=2, length=5)
+        self.assertEqual(b''.join(chunks), b'23456')
+        self.assertEqual(properties.size, 10)
+
+    def test_copy(self):
+        source = InMemoryReportStore()
+        source.put('a/b.html', b'<h4>t</h4>', content_type='text/html')
+        store = self.get_store()
+        store.copy(source, 'a/b.html')
+        self.assertEqual(store.get('a/b.html'), b'<h4>t</h4>')
+
+
+class InMemoryReportStoreTestCase(ReportStoreTestMixin, TestCase):
+    def get_store(self):
+        return InMemoryReportStore()
+
+
+class LocalReportStoreTestCase(ReportStoreTestMixin, TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def get_store(self):
+        return LocalReportStore(self.location)
+
+
+class ReportDocumentsTestCase(TestCase):
+    report = {
+        'report_content': '<h1>Title</h1>',
+        'report_citations': ['c1'],
+        'research_chunks': [{'text': 'chunk'}] * 50,
+    }
+
+    def test_write_read_parts(self):
+        store = InMemoryReportStore()
+        report_documents.write_report(store, 'r1', self.report, metadata={'Report_ID': 'r1'})
+        self.assertEqual(report_documents.read_report(store, 'r1'),
+                         dict(self.report, research_chunks_total=50))
+        self.assertEqual(report_documents.read_report(store, 'r1', parts=('content',)),
+                         {'report_content': '<h1>Title</h1>'})
+        manifest = json.loads(store.get(report_documents.manifest_name('r1')))
+        page = manifest['chunks']['pages'][0]
+        self.assertLess(page['stored_size'], len(json.dumps(self.report['research_chunks'][:page['count']])))
+
+    def test_rewrite_keeps_previous_generation_until_pruned(self):
+        store = InMemoryReportStore()
+        store.put(report_documents.legacy_name('r1'), json.dumps(self.report).encode('utf-8'),
+                  metadata={'Report_ID': 'r1'})
+        self.assertEqual(report_documents.read_report(store, 'r1', parts=('citations',)),
+                         {'report_citations': ['c1']})
+
+        report_documents.write_report(store, 'r1', self.report, metadata={'Report_ID': 'r1'})
+        old_manifest = report_documents.read_manifest(store, 'r1')
+        report_documents.write_report(store, 'r1', dict(self.report, report_content='<h1>New</h1>'),
+                                      metadata={'Report_ID': 'r1'})
+        self.assertEqual(report_documents.read_report(store, 'r1', parts=('content',)),
+                         {'report_content': '<h1>New</h1>'})
+
+        # a reader that loaded the old manifest before the rewrite still finds its parts
+        names = report_documents.blobs_to_read(old_manifest, ('content', 'chunks'))
+        old = report_documents.assemble(old_manifest, ('content', 'chunks'), {name: store.get(name) for name in names})
+        self.assertEqual(old['report_content'], '<h1>Title</h1>')
+        self.assertEqual(report_documents.prune_report(store, 'r1'), 0)  # within the grace period
+
+        self.assertEqual(report_documents.prune_report(store, 'r1', grace=0), 5)  # 4 parts + the legacy JSON
+        blobs = store.list('r1/')[0]
+        self.assertEqual(len(blobs), 5)  # manifest + content + citations + 2 chunk pages
+        self.assertEqual([blob.name for blob in blobs if report_documents.is_report_document(blob)],
+                         [report_documents.manifest_name('r1')])
+        self.assertEqual(report_documents.read_report(store, 'r1', parts=('content',)),
+                         {'report_content': '<h1>New</h1>'})
+
+    @override_settings(REPORT_CHUNK_PAGE_SIZE=4)
+    def test_chunk_window_reads_only_overlapping_pages(self):
+        store = InMemoryReportStore()
+        chunks = [{'i': i} for i in range(10)]
+        report_documents.write_report(store, 'r1', dict(self.report, research_chunks=chunks),
+                                      metadata={'Report_ID': 'r1'})
+        manifest = json.loads(store.get(report_documents.manifest_name('r1')))
+        self.assertEqual(len(manifest['chunks']['pages']), 3)
+        self.assertEqual(len(report_documents.blobs_to_read(manifest, ('chunks',), 5, 2)), 1)
+
+        result = report_documents.read_report(store, 'r1', parts=('chunks',), chunks_offset=3, chunks_limit=3)
+        self.assertEqual(result['research_chunks'], chunks[3:6])
+        self.assertEqual(result['research_chunks_total'], 10)
+        result = report_documents.read_report(store, 'r1', parts=('chunks',), chunks_offset=8)
+        self.assertEqual(result['research_chunks'], chunks[8:])
+
+
+
+class HTMLStreamTestCase(TestCase):
+    def test_find_title(self):
+        chunks = iter([b'<p>intro</p><h', b'1 class="t">Caf\xc3', b'\xa9 &amp; <b>bar</b></h1><h1>second</h1>'])
+        self.assertEqual(html_stream.find_title(chunks), 'Caf\xe9 & bar')
+        self.assertEqual(html_stream.find_title('<h4>Data</h4>', tags=('h4',)), 'Data')
+        self.assertIsNone(html_stream.find_title('<p>none</p>'))
+
+    def test_rewrite_img_src(self):
+        source = '<p>a &amp; b</p><img src="x.png" alt="x"><img src=\'file://y.png\'/><!-- c -->'
+        output = rewrite_img_src([source[:20].encode(), source[20:].encode()], 't1', None)
+        self.assertEqual(output, '<p>a &amp; b</p>'
+                                 '<img src="http://localhost:8000/api/core/download/t1/x.png/?show_image=true" alt="x">'
+                                 '<img src="http://localhost:8000/api/core/download/t1/y.png/?show_image=true"/><!-- c -->')
+
+
+@override_settings(REPORT_STORES=IN_MEMORY_REPORT_STORES, VISIT_BUFFERED=False)
+class ReportViewsTestCase(TestCase):
+    def setUp(self):
+        self.tenant = models.Tenant.objects.create(name='Tenant', email='t@example.com', phone='1')
+        self.user = User.objects.create_user(email='u@example.com', password='pw', tenant=self.tenant)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_upload_then_fetch_report(self):
+        response = self.client.post('/api/core/upload-report/', {
+            'report_id': 'r1',
+            'report_content': '<h1>Impact</h1><p>body</p>',
+            'report_citations': ['c1'],
+            'research_chunks': [{'text': 'chunk'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(get_report_store('report').exists('r1/report/manifest.json'))
+
+        response = self.client.get('/api/core/fetch-report/', {'report_id': 'r1'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['report_title'], 'Impact')
+        self.assertEqual(data['research_chunks'], [{'text': 'chunk'}])
+
+        response = self.client.get('/api/core/fetch-report-as-html/', {'report_id': 'r1'})
+        self.assertEqual(response.content, b'<h1>Impact</h1><p>body</p>')
+
+    def test_fetch_report_fields_and_chunk_cursor(self):
+        chunks = [{'i': i} for i in range(5)]
+        self.client.post('/api/core/upload-report/', {
+            'report_id': 'r2',
+            'report_content': '<h1>Impact</h1>',
+            'research_chunks': chunks,
+        }, format='json')
+
+        data = self.client.get('/api/core/fetch-report/', {'report_id': 'r2', 'fields': 'citations'}).json()
+        self.assertEqual(data, {'report_id': 'r2', 'report_title': 'Impact', 'report_citations': []})
+
+        params = {'report_id': 'r2', 'fields': 'chunks', 'chunks_limit': 2}
+        received = []
+        while True:
+            data = self.client.get('/api/core/fetch-report/', params).json()
+            received.extend(data['research_chunks'])
+            self.assertEqual(data['research_chunks_total'], 5)
+            if not data['next_cursor']:
+                break
+            params = {'report_id': 'r2', 'fields': 'chunks', 'chunks_cursor': data['next_cursor']}
+        self.assertEqual(received, chunks)
+
+        response = self.client.get('/api/core/fetch-report/', {'report_id': 'r2', 'fields': 'everything'})
+        self.assertEqual(response.status_code, 400)
+        for params, message in [({'chunks_offset': -1}, 'chunks_offset must not be negative'),
+                                ({'chunks_offset': 'x'}, 'chunks_offset must be an integer'),
+                                ({'chunks_limit': 0}, 'chunks_limit must be between 1 and 200'),
+                                ({'chunks_cursor': '!!'}, 'chunks_cursor is invalid')]:
+            response = self.client.get('/api/core/fetch-report/', dict(params, report_id='r2'))
+            self.assertEqual((response.status_code, response.json()['message']), (400, message))
+
+    def test_report_etag_revalidation(self):
+        def upload(content):
+            self.client.post('/api/core/upload-report/', {'report_id': 'r3', 'report_content': content}, format='json')
+
+        upload('<h1>One</h1>')
+        response = self.client.get('/api/core/fetch-report-as-html/', {'report_id': 'r3'})
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        response = self.client.get('/api/core/fetch-report-as-html/', {'report_id': 'r3'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/api/core/fetch-report/', {'report_id': 'r3', 'fields': 'content'})
+        self.assertNotEqual(response['ETag'], etag)
+
+        upload('<h1>Two</h1>')
+        response = self.client.get('/api/core/fetch-report-as-html/', {'report_id': 'r3'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'<h1>Two</h1>')
+
+
+    def test_list_reports_from_index(self):
+        for i in range(3):
+            self.client.post('/api/core/upload-report/', {
+                'report_id': f'{self.tenant.uuid}/r{i}', 'report_content': f'<h1>Report {i}</h1>',
+            }, format='json')
+        entry = models.ReportIndex.objects.get(report_id=f'{self.tenant.uuid}/r1')
+        self.assertEqual((entry.title, entry.tenant), ('Report 1', self.tenant))
+        self.assertGreater(entry.size, 0)
+
+        params = {'ordering': 'last_modified', 'limit': 2, 'count': 'true'}
+        data = self.client.get('/api/core/list-reports/', params).json()
+        self.assertEqual(data['count'], 3)
+        received = [report['report_title'] for report in data['reports']]
+        data = self.client.get('/api/core/list-reports/', dict(params, continuation_token=data['continuation_token'])).json()
+        received += [report['report_title'] for report in data['reports']]
+        self.assertEqual((received, data['continuation_token']), (['Report 0', 'Report 1', 'Report 2'], None))
+
+        response = self.client.get('/api/core/list-reports/', {'search': 'report 2'})
+        self.assertEqual([report['report_title'] for report in response.json()['reports']], ['Report 2'])
+        response = self.client.get('/api/core/list-reports/', {'ordering': 'title'})
+        self.assertEqual(response.status_code, 400)
+
+        # the index is rebuilt from blob
+        models.ReportIndex.objects.all().delete()
+        call_command('reindex_reports', stdout=io.StringIO())
+        self.assertEqual(models.ReportIndex.objects.filter(tenant=self.tenant).count(), 3)
+
+    def test_search_reports_and_stories(self):
+        for report_id, content in [('r4', '<h1>Food bank</h1><p>Meals served to families</p>'),
+                                   ('r5', '<h1>Shelter</h1><p>Food drives <script>meals()</script></p>')]:
+            self.client.post('/api/core/upload-report/', {'report_id': report_id, 'report_content': content}, format='json')
+        other = models.Tenant.objects.create(name='Other', email='o@example.com', phone='2')
+        search.index_report(other, 'r6', 'Meals', '<p>meals</p>')
+        search.index_story(self.tenant, 'storyRoom/s1', 'Ann - Housing', 'The shelter <b>served</b> meals')
+
+        data = self.client.get('/api/core/search/', {'q': 'meals'}).json()
+        self.assertEqual([result['key'] for result in data['results']], ['r4'])  # stories are for tenant admins
+        self.assertIn('«Meals»', data['results'][0]['snippet'])
+        data = self.client.get('/api/core/search/', {'q': 'food', 'limit': 1}).json()
+        self.assertEqual((data['results'][0]['key'], data['next_offset']), ('r4', 1))  # title ranks above body
+        data = self.client.get('/api/core/search/', {'q': 'food', 'limit': 1, 'offset': 1}).json()
+        self.assertEqual(([result['key'] for result in data['results']], data['next_offset']), (['r5'], None))
+
+        self.user.is_tenant_admin = True
+        self.user.save()
+        data = self.client.get('/api/core/search/', {'q': 'shelter meals', 'kind': 'story'}).json()
+        self.assertEqual(data['results'][0]['snippet'], 'The «shelter» <b>served</b> «meals»')  # stored as submitted
+        response = self.client.get('/api/core/search/', {'q': 'meals', 'kind': 'image'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(REPORT_STORES=IN_MEMORY_REPORT_STORES, VISIT_BUFFERED=False)
+class StoryListTestCase(TestCase):
+    def setUp(self):
+        self.tenant = models.Tenant.objects.create(name='Tenant', email='t@example.com', phone='1')
+        self.user = User.objects.create_user(email='a@example.com', password='pw', tenant=self.tenant, is_tenant_admin=True)
+        self.client = APIClient()
+
+    @mock.patch('core.views.StoryRoomUpload.recaptcha', return_value={'success': True, 'action': 'story_room', 'score': 0.9})
+    def test_list_filter_and_delete(self, recaptcha):
+        for name, category in [('Ann', 'Housing'), ('Bob', 'Food'), ('Cid', 'Housing')]:
+            response = self.client.post('/api/core/story-room/upload/', {
+                'tenant_uuid': str(self.tenant.uuid), 'name': name, 'category': category, 'story': f'story of {name}',
+            }, format='json')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(story_ingestion.drain(), 3)
+        self.client.force_authenticate(self.user)
+
+        params = {'category': 'Housing', 'limit': 1, 'count': 'true'}
+        data = self.client.get('/api/core/story/list/', params).json()
+        self.assertEqual(data['count'], 2)
+        received = [story['created_by'] for story in data['blobs']]
+        data = self.client.get('/api/core/story/list/', dict(params, continuation_token=data['continuation_token'])).json()
+        received += [story['created_by'] for story in data['blobs']]
+        self.assertEqual((sorted(received), data['continuation_token']), (['Ann', 'Cid'], None))
+        response = self.client.get('/api/core/story/list/', {'created_after': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+        # only stories of the tenant of the user can be deleted
+        other = models.Tenant.objects.create(name='Other', email='o@example.com', phone='2')
+        get_report_store('rag').put(f'{other.uuid}/storyRoom/x.txt', b'x')
+        response = self.client.delete('/api/core/story/', {'file_name': f'{other.uuid}/storyRoom/x.txt'}, format='json')
+        self.assertEqual(response.status_code, 404)
+        story = models.StorySubmission.objects.get(created_by='Bob')
+        response = self.client.delete('/api/core/story/', {'file_name': story.blob_name}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(get_report_store('rag').exists(story.blob_name))
+
+        # the catalogue is rebuilt from blob
+        models.StorySubmission.objects.all().delete()
+        call_command('reconcile_stories', stdout=io.StringIO())
+        self.assertEqual(models.StorySubmission.objects.filter(tenant=self.tenant).count(), 2)
+        self.assertEqual(models.StorySubmission.objects.get(created_by='Ann').category, 'Housing')
+
+    def test_failed_uploads_are_retried_with_backoff(self):
+        upload = story_ingestion.enqueue_story(self.tenant, 'Ann', 'Housing', 'story')
+        with mock.patch.object(InMemoryReportStore, 'put', side_effect=OSError('unavailable')):
+            self.assertEqual(story_ingestion.process_batch(), 1)
+        upload.refresh_from_db()
+        self.assertEqual((upload.status, upload.attempts, upload.error), ('pending', 1, 'unavailable'))
+        self.assertGreater(upload.next_attempt_at, upload.submitted_at)
+        self.assertEqual(story_ingestion.process_batch(), 0)  # not due yet
+        # the in-process drain sets a timer for the retry
+        self.assertAlmostEqual(story_ingestion.next_wakeup(), settings.STORY_INGEST_RETRY_DELAY, delta=1)
+        with mock.patch('core.story_ingestion._schedule_wakeup') as schedule_wakeup:
+            story_ingestion._scheduled_drain()
+        self.assertAlmostEqual(schedule_wakeup.call_args.args[0], settings.STORY_INGEST_RETRY_DELAY, delta=1)
+
+        models.StoryUpload.objects.filter(pk=upload.pk).update(next_attempt_at=upload.submitted_at)
+        self.assertEqual(story_ingestion.process_batch(), 1)
+        self.assertFalse(models.StoryUpload.objects.exists())
+        self.assertTrue(get_report_store('rag').exists(upload.blob_name))
+        self.assertTrue(models.StorySubmission.objects.filter(blob_name=upload.blob_name).exists())
+        self.assertIsNone(story_ingestion.next_wakeup())
+
+    def test_stale_uploads_are_requeued_by_the_drain(self):
+        upload = story_ingestion.enqueue_story(self.tenant, 'Ann', 'Housing', 'story')
+        claimed_at = timezone.now() - timedelta(seconds=settings.STORY_INGEST_STALE_AFTER)
+        models.StoryUpload.objects.filter(pk=upload.pk).update(status='uploading', claimed_at=claimed_at)
+        self.assertEqual(story_ingestion.next_wakeup(), 0)
+        with mock.patch('core.story_ingestion._schedule_wakeup') as schedule_wakeup:
+            story_ingestion._scheduled_drain()
+        self.assertFalse(models.StoryUpload.objects.exists())
+        self.assertFalse(schedule_wakeup.called)
+
+    def test_upload_rejects_unknown_tenant(self):
+        with mock.patch('core.views.StoryRoomUpload.recaptcha', return_value={'success': True, 'action': 'story_room', 'score': 0.9}):
+            response = self.client.post('/api/core/story-room/upload/', {
+                'tenant_uuid': 'nope', 'name': 'Ann', 'category': 'Housing', 'story': 'story'}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(models.StoryUpload.objects.exists())
+
+
+@override_settings(CACHES={
+    'tiered': {'BACKEND': 'core.tiered_cache.TieredCache', 'LOCATION': 'tiered-test',
+               'OPTIONS': {'REMOTE': 'remote', 'LOCAL_TIMEOUT': 60, 'LOCAL_MAX_ENTRIES': 2}},
+    'remote': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tiered-test-remote'},
+})
+class TieredCacheTestCase(TestCase):
+    def setUp(self):
+        caches['tiered'].clear()
+
+    def test_reads_are_local_after_the_first(self):
+        tiered, remote = caches['tiered'], caches['remote']
+        tiered.set('feed', ['a'])
+        with mock.patch.object(type(remote), 'get', side_effect=AssertionError):
+            value = tiered.get('feed')
+            value.append('b')  # the cached copy is not changed
+            self.assertEqual(tiered.get('feed'), ['a'])
+
+        # another process changed the remote value: seen once the local entry is gone
+        remote.set(tiered.make_key('feed'), ['c'])
+        self.assertEqual(tiered.get('feed'), ['a'])
+        tiered.clear_local()
+        self.assertEqual(tiered.get('feed'), ['c'])
+
+        self.assertTrue(tiered.add('lock', 1))
+        self.assertFalse(tiered.add('lock', 1))
+        self.assertEqual(tiered.incr('lock'), 2)
+        self.assertEqual(tiered.get('lock'), 2)
+        tiered.delete('feed')
+        self.assertIsNone(tiered.get('feed'))
+        self.assertIsNone(remote.get(tiered.make_key('feed')))
+
+    def test_local_entries_expire_with_the_timeout(self):
+        tiered, remote = caches['tiered'], caches['remote']
+        tiered.set('gone', 'v', 0)
+        self.assertIsNone(tiered.get('gone'))
+
+        tiered.set('short', 'v', 1)  # shorter than LOCAL_TIMEOUT
+        self.assertEqual(tiered.get('short'), 'v')
+        now = time.monotonic()
+        with mock.patch('core.tiered_cache.time.monotonic', return_value=now + 1.5), \
+                mock.patch.object(type(remote), 'get', side_effect=lambda key, default=None, version=None: default):
+            self.assertIsNone(tiered.get('short'))
+
+
+@override_settings(VISIT_BUFFERED=False)
+class StoryRoomThrottleTestCase(TestCase):
+    def setUp(self):
+        self.tenant = models.Tenant.objects.create(name='Food Bank', email='t@example.com', phone='1')
+        models.StoryRoom.objects.create(tenant=self.tenant, categories=['Housing'])
+        throttling.local_buckets.clear()
+        cache.clear()
+
+    def test_verify_is_cached_and_throttled(self):
+        rates = {'story_room_ip': '3/min', 'story_room_tenant': '100/min'}
+        with override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES=rates)), \
+                mock.patch('core.story_rooms._load', wraps=story_rooms._load) as load:
+            response = self.client.post('/api/core/story-room/verify/', {'tenant_name': 'food bank'})
+            self.assertEqual(response.json()['tenant_uuid'], str(self.tenant.uuid))
+            response = self.client.post('/api/core/story-room/verify/', {'tenant_name': 'FOOD BANK'})
+            self.assertEqual((response.status_code, load.call_count), (200, 1))
+            response = self.client.post('/api/core/story-room/verify/', {'tenant_name': 'other'})
+            self.assertEqual(response.status_code, 404)
+            response = self.client.post('/api/core/story-room/verify/', {'tenant_name': 'food bank'})
+            self.assertEqual((response.status_code, load.call_count), (429, 2))  # 4th request of the IP
+            self.assertGreater(int(response['Retry-After']), 0)
+
+        # disabling the story room invalidates the cached configuration
+        story_room = models.StoryRoom.objects.get(tenant=self.tenant)
+        story_room.enabled = False
+        story_room.save()
+        response = self.client.post('/api/core/story-room/verify/', {'tenant_name': 'food bank'}, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 404)
+
+    def test_spoofed_forwarded_for_keeps_the_ip_bucket(self):
+        url = '/api/core/story-room/verify/'
+        rates = {'story_room_ip': '2/min', 'story_room_tenant': '100/min'}
+        for num_proxies, client_ip in ((0, ''), (1, ', 10.0.0.9')):
+            throttling.local_buckets.clear()
+            cache.clear()
+            rest_framework = dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES=rates, NUM_PROXIES=num_proxies)
+            with self.subTest(num_proxies=num_proxies), override_settings(REST_FRAMEWORK=rest_framework):
+                statuses = [
+                    self.client.post(url, {'tenant_name': 'food bank'}, HTTP_X_FORWARDED_FOR=f'192.0.2.{i}{client_ip}').status_code
+                    for i in range(3)
+                ]
+                self.assertEqual(statuses, [200, 200, 429])
+
+
+@override_settings(REPORT_STORES=IN_MEMORY_REPORT_STORES, VISIT_BUFFERED=False)
+class DownloadViewTestCase(TestCase):
+    url = '/api/core/download/t1/story.txt/'
+
+    def setUp(self):
+        get_report_store('chat_bot').put('t1/story.txt', b'0123456789', content_type='text/plain')
+
+    def test_streams_with_range(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 7-9/10')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3', HTTP_IF_RANGE='"outdated"')
+        self.assertEqual((response.status_code, b''.join(response.streaming_content)), (200, b'0123456789'))
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_conditional_download(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_show_html_with_cached_base_template(self):
+        tenant = models.Tenant.objects.create(name='Tenant', email='t@example.com', phone='1')
+        user = User.objects.create_user(email='u@example.com', password='pw', tenant=tenant)
+        template = models.ReportBaseTemplate.objects.create(
+            title='story', template_file='base_report_template/story.html', is_official=True, category='PDF')
+        media = get_report_store('media')
+        media.put('base_report_template/story.html', b'<main>{{ blob_content|safe }}</main>')
+        get_report_store('chat_bot').put('t1/story.html', b'<p>story</p>')
+
+        with mock.patch.object(media, 'get', wraps=media.get) as get:
+            for _ in range(2):
+                response = self.client.get('/api/core/download/t1/story.html/', {'show_html': 'true', 'user_id': user.id})
+                self.assertEqual(response.content, b'<main><p>story</p></main>')
+            self.assertEqual(get.call_count, 1)
+
+            media.put('base_report_template/story.html', b'<article>{{ blob_content|safe }}</article>')
+            template.save()  # invalidated
+            response = self.client.get('/api/core/download/t1/story.html/', {'show_html': 'true', 'user_id': user.id})
+            self.assertEqual(response.content, b'<article><p>story</p></article>')
+
+
+@override_settings(REPORT_STORES=IN_MEMORY_REPORT_STORES, VISIT_BUFFERED=False)
+class AsyncViewsTestCase(TestCase):
+    """the async views read the configured stores like the sync ones"""
+
+    def setUp(self):
+        self.tenant = models.Tenant.objects.create(name='Tenant', email='t@example.com', phone='1')
+        self.user = User.objects.create_user(email='u@example.com', password='pw', tenant=self.tenant, is_tenant_admin=True)
+        self.auth = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        store = get_report_store('report')
+        report_id = f'{self.tenant.uuid}/r1'
+        report_documents.write_report(store, report_id, {'report_content': '<h1>Impact</h1>', 'research_chunks': [{'i': 0}]},
+                                      metadata={'Report_ID': report_id}, title='Impact')
+        report_index.sync_report(store, report_id, self.tenant)
+        story = get_report_store('rag').put(f'{self.tenant.uuid}/storyRoom/s1.txt', b'story',
+                                            metadata={'Category': 'Housing', 'Created_By_Display_Name': 'Ann'})
+        story_index.record_story(story, self.tenant)
+        get_report_store('chat_bot').put('t1/story.txt', b'0123456789', content_type='text/plain')
+
+    async def test_fetch_report(self):
+        response = await self.async_client.get('/api/core/async/fetch-report/', {'report_id': f'{self.tenant.uuid}/r1'}, headers=self.auth)
+        data = json.loads(response.content)
+        self.assertEqual((data['report_title'], data['research_chunks']), ('Impact', [{'i': 0}]))
+        response = await self.async_client.get('/api/core/async/fetch-report/', {'report_id': 'r1'})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_fetch_report_as_html(self):
+        response = await self.async_client.get('/api/core/async/fetch-report-as-html/', {'report_id': f'{self.tenant.uuid}/r1'})
+        self.assertEqual(response.content, b'<h1>Impact</h1>')
+        response = await self.async_client.get('/api/core/async/fetch-report-as-html/', {'report_id': f'{self.tenant.uuid}/r1'},
+                                               headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_list_reports(self):
+        response = await self.async_client.get('/api/core/async/list-reports/', headers=self.auth)
+        self.assertEqual([report['report_title'] for report in json.loads(response.content)['reports']], ['Impact'])
+
+    async def test_story_list(self):
+        response = await self.async_client.get('/api/core/async/story/list/', headers=self.auth)
+        self.assertEqual([story['created_by'] for story in json.loads(response.content)['blobs']], ['Ann'])
+
+    async def test_download_streams_with_range(self):
+        response = await self.async_client.get('/api/core/async/download/t1/story.txt/')
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'0123456789')
+        response = await self.async_client.get('/api/core/async/download/t1/story.txt/', headers={'Range': 'bytes=-3'})
+        self.assertEqual((response.status_code, response['Content-Range']), (206, 'bytes 7-9/10'))
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'789')
+        response = await self.async_client.get('/api/core/async/download/t1/missing.txt/')
+        self.assertEqual(response.status_code, 404)
+
+
+class BlobCacheTestCase(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.source = InMemoryReportStore()
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def test_fetch_revalidates_by_etag(self):
+        cache = BlobCache(self.location, max_bytes=1000, revalidate_after=0)
+        source_blob = self.source.put('r1/a.png', b'one', content_type='image/png')
+        cache.fetch(self.source, 'r1/a.png')
+        cache.fetch(self.source, 'r1/a.png')
+        self.assertEqual(cache.get_properties('r1/a.png').etag, source_blob.etag)
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(cache.stats()['revalidations'], 1)
+
+        self.source.put('r1/a.png', b'two')
+        cache.fetch(self.source, 'r1/a.png')
+        self.assertEqual(cache.get('r1/a.png'), b'two')
+
+        self.source.delete('r1/a.png')
+        with self.assertRaises(BlobNotFound):
+            cache.fetch(self.source, 'r1/a.png')
+        self.assertFalse(cache.exists('r1/a.png'))
+
+    def test_evicts_least_recently_used(self):
+        cache = BlobCache(self.location, max_bytes=250, revalidate_after=60, low_watermark=1)
+        for i in range(3):
+            self.source.put(f'r1/{i}.png', b'x' * 100)
+            cache.fetch(self.source, f'r1/{i}.png')
+            if i == 1:
+                cache.fetch(self.source, 'r1/0.png')  # hit, 0 is now used more recently than 1
+        self.assertTrue(cache.exists('r1/0.png'))
+        self.assertFalse(cache.exists('r1/1.png'))
+        self.assertTrue(cache.exists('r1/2.png'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['size'], 200)
+
+
+@override_settings(REPORT_STORES=IN_MEMORY_REPORT_STORES, VISIT_BUFFERED=False)
+class FetchReportImageViewTestCase(TestCase):
+    url = '/api/core/fetch-image-report/'
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        override = override_settings(BLOB_CACHE_LOCATION=self.location)
+        override.enable()
+        self.addCleanup(override.disable)
+        image = io.BytesIO()
+        Image.new('RGB', (1000, 500), 'red').save(image, format='PNG')
+        # stored with a wrong content type, the real one is sniffed
+        get_report_store('report').put('r1/a.jpg', image.getvalue(), content_type='image/jpeg')
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def test_original_with_sniffed_type(self):
+        response = self.client.get(self.url, {'image_key': 'r1/a.jpg'})
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(Image.open(io.BytesIO(b''.join(response.streaming_content))).width, 1000)
+
+    def test_width_and_webp_variant(self):
+        for _ in range(2):  # generated, then served from the cache
+            response = self.client.get(self.url, {'image_key': 'r1/a.jpg', 'w': 300}, HTTP_ACCEPT='image/webp,*/*')
+            self.assertEqual(response['Content-Type'], 'image/webp')
+            image = Image.open(io.BytesIO(b''.join(response.streaming_content)))
+            self.assertEqual((image.format, image.size), ('WEBP', (320, 160)))
+        variants = get_report_store('report').list('image-variants/report/r1/a.jpg/')[0]
+        self.assertEqual(len(variants), 1)
+        self.assertEqual([blob.name for blob in get_report_store('report').list('r1/')[0]], ['r1/a.jpg'])
+
+        response = self.client.get(self.url, {'image_key': 'r1/a.jpg', 'w': 'wide'})
+        self.assertEqual(response.status_code, 400)
+
+
+def converter_response(status_code, content=b''):
+    response = mock.MagicMock(status_code=status_code)
+    response.iter_content.side_effect = lambda chunk_size=1: iter([content[:2], content[2:]])
+    response.__enter__.return_value = response
+    return response
+
+
+# bulk downloads convert in threads, they cannot use the sqlite test database during the test transaction
+@override_settings(REPORT_STORES=IN_MEMORY_REPORT_STORES, API_DOMAIN='http://api', PDF_FUNC_DOMAIN='http://pdf',
+                   VISIT_BUFFERED=False)
+class ExportJobTestCase(TestCase):
+    def setUp(self):
+        self.tenant = models.Tenant.objects.create(name='Tenant', email='t@example.com', phone='1')
+        self.user = User.objects.create_user(email='u@example.com', password='pw', tenant=self.tenant)
+        self.portfolio = models.Portfolio.objects.create(
+            user=self.user, tenant=self.tenant, category='story', title='t', html_file_key='t1/story.html')
+        models.ReportBaseTemplate.objects.create(
+            title='story', template_file='base_report_template/story.html', is_official=True, category='PDF')
+        get_report_store('report').delete_prefix('t1/')
+        get_report_store('report').put('t1/story.html', b'<h4>Story</h4>')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # the worker threads use their own connections, jobs are run here instead
+        patcher = mock.patch('core.exports.close_old_connections')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def export(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(f'/api/core/portfolios/{self.portfolio.pk}/exports/', {'fileType': 'PDF'}, format='json')
+        return response, callbacks
+
+    @mock.patch('core.exports.requests.get')
+    def test_export_job(self, get):
+        get.return_value = converter_response(200, b'%PDF')
+        response, callbacks = self.export()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(callbacks), 1)
+        job_id = response.json()['uuid']
+        self.assertIsNone(response.json()['download_url'])
+
+        self.assertTrue(exports.run_job(job_id))
+        self.assertFalse(exports.run_job(job_id))  # claimed once
+        self.assertTrue(get.call_args.args[0].startswith('http://pdf/api/convert-html-to-pdf?url='))
+
+        data = self.client.get(f'/api/core/export-jobs/{job_id}/').json()
+        self.assertEqual(data['status'], 'done')
+        response = self.client.get(data['download_url'])
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF')
+
+        # the stored artifact is reused until the html changes
+        artifact = models.ExportJob.objects.get(pk=job_id).artifact_name
+        self.assertRegex(artifact, r'^t1/exports/story-[0-9a-f]{16}\.pdf$')
+        response, callbacks = self.export()
+        self.assertEqual((response.status_code, response.json()['status'], len(callbacks)), (200, 'done', 0))
+        self.assertEqual(get.call_count, 1)
+
+        url = f'/api/core/portfolios/{self.portfolio.pk}/exports/'
+        self.assertFalse(self.client.get(url).json()['PDF']['stale'])
+        get_report_store('report').put('t1/story.html', b'<h4>Story 2</h4>')
+        self.assertTrue(self.client.get(url).json()['PDF']['stale'])
+
+        response, callbacks = self.export()
+        self.assertEqual(response.status_code, 202)
+        exports.run_job(response.json()['uuid'])
+        self.assertEqual(get.call_count, 2)
+        new_artifact = models.ExportJob.objects.get(pk=response.json()['uuid']).artifact_name
+        self.assertNotEqual(new_artifact, artifact)
+        self.assertEqual(self.client.get(url).json()['PDF']['artifact'], new_artifact)
+
+        # the first job keeps its download until the retention ends
+        self.assertEqual(exports.prune_artifacts(), 0)
+        self.assertEqual(self.client.get(f'/api/core/export-jobs/{job_id}/download/').status_code, 200)
+        self.assertEqual(exports.prune_artifacts(retention=-1), 1)
+        self.assertFalse(get_report_store('report').exists(artifact))
+        self.assertTrue(get_report_store('report').exists(new_artifact))  # current
+        self.assertEqual(self.client.get(f'/api/core/export-jobs/{job_id}/download/').status_code, 404)
+
+    @mock.patch('core.exports.requests.get')
+    def test_legacy_download_queues_the_export(self, get):
+        get.return_value = converter_response(200, b'%PDF')
+        url = f'/api/core/portfolios/{self.portfolio.pk}/download/'
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.get(url, {'fileType': 'PDF'})
+        self.assertEqual((response.status_code, len(callbacks), get.call_count), (202, 1, 0))  # not converted inline
+        self.assertTrue(response['Location'].endswith(f"/api/core/export-jobs/{response.json()['uuid']}/"))
+
+        exports.run_job(response.json()['uuid'])
+        response = self.client.get(url, {'fileType': 'PDF'})
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF')
+        self.assertEqual(get.call_count, 1)
+
+    @mock.patch('core.exports.requests.get')
+    def test_prewarm_after_upload(self, get):
+        get.return_value = converter_response(200, b'%PDF')
+
+        def upload(content):
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.client.post('/api/core/upload-report/', {'report_id': 'r9', 'report_content': content}, format='json')
+            return callbacks
+
+        self.assertEqual(upload('<h1>One</h1>'), [])  # never exported
+        portfolio = models.Portfolio.objects.get(report_id='r9')
+        exports.build_artifact(portfolio, 'PDF', True, self.user)
+        self.assertEqual(len(upload('<h1>Two</h1>')), 1)
+        self.assertEqual(upload('<h1>Three</h1>'), [])  # already pending
+        job = models.ExportJob.objects.get(portfolio=portfolio)
+        self.assertEqual((job.file_type, job.is_impact_report, job.status), ('PDF', True, 'pending'))
+
+    @override_settings(EXPORT_LOCK_POLL_INTERVAL=0)
+    def test_single_flight(self):
+        with exports.single_flight('t1/exports/story-0.pdf', 'PDF') as convert_it:
+            self.assertTrue(convert_it)
+            get_report_store('report').put('t1/exports/story-0.pdf', b'%PDF')
+            # a concurrent conversion waits for the holder of the lock and takes its artifact
+            with exports.single_flight('t1/exports/story-0.pdf', 'PDF') as convert_it:
+                self.assertFalse(convert_it)
+        with exports.single_flight('t1/exports/story-0.pdf', 'PDF') as convert_it:
+            self.assertFalse(convert_it)
+
+    def test_single_flight_releases_only_its_lock(self):
+        key = 'export-lock:t1/exports/story-1.pdf'
+        with exports.single_flight('t1/exports/story-1.pdf', 'PDF'):
+            cache.set(key, 'other')  # expired, then taken by another conversion
+        self.assertEqual(cache.get(key), 'other')
+        cache.delete(key)
+        with exports.single_flight('t1/exports/story-1.pdf', 'PDF'):
+            self.assertIsNotNone(cache.get(key))
+        self.assertIsNone(cache.get(key))
+
+    @mock.patch('core.exports.requests.get')
+    def test_failed_export(self, get):
+        get.return_value = converter_response(500)
+        job_id = self.export()[0].json()['uuid']
+        exports.run_job(job_id)
+        job = models.ExportJob.objects.get(pk=job_id)
+        self.assertEqual((job.status, job.error), ('failed', 'Failed to retrieve data from the converter'))
+        response = self.client.get(f'/api/core/export-jobs/{job_id}/download/')
+        self.assertEqual(response.status_code, 409)
+
+    @mock.patch('core.exports.requests.get')
+    def test_bulk_download(self, get):
+        get.return_value = converter_response(200, b'%PDF')
+        portfolios = []
+        for report_id in ('ra', 'rb'):
+            report_documents.write_report(get_report_store('report'), report_id, {'report_content': '<h1>R</h1>'}, {})
+            portfolios.append(models.Portfolio.objects.create(
+                user=self.user, tenant=self.tenant, category='impactReport', title='Board pack', report_id=report_id))
+
+        response = self.client.post('/api/core/portfolios/bulk-download/', {
+            'portfolios': [str(portfolio.pk) for portfolio in portfolios], 'fileTypes': ['PDF'],
+        }, format='json')
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(sorted(archive.namelist()), ['Board_pack (2).pdf', 'Board_pack.pdf'])
+        self.assertEqual(archive.read('Board_pack.pdf'), b'%PDF')
+
+        response = self.client.post('/api/core/portfolios/bulk-download/', {'portfolios': ['x'], 'fileTypes': ['PDF']}, format='json')
+        self.assertEqual(response.status_code, 400)
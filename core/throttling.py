@@ -0,0 +1,113 @@
+"""token-bucket throttles of the anonymous story room endpoints
+
+StoryRoomVerify and StoryRoomUpload are public, a script hammering them used to turn every
+request into tenant queries and reCAPTCHA calls. DRF runs these throttles before the view:
+
+    class StoryRoomUpload(APIView):
+        throttle_classes = [StoryRoomIPThrottle, StoryRoomTenantThrottle]
+        throttle_tenant_field = 'tenant_uuid'   # request data identifying the story room
+
+A scope rate of `REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']`, e.g. '30/min', is a bucket of
+30 tokens refilled at 30 per minute: bursts up to the capacity, then the steady rate.
+
+- every process keeps its own buckets (THROTTLE_LOCAL_MAX_KEYS most recent keys), a client
+  that emptied it is refused without any cache call
+- the bucket that counts is in the shared cache (THROTTLE_CACHE), so the limit holds across
+  processes. Its read-modify-write is not atomic, concurrent requests of one key in several
+  processes may get a few requests more than the rate
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class LocalBuckets:
+    """token buckets of the most recent keys of this process"""
+
+    def __init__(self):
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill, now):
+        """take a token of `key`, return the tokens left or None when there was none"""
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill)
+            taken = tokens >= 1
+            if taken:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > settings.THROTTLE_LOCAL_MAX_KEYS:
+                self._buckets.popitem(last=False)
+        return tokens if taken else None
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+local_buckets = LocalBuckets()
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """SimpleRateThrottle with a token bucket instead of the request history"""
+
+    def get_rate(self):
+        # read at every request, SimpleRateThrottle.THROTTLE_RATES is fixed at import
+        self.THROTTLE_RATES = api_settings.DEFAULT_THROTTLE_RATES
+        return super().get_rate()
+
+    def get_ident_value(self, request, view):
+        raise NotImplementedError
+
+    def get_cache_key(self, request, view):
+        value = self.get_ident_value(request, view)
+        if not value:
+            return None
+        ident = hashlib.sha256(str(value).encode('utf-8')).hexdigest()[:32]
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        self.refill = self.num_requests / self.duration
+        if local_buckets.take(self.key, self.num_requests, self.refill, self.now) is None:
+            self.tokens = 0
+            return False
+
+        cache = caches[settings.THROTTLE_CACHE]
+        tokens, updated = cache.get(self.key) or (self.num_requests, self.now)
+        self.tokens = min(self.num_requests, tokens + (self.now - updated) * self.refill)
+        if self.tokens < 1:
+            return False
+        cache.set(self.key, (self.tokens - 1, self.now), self.duration)
+        return True
+
+    def wait(self):
+        return max(0, (1 - self.tokens) / self.refill)
+
+
+class StoryRoomIPThrottle(TokenBucketThrottle):
+    scope = 'story_room_ip'
+
+    def get_ident_value(self, request, view):
+        return self.get_ident(request)
+
+
+class StoryRoomTenantThrottle(TokenBucketThrottle):
+    """bucket of the story room named by `view.throttle_tenant_field` of the request data"""
+    scope = 'story_room_tenant'
+
+    def get_ident_value(self, request, view):
+        value = request.data.get(view.throttle_tenant_field)
+        return value.strip().lower() if isinstance(value, str) else None
@@ -0,0 +1,172 @@
+"""two-tier cache backend: a per-process LRU in front of a shared cache (Redis)
+
+    CACHES = {
+        'redis': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL},
+        'default': {
+            'BACKEND': 'core.tiered_cache.TieredCache',
+            'LOCATION': 'default',   # names the LRU, shared by the threads of the process
+            'OPTIONS': {'REMOTE': 'redis', 'LOCAL_TIMEOUT': 5, 'LOCAL_MAX_ENTRIES': 1000},
+        },
+    }
+
+- reads are served from the LRU for at most LOCAL_TIMEOUT seconds, then from the remote
+  cache, whose hits are copied into the LRU. Misses are not kept
+- writes and deletes go to both tiers, so this process sees its own changes at once. Other
+  processes may read the previous value up to LOCAL_TIMEOUT seconds longer
+- add, incr, decr and touch are left to the remote cache (locks, counters), the local copy
+  is dropped
+
+KEY_PREFIX and VERSION of this alias are passed to the remote cache with each key. Values
+are pickled in the LRU like in LocMemCache, a caller mutating a result does not change it.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# LOCATION -> (LRU, lock), Django creates a backend instance per thread
+_locals = {}
+_locals_lock = threading.Lock()
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._remote_alias = options['REMOTE']
+        self._local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self._local_max_entries = options.get('LOCAL_MAX_ENTRIES', 1000)
+        with _locals_lock:
+            # key -> (monotonic expiry, pickled value)
+            self._local, self._lock = _locals.setdefault(location, (OrderedDict(), threading.Lock()))
+
+    @property
+    def remote(self):
+        return caches[self._remote_alias]
+
+    def _remote_key(self, key, version):
+        # the remote alias applies its own prefix and version on top
+        return self.make_and_validate_key(key, version=version)
+
+    # local tier
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return entry[1]
+
+    def _local_set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        # seconds from now, get_backend_timeout() returns an expiry time
+        timeout = self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+        local_timeout = self._local_timeout if timeout is None else min(timeout, self._local_timeout)
+        if local_timeout <= 0:
+            self._local_delete(key)
+            return
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._local[key] = (time.monotonic() + local_timeout, pickled)
+            self._local.move_to_end(key)
+            while len(self._local) > self._local_max_entries:
+                self._local.popitem(last=False)
+
+    def _local_delete(self, key):
+        with self._lock:
+            self._local.pop(key, None)
+
+    # cache API
+
+    def get(self, key, default=None, version=None):
+        key = self._remote_key(key, version)
+        pickled = self._local_get(key)
+        if pickled is not None:
+            return pickle.loads(pickled)
+        missing = object()
+        value = self.remote.get(key, missing)
+        if value is missing:
+            return default
+        self._local_set(key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        found, remote_keys = {}, {}
+        for key in keys:
+            full_key = self._remote_key(key, version)
+            pickled = self._local_get(full_key)
+            if pickled is None:
+                remote_keys[full_key] = key
+            else:
+                found[key] = pickle.loads(pickled)
+        if remote_keys:
+            for full_key, value in self.remote.get_many(list(remote_keys)).items():
+                self._local_set(full_key, value)
+                found[remote_keys[full_key]] = value
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._remote_key(key, version)
+        timeout = self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+        self.remote.set(key, value, timeout)
+        self._local_set(key, value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        keys = {self._remote_key(key, version): key for key in data}
+        timeout = self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+        failed = set(self.remote.set_many({full_key: data[key] for full_key, key in keys.items()}, timeout))
+        for full_key, key in keys.items():
+            if full_key not in failed:
+                self._local_set(full_key, data[key], timeout)
+        return [keys[full_key] for full_key in failed]
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._remote_key(key, version)
+        timeout = self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+        self._local_delete(key)
+        return self.remote.add(key, value, timeout)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._remote_key(key, version)
+        timeout = self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+        self._local_delete(key)
+        return self.remote.touch(key, timeout)
+
+    def incr(self, key, delta=1, version=None):
+        key = self._remote_key(key, version)
+        self._local_delete(key)
+        return self.remote.incr(key, delta)
+
+    def decr(self, key, delta=1, version=None):
+        return self.incr(key, -delta, version)
+
+    def has_key(self, key, version=None):
+        key = self._remote_key(key, version)
+        return self._local_get(key) is not None or self.remote.has_key(key)
+
+    def delete(self, key, version=None):
+        key = self._remote_key(key, version)
+        self._local_delete(key)
+        return self.remote.delete(key)
+
+    def delete_many(self, keys, version=None):
+        keys = [self._remote_key(key, version) for key in keys]
+        for key in keys:
+            self._local_delete(key)
+        self.remote.delete_many(keys)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        self.remote.clear()
+
+    def clear_local(self):
+        """forget the local tier of this process"""
+        with self._lock:
+            self._local.clear()
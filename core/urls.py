@@ -5,12 +5,14 @@ from core import views as core_views
 from core import views_donate
 from core import views_feedback
 from core import views_editor
+from core import views_async
 
 router = DefaultRouter()
 router.register(r'portfolios', core_views.PortfolioViewSet, basename='portfolio')
 router.register(r'report_base_templates', core_views.ReportBaseTemplateViewSet, basename='reportBaseTemplate')
 router.register(r'story-rooms', core_views.StoryRoomViewSet, basename='story-rooms')
 router.register(r'release-notes', core_views.ReleaseNoteViewSet, basename='release-notes')
+router.register(r'export-jobs', core_views.ExportJobViewSet, basename='export-jobs')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -27,6 +29,7 @@ urlpatterns = [
     path("story-room/upload/", core_views.StoryRoomUpload.as_view(), name="story-room-upload"),
     path("story/list/", core_views.StoryList.as_view(), name="story-list"),
     path("story/", core_views.Story.as_view(), name="story-detail"),
+    path("search/", core_views.SearchView.as_view(), name="search"),
 
     path("donate/", views_donate.DonateView.as_view(), name="donate"),
     path("donate-return/", views_donate.DonateReturnView.as_view(), name="donate-return"),
@@ -41,7 +44,15 @@ urlpatterns = [
     path("fetch-image-report/", views_editor.FetchReportImageView.as_view(), name="fetch-report"),
     path("list-reports/", views_editor.ReportListView.as_view(), name="list-reports"),
     path("fetch-report-as-html/", views_editor.FetchReportAsHtmlView.as_view(), name="fetch-report-as-html"),
+    path("blob-cache/stats/", views_editor.BlobCacheStatsView.as_view(), name="blob-cache-stats"),
 
     path("news-feed/", core_views.NewsFeedView.as_view(), name="news-feed"),
 
+    # asyncio versions of the blob views, served by daphne without blocking a worker thread
+    path("async/download/<str:blob>/<path:name>/", views_async.AsyncDownloadView.as_view(), name="async-download"),
+    path("async/fetch-report/", views_async.AsyncFetchReportView.as_view(), name="async-fetch-report"),
+    path("async/fetch-report-as-html/", views_async.AsyncFetchReportAsHtmlView.as_view(), name="async-fetch-report-as-html"),
+    path("async/list-reports/", views_async.AsyncReportListView.as_view(), name="async-list-reports"),
+    path("async/story/list/", views_async.AsyncStoryList.as_view(), name="async-story-list"),
+
 ]
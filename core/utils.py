@@ -1,18 +1,18 @@
 import logging
 from django.conf import settings
-from bs4 import BeautifulSoup
 
 from azure.communication.email import EmailClient
 
+from core.html_stream import find_title
+
 logger = logging.getLogger(__name__)
 
 
 def extract_title(content):
     if not content:
         return "Untitled Report"
-    soup = BeautifulSoup(content, 'html.parser')
-    h1 = soup.find('h1')
-    return h1.text if h1 else "Untitled Report"
+    title = find_title(content, tags=('h1',))
+    return title if title is not None else "Untitled Report"
 
 
 def send_cancellation_email(subscription_id, customer_email, tenant_name):
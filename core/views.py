@@ -1,22 +1,21 @@
 import re
 import datetime
-import io
 import logging
 from datetime import timedelta
 
 import requests
-from urllib.parse import quote
 from django.conf import settings
-from django.http import HttpResponse
-from django.template import Context, Template
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template import Context
 from django.utils.decorators import method_decorator
 from django.views.decorators.clickjacking import xframe_options_exempt
 from django.utils import timezone
-from django.urls import reverse
 from django.http import Http404
 from django.db.models import Q
+from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
+from django.urls import reverse
 
 from rest_framework.views import APIView
 from rest_framework import generics
@@ -24,13 +23,23 @@ from rest_framework import status, viewsets, mixins
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from azure.storage.blob import BlobClient, BlobServiceClient
-from bs4 import BeautifulSoup
 from exa_py import Exa
 
 from core import models
 from core import serializers
+from core import exports
+from core import report_index
+from core import search
+from core import story_index
+from core import story_ingestion
+from core.blob_responses import stream_blob, streaming_attachment, streaming_content, json_string_chunks
+from core.html_stream import find_title, rewrite_html
+from core.image_variants import image_response
+from core.report_store import BlobNotFound, get_report_store
 from core.services import DataConnectionService
+from core.story_rooms import get_story_room_config
+from core.template_cache import get_base_template
+from core.throttling import StoryRoomIPThrottle, StoryRoomTenantThrottle
 from authentication.permissions import TenantAdminPermission
 
 logger = logging.getLogger(__name__)
@@ -73,211 +82,115 @@ class PortfolioViewSet(viewsets.ModelViewSet):
         serializer.save(user=user, tenant=tenant, title=title)
 
     def copy_blob(self, blob_key):
-        blob_service_client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONNECTION_STRING)
-        source_blob = blob_service_client.get_blob_client(container=settings.AZURE_STORAGE_CHAT_BOT_CONTAINER_NAME, blob=blob_key)
-        target_blob = blob_service_client.get_blob_client(container=settings.AZURE_STORAGE_REPORT_CONTAINER_NAME, blob=blob_key)
-        target_blob.start_copy_from_url(source_blob.url)
+        get_report_store('report').copy(get_report_store('chat_bot'), blob_key)
 
     def get_html_title(self, blob_key, category):
-        blob_service_client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONNECTION_STRING)
-        blob_client = blob_service_client.get_blob_client(container=settings.AZURE_STORAGE_CHAT_BOT_CONTAINER_NAME, blob=blob_key)
-
-        blob_data = blob_client.download_blob()
-        html_content = blob_data.readall()
-
-        soup = BeautifulSoup(html_content, 'html.parser')
-        title_tag = soup.find('h4')
+        # only the blob up to the first h4 is downloaded
+        chunks, _ = get_report_store('chat_bot').open(blob_key)
+        title = find_title(chunks, tags=('h4',))
 
         current_time = timezone.localtime()
         formatted_time = current_time.strftime("%Y-%m-%d_%H-%M-%S")
 
-        return title_tag.get_text() if title_tag else f'Data{category}_{formatted_time}'
+        return title if title is not None else f'Data{category}_{formatted_time}'
 
     def perform_destroy(self, instance):
         blob_key = instance.html_file_key
         if instance.category == "impactReport":
             blob_key = instance.report_id + "/"
+            report_index.remove_report(instance.report_id)
+            search.remove_document('report', instance.report_id)
         self.delete_blob_and_directory_contents(blob_key)
         instance.delete()
 
     def delete_blob_and_directory_contents(self, blob_key):
         directory_path = '/'.join(blob_key.split('/')[:-1])
 
-        blob_service_client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONNECTION_STRING)
-        container = blob_service_client.get_container_client(settings.AZURE_STORAGE_REPORT_CONTAINER_NAME)
+        get_report_store('report').delete_prefix(directory_path)
 
-        for blob in container.list_blobs(name_starts_with=directory_path):
-            blob_client = container.get_blob_client(blob)
-            blob_client.delete_blob()
+    def _export_params(self, params):
+        file_type = params.get('fileType', None)
+        if file_type not in exports.FILE_TYPES:
+            return None, None
+        return file_type, params.get('isImpactReport', None) in ('true', True)
 
     @action(detail=True)
     def download(self, request, pk=None):
-        is_impact_report = request.query_params.get('isImpactReport', None)
-        file_type = request.query_params.get('fileType', None)
+        """the stored export, otherwise the export is queued: 202 with the job to poll (Location)"""
         portfolio = self.get_object()
-        html_file_key = portfolio.html_file_key
-
-        if is_impact_report == 'true' and file_type == 'PDF':
-            report_url = request.build_absolute_uri(f"{reverse('fetch-report-as-html')}?report_id={portfolio.report_id}")
-            pdf_content = self.get_impact_pdf(report_url, portfolio.report_id)
-            if pdf_content:
-                response = HttpResponse(content_type='application/pdf')
-                response['Content-Disposition'] = 'attachment; filename="report.pdf"'
-                response.write(pdf_content)
-                return response
-        elif is_impact_report == 'true' and file_type == 'DOC':
-            report_url = request.build_absolute_uri(f"{reverse('fetch-report-as-html')}?report_id={portfolio.report_id}")
-            doc_content = self.get_impact_doc(report_url, portfolio.report_id)
-            if doc_content:
-                response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-                response['Content-Disposition'] = 'attachment; filename="report.docx"'
-                response.write(doc_content)
-                return response
-        
-        if file_type == 'PDF':
-            pdf_content = self.get_pdf(html_file_key, portfolio.category)
-            if pdf_content:
-                response = HttpResponse(content_type='application/pdf')
-                response['Content-Disposition'] = 'attachment; filename="report.pdf"'
-                response.write(pdf_content)
-                return response
-        elif file_type == 'PPT':
-            ppt_content = self.get_ppt(html_file_key, portfolio.category)
-            if ppt_content:
-                response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.presentationml.presentation')
-                response['Content-Disposition'] = 'attachment; filename="report.ppt"'
-                response.write(ppt_content)
-                return response
-        elif file_type == 'DOC':
-            doc_content = self.get_doc(html_file_key, portfolio.category)
-            if doc_content:
-                response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-                response['Content-Disposition'] = 'attachment; filename="report.docx"'
-                response.write(doc_content)
-                return response
-        else:
+        file_type, is_impact_report = self._export_params(request.query_params)
+        if file_type is None:
             return Response({'message': 'No report content found'}, status=status.HTTP_400_BAD_REQUEST)
-    
-    def get_impact_pdf(self, report_url, report_id):
-        pdf_file_key = f"{report_id}/{report_id}.pdf"
-        blob_service_client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONNECTION_STRING)
-        blob_client = blob_service_client.get_blob_client(
-            container=settings.AZURE_STORAGE_REPORT_CONTAINER_NAME,
-            blob=pdf_file_key)
-
-        if blob_client.exists():
-            blob_data = blob_client.download_blob()
-            blob_content = blob_data.readall()
-            return blob_content
-        else:
-            pdf_url = f"{settings.PDF_FUNC_DOMAIN}/api/convert-html-to-pdf?url={report_url}"
-            response = requests.get(pdf_url)
-            if response.status_code == 200:
-                return response.content
-            else:
-                raise Exception("Failed to retrieve data from the converter")
-    
-    def get_impact_doc(self, report_url, report_id):
-        self.get_impact_pdf(report_url, report_id)  # make sure PDF file exists
-
-        doc_file_key = f"{report_id}/{report_id}.docx"
-        blob_service_client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONNECTION_STRING)
-        blob_client = blob_service_client.get_blob_client(
-            container=settings.AZURE_STORAGE_REPORT_CONTAINER_NAME,
-            blob=doc_file_key)
-
-        if blob_client.exists():
-            blob_data = blob_client.download_blob()
-            blob_content = blob_data.readall()
-            return blob_content
-        else:
-            path_name = report_id
-            html_name = f"{report_id}.html"
-            doc_url = f"{settings.DOC_FUNC_DOMAIN}&path_name={path_name}&html_name={html_name}"
-            response = requests.get(doc_url)
-            if response.status_code == 200:
-                return response.content
-            else:
-                raise Exception("Failed to retrieve data from the converter")
 
+        try:
+            name = exports.stored_export(portfolio, file_type, is_impact_report, request.user)
+            job = None if name else exports.start_export(portfolio, file_type, is_impact_report, request.user)
+        except exports.ExportError as e:
+            return Response({'message': str(e)}, status=status.HTTP_404_NOT_FOUND)
+        if job is not None:
+            serializer = serializers.ExportJobSerializer(job, context={'request': request})
+            location = request.build_absolute_uri(reverse('export-jobs-detail', kwargs={'pk': job.pk}))
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED, headers={'Location': location})
 
-    def get_pdf(self, html_file_key, category):
-        pdf_file_key = html_file_key.replace('.html', '.pdf')
-        blob_service_client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONNECTION_STRING)
-        blob_client = blob_service_client.get_blob_client(
-            container=settings.AZURE_STORAGE_REPORT_CONTAINER_NAME,
-            blob=pdf_file_key)
+        try:
+            chunks, properties = get_report_store('report').open(name)
+        except BlobNotFound:  # replaced meanwhile
+            return Response({'message': 'Export not found, request it again'}, status=status.HTTP_404_NOT_FOUND)
+        _, content_type, filename = exports.FILE_TYPES[file_type]
+        return streaming_attachment(request, chunks, properties.size, content_type, filename)
+
+    @action(detail=True, methods=['get', 'post'], url_path='exports')
+    def create_export(self, request, pk=None):
+        """queue the export, poll the returned job and download it from export-jobs
+
+        GET returns the manifest of the last export of every type, `stale` when the report
+        or template changed since
+        """
+        portfolio = self.get_object()
+        if request.method == 'GET':
+            is_impact_report = request.query_params.get('isImpactReport', None) == 'true'
+            try:
+                return Response(exports.export_states(portfolio, is_impact_report, request.user))
+            except exports.ExportError as e:
+                return Response({'message': str(e)}, status=status.HTTP_404_NOT_FOUND)
 
-        if blob_client.exists():
-            blob_data = blob_client.download_blob()
-            blob_content = blob_data.readall()
-            return blob_content
-        else:
-            original_url = f"{settings.API_DOMAIN}/api/core/download/{html_file_key}/?show_html=true&category={category}&is_portfolio_page=true&user_id={self.request.user.id}"
-            escaped_url = quote(original_url, safe='')
-            pdf_url = f"{settings.PDF_FUNC_DOMAIN}/api/convert-html-to-pdf?url={escaped_url}"
-            response = requests.get(pdf_url)
-            if response.status_code == 200:
-                return response.content
-            else:
-                raise Exception("Failed to retrieve data from the converter")
-    
-    def get_ppt(self, html_file_key, category):
-        ppt_file_key = html_file_key.replace('.html', '.pptx')
-        blob_service_client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONNECTION_STRING)
-        blob_client = blob_service_client.get_blob_client(
-            container=settings.AZURE_STORAGE_REPORT_CONTAINER_NAME,
-            blob=ppt_file_key)
-
-        if blob_client.exists():
-            blob_data = blob_client.download_blob()
-            blob_content = blob_data.readall()
-            return blob_content
-        else:
-            # NOTE: official template don't use is_approved field, MUST CONTAIN THE CATEGORY
-            default_template = models.ReportBaseTemplate.objects.get(title__icontains=category, is_official=True, category='PPT')
-            template_file = default_template.template_file.url.split('/')[-1]
+        file_type, is_impact_report = self._export_params(request.data)
+        if file_type is None:
+            return Response({'message': 'fileType must be one of PDF, PPT, DOC'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            job = exports.start_export(portfolio, file_type, is_impact_report, request.user)
+        except exports.ExportError as e:
+            return Response({'message': str(e)}, status=status.HTTP_404_NOT_FOUND)
+        serializer = serializers.ExportJobSerializer(job, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_200_OK if job.status == 'done' else status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['post'], url_path='bulk-download')
+    def bulk_download(self, request):
+        """ZIP of the exports of several portfolios, `{"portfolios": [uuid], "fileTypes": ["PDF", "DOC"]}`"""
+        uuids = request.data.get('portfolios') or []
+        file_types = request.data.get('fileTypes') or ['PDF']
+        if not isinstance(uuids, list) or not isinstance(file_types, list) \
+                or any(file_type not in exports.FILE_TYPES for file_type in file_types):
+            return Response({'message': 'portfolios must be a list of uuids, fileTypes of PDF, PPT, DOC'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(uuids) * len(file_types) > settings.EXPORT_BULK_MAX_ITEMS:
+            return Response({'message': f'At most {settings.EXPORT_BULK_MAX_ITEMS} exports per download'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            portfolios = list(self.get_queryset().filter(uuid__in=uuids))
+        except ValidationError:
+            return Response({'message': 'portfolios must be a list of uuids'}, status=status.HTTP_400_BAD_REQUEST)
+        items = [
+            (portfolio, file_type, portfolio.category == 'impactReport')
+            for portfolio in portfolios for file_type in file_types
+        ]
+        if not items:
+            return Response({'message': 'No report content found'}, status=status.HTTP_404_NOT_FOUND)
+        chunks = exports.bulk_export_chunks(items, request.user)
+        return streaming_attachment(request, chunks, None, 'application/zip', 'reports.zip')
 
-            user = self.request.user
-            tenant = user.tenant
-            template_of_tenant = models.ReportBaseTemplate.objects.filter(tenant=tenant, is_approved=True, is_default=True, category='PPT').first()
-            if template_of_tenant:
-                template_file = template_of_tenant.template_file.url.split('/')[-1]
-
-            file_key_group = html_file_key.split('/')
-            path_name = file_key_group[0]
-            html_name = file_key_group[1]
-            ppt_url = f"{settings.PPT_FUNC_DOMAIN}&path_name={path_name}&html_name={html_name}&template_file={template_file}"
-            response = requests.get(ppt_url)
-            if response.status_code == 200:
-                return response.content
-            else:
-                raise Exception("Failed to retrieve data from the converter")
-    
-    def get_doc(self, html_file_key, category):
-        self.get_pdf(html_file_key, category)  # make sure PDF file exists
-
-        doc_file_key = html_file_key.replace('.html', '.docx')
-        blob_service_client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONNECTION_STRING)
-        blob_client = blob_service_client.get_blob_client(
-            container=settings.AZURE_STORAGE_REPORT_CONTAINER_NAME,
-            blob=doc_file_key)
-
-        if blob_client.exists():
-            blob_data = blob_client.download_blob()
-            blob_content = blob_data.readall()
-            return blob_content
-        else:
-            file_key_group = html_file_key.split('/')
-            path_name = file_key_group[0]
-            html_name = file_key_group[1]
-            doc_url = f"{settings.DOC_FUNC_DOMAIN}&path_name={path_name}&html_name={html_name}"
-            response = requests.get(doc_url)
-            if response.status_code == 200:
-                return response.content
-            else:
-                raise Exception("Failed to retrieve data from the converter")
-    
     @action(detail=False)
     def latest(self, request):
         user = self.request.user
@@ -293,6 +206,9 @@ class PortfolioViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
+IMG_SRC = re.compile(r'<img src=["\'](?:file://)?([^"\']+?)["\']')
+
+
 def create_replace_function(blob_name, is_portfolio_page):
     def replace_src(match):
         image_name = match.group(1)
@@ -302,6 +218,40 @@ def create_replace_function(blob_name, is_portfolio_page):
     return replace_src
 
 
+def rewrite_img_src(html_content, blob_name, is_portfolio_page):
+    """point `<img src=...>` of chat bot HTML to DownloadView
+
+    `html_content` is a str or the chunks of the blob, rewritten in one pass as they arrive
+    """
+    replace_src = create_replace_function(blob_name, is_portfolio_page)
+    return rewrite_html(html_content, lambda tag: IMG_SRC.sub(replace_src, tag, count=1))
+
+
+class ExportJobViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """export jobs of the user, queued by `POST portfolios/{uuid}/exports/`"""
+    queryset = models.ExportJob.objects.all()
+    serializer_class = serializers.ExportJobSerializer
+    permission_classes = [IsAuthenticated]
+    filterset_fields = ['portfolio', 'status']
+
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user)
+
+    @action(detail=True)
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != 'done':
+            return Response({'message': f'Export is {job.status}', 'error': job.error}, status=status.HTTP_409_CONFLICT)
+        if not job.artifact_name:
+            return Response({'message': 'Export not found'}, status=status.HTTP_404_NOT_FOUND)  # pruned
+        _, content_type, filename = exports.FILE_TYPES[job.file_type]
+        try:
+            return stream_blob(request, get_report_store('report'), job.artifact_name,
+                               content_type=content_type, filename=filename)
+        except BlobNotFound:
+            return Response({'message': 'Export not found'}, status=status.HTTP_404_NOT_FOUND)
+
+
 @method_decorator(xframe_options_exempt, name='dispatch')
 class DownloadView(APIView):
     """ User can retrieve specific files (image or HTML) from Azure Blob Storage 
@@ -317,72 +267,36 @@ class DownloadView(APIView):
         is_portfolio_page = request.query_params.get('is_portfolio_page')
         blob_name = f"{kwargs['blob']}/{file_name}"
         
-        container_name = settings.AZURE_STORAGE_CHAT_BOT_CONTAINER_NAME
+        store_alias = 'chat_bot'
         if is_portfolio_page:
-            container_name = settings.AZURE_STORAGE_REPORT_CONTAINER_NAME
-        
+            store_alias = 'report'
         if show_document:
-            container_name = settings.AZURE_STORAGE_RAG_CONTAINER_NAME
-            blob_client = BlobClient.from_connection_string(
-                conn_str=settings.AZURE_STORAGE_RAG_CONNECTION_STRING,
-                container_name=container_name,
-                blob_name=blob_name)
-        else:
-            blob_client = BlobClient.from_connection_string(
-                conn_str=settings.AZURE_STORAGE_CONNECTION_STRING,
-                container_name=container_name,
-                blob_name=blob_name)
-        
-        try:
-            blob_data = blob_client.download_blob()
-            content_type = blob_client.get_blob_properties().content_settings.content_type
-            blob_content = blob_data.readall()
+            store_alias = 'rag'
+
+        store = get_report_store(store_alias)
 
+        try:
             if show_image:
-                response = HttpResponse(blob_content, content_type="image/png", status=status.HTTP_200_OK)
+                return image_response(request, store_alias, blob_name)
             elif show_html:
-                blob_content = blob_content.decode("utf-8")
-                pattern = r'<img src=["\'](?:file://)?([^"\']+?)["\']'
-                blob_content = re.sub(pattern, create_replace_function(kwargs['blob'], is_portfolio_page), blob_content)
-                base_html_template = self.get_base_html_template(category)
-                template = Template(base_html_template)
+                chunks, _ = store.open(blob_name)
+                blob_content = rewrite_img_src(chunks, kwargs['blob'], is_portfolio_page)
+                template = self.get_base_template(category)
                 context = Context({'blob_content': blob_content})
                 return HttpResponse(template.render(context))
             else:
-                response = HttpResponse(blob_content, content_type=content_type, status=status.HTTP_200_OK)
-                response['Content-Disposition'] = f'attachment; filename="{file_name}"'
-            return response
+                return stream_blob(request, store, blob_name, filename=file_name)
         except Exception as e:
             return HttpResponse(f"Error: {str(e)}", status=status.HTTP_404_NOT_FOUND)
 
-    def get_base_html_template(self, category):
+    def get_base_template(self, category):
         user_id = self.request.query_params.get('user_id')
         if user_id:
             UserModel = get_user_model()
             user = UserModel.objects.get(id=user_id)
         else:
             user = self.request.user
-        tenant = user.tenant
-
-        container_name = settings.AZURE_STORAGE_MEDIA_CONTAINER_NAME
-        blob_name = None
-
-        template_of_tenant = models.ReportBaseTemplate.objects.filter(tenant=tenant, is_approved=True, is_default=True, category='PDF').first()
-        if template_of_tenant:
-            blob_name = template_of_tenant.template_file.url.split('/')[-1]
-            blob_name = f'base_report_template/{blob_name}'
-        else:
-            template = models.ReportBaseTemplate.objects.get(is_official=True, category='PDF', title__icontains=category)
-            blob_name = template.template_file.url.split('/')[-1]
-            blob_name = f'base_report_template/{blob_name}'
-
-        blob_client = BlobClient.from_connection_string(
-            conn_str=settings.AZURE_STORAGE_CONNECTION_STRING,
-            container_name=container_name,
-            blob_name=blob_name)
-        blob_data = blob_client.download_blob()
-        blob_content = blob_data.readall()
-        return blob_content.decode("utf-8")
+        return get_base_template(user, category)
 
 
 class ReportBaseTemplateViewSet(viewsets.ModelViewSet):
@@ -493,37 +407,27 @@ class StoryRoomViewSet(viewsets.ModelViewSet):
 
 class StoryRoomVerify(APIView):
     """CZ-107, ananymous verify by `Tenant Name` before they can upload story"""
+    authentication_classes = []
     permission_classes = []
+    throttle_classes = [StoryRoomIPThrottle, StoryRoomTenantThrottle]
+    throttle_tenant_field = 'tenant_name'
 
     def post(self, request, *args, **kwargs):
-        tenant_name = request.data.get('tenant_name')
-        error_message = 'Unrecognized Story Room'
-
-        try:
-            tenant = models.Tenant.objects.get(name__iexact=tenant_name)
-        except models.Tenant.DoesNotExist:
-            return Response({'error': error_message}, status=status.HTTP_404_NOT_FOUND)
-        try:
-            story_room_instance = models.StoryRoom.objects.get(tenant=tenant, enabled=True)
-        except models.StoryRoom.DoesNotExist:
-            return Response({'error': error_message}, status=status.HTTP_404_NOT_FOUND)
-
-        data = {
-            'tenant_uuid': tenant.uuid,
-            'logo': tenant.logo.url if tenant.logo else None,
-            'categories': story_room_instance.categories,
-            'allow_donation': story_room_instance.allow_donation
-        }
+        data = get_story_room_config(request.data.get('tenant_name'))
+        if data is None:
+            return Response({'error': 'Unrecognized Story Room'}, status=status.HTTP_404_NOT_FOUND)
         return Response(data, status=status.HTTP_200_OK)
 
 
-def sanitize_metadata_value(value):
-    return ''.join(char for char in value if ord(char) < 128)
-
-
 class StoryRoomUpload(APIView):
-    """CZ-107, upload story"""
+    """CZ-107, upload story
+
+    the story is queued and uploaded in the background, see core/story_ingestion.py
+    """
+    authentication_classes = []
     permission_classes = []
+    throttle_classes = [StoryRoomIPThrottle, StoryRoomTenantThrottle]
+    throttle_tenant_field = 'tenant_uuid'
 
     @staticmethod
     def recaptcha(request_data):
@@ -531,47 +435,76 @@ class StoryRoomUpload(APIView):
             'response': request_data.get('token'),
             'secret': settings.RECAPTCHA_V3_SECRET_KEY
         }
-        resp = requests.post('https://www.google.com/recaptcha/api/siteverify', data=data)
+        resp = requests.post('https://www.google.com/recaptcha/api/siteverify', data=data,
+                             timeout=settings.RECAPTCHA_TIMEOUT)
         result_json = resp.json()
         return result_json
 
     def post(self, request, *args, **kwargs):
-        recaptcha_result = self.recaptcha(request.data)
+        try:
+            recaptcha_result = self.recaptcha(request.data)
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"recaptcha v3 verification failed: {e}")
+            return Response('service unavailable', status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
         logger.info(f"recaptcha v3 result: {recaptcha_result}")
-        if not recaptcha_result.get('success') or recaptcha_result.get('action') != 'story_room' or recaptcha_result.get('score') < 0.5:
+        if not recaptcha_result.get('success') or recaptcha_result.get('action') != 'story_room' or (recaptcha_result.get('score') or 0) < 0.5:
             return Response('bad request', status=status.HTTP_403_FORBIDDEN)
 
         tenant_uuid = request.data.get('tenant_uuid')
         name = request.data.get('name')
         category = request.data.get('category')
         story = request.data.get('story')
+        if not all(isinstance(value, str) and value for value in (name, category, story)):
+            return Response('name, category and story are required', status=status.HTTP_400_BAD_REQUEST)
+        try:
+            tenant = models.Tenant.objects.get(uuid=tenant_uuid)
+        except (models.Tenant.DoesNotExist, ValidationError):
+            return Response('tenant not found', status=status.HTTP_404_NOT_FOUND)
 
-        current = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        filename = sanitize_metadata_value(f"{name}-{category}-{current}.txt")
-
-        metadata = {
-            'Created_By_Display_Name': name,
-            'Created_At': current,
-            'Last_Modified_By_Display_Name': name,
-            'Last_Modified_At': current,
-            'Category': category,
-            'Summary': sanitize_metadata_value(story[:128])
-        }
-
-        blob_service_client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_RAG_CONNECTION_STRING)
-        container_client = blob_service_client.get_container_client(container=settings.AZURE_STORAGE_RAG_CONTAINER_NAME)
-        text = f"""
-            StoryRoom Feedback: {category}
-            Name: {name}
+        story_ingestion.enqueue_story(tenant, name, category, story)
+        return Response('ok', status=status.HTTP_200_OK)
 
-            Date: {current}
-            Story: {story}
-        """
-        data = io.BytesIO(text.encode('utf-8'))
-        container_client.upload_blob(name=f"{tenant_uuid}/storyRoom/{filename}", data=data, overwrite=True, metadata=metadata)
 
-        return Response('ok', status=status.HTTP_200_OK)
+def parse_date(value, name):
+    """date or datetime of the ISO string `value`, None when empty, raise ValueError"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 date or datetime")
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
+def parse_story_list_params(query_params):
+    """keyword arguments of story_index.list_stories, raise ValueError"""
+    limit = int(query_params.get('limit') or 100)
+    if not 0 < limit <= settings.STORY_LIST_MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {settings.STORY_LIST_MAX_LIMIT}")
+    return {
+        'ordering': query_params.get('ordering') or '-created_at',
+        'cursor': query_params.get('continuation_token') or None,
+        'limit': limit,
+        'category': query_params.get('category') or None,
+        'created_by': query_params.get('created_by') or None,
+        'created_after': parse_date(query_params.get('created_after'), 'created_after'),
+        'created_before': parse_date(query_params.get('created_before'), 'created_before'),
+    }
+
+
+def list_stories_data(tenant, query_params):
+    """body of StoryList, raise ValueError"""
+    params = parse_story_list_params(query_params)
+    entries, continuation_token = story_index.list_stories(tenant, **params)
+    data = {
+        'blobs': [story_index.serialize_entry(entry) for entry in entries],
+        'continuation_token': continuation_token,
+    }
+    if query_params.get('count') == 'true':
+        filters = {key: value for key, value in params.items() if key not in ('ordering', 'cursor', 'limit')}
+        data['count'] = story_index.count_stories(tenant, **filters)
+    return data
 
 
 class StoryList(APIView):
@@ -579,73 +512,67 @@ class StoryList(APIView):
     permission_classes = [TenantAdminPermission]
 
     def get(self, request, *args, **kwargs):
-        user = request.user
-        tenant_uuid = user.tenant.uuid
-
-        blob_service_client = BlobServiceClient.from_connection_string(
-            settings.AZURE_STORAGE_RAG_CONNECTION_STRING
-        )
-        container_client = blob_service_client.get_container_client(
-            container=settings.AZURE_STORAGE_RAG_CONTAINER_NAME
-        )
-
-        continuation_token = request.query_params.get('continuation_token') or None
-        blob_list = container_client.list_blobs(
-            name_starts_with=f"{tenant_uuid}/storyRoom/",
-            include=['metadata'],
-            results_per_page=100
-        )
-        blobs = blob_list.by_page(continuation_token)
-        response_data = []
-        current_page = blobs.next()
-        for blob in current_page:
-            response_data.append({
-                'file_name': blob['name'],
-                'etag': blob['etag'],
-                'created_by': blob['metadata'].get('Created_By_Display_Name'),
-                'created_at': blob['metadata'].get('Created_At'),
-                'category': blob['metadata'].get('Category'),
-                'summary': blob['metadata'].get('Summary'),
-            })
-
-        return Response({
-            'blobs': response_data,
-            'continuation_token': blobs.continuation_token
-        }, status=status.HTTP_200_OK)
+        try:
+            data = list_stories_data(request.user.tenant, request.query_params)
+        except ValueError as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data, status=status.HTTP_200_OK)
 
 
 class Story(APIView):
     """CZ-138, delete story blob of a tenant by name"""
     permission_classes = [TenantAdminPermission]
 
-    @staticmethod
-    def _get_blob_client(file_name):
-        blob_service_client = BlobServiceClient.from_connection_string(
-            settings.AZURE_STORAGE_RAG_CONNECTION_STRING
-        )
-        container_client = blob_service_client.get_container_client(
-            container=settings.AZURE_STORAGE_RAG_CONTAINER_NAME
-        )
-        blob_client = container_client.get_blob_client(blob=file_name)
-        return blob_client
-
     def get(self, request, *args, **kwargs):
         file_name = request.query_params.get('fileName', None)
-        if file_name:
-            blob_client = self._get_blob_client(file_name)
-            blob_data = blob_client.download_blob().readall()
-            text_content = blob_data.decode('utf-8')
-        else:
-            text_content = ""
-        return Response(text_content, status=status.HTTP_200_OK)
+        if not file_name:
+            return Response("", status=status.HTTP_200_OK)
+        # the same JSON string as Response(text) renders, without reading the story into memory
+        chunks, _ = get_report_store('rag').open(file_name)
+        return StreamingHttpResponse(streaming_content(request, json_string_chunks(chunks)),
+                                     content_type='application/json')
 
     def delete(self, request, *args, **kwargs):
         file_name = request.data.get('file_name')
-        blob_client = self._get_blob_client(file_name)
-        blob_client.delete_blob()
+        if not models.StorySubmission.objects.filter(blob_name=file_name, tenant=request.user.tenant).exists():
+            raise Http404
+        get_report_store('rag').delete(file_name)
+        story_index.remove_story(file_name)
+        search.remove_document('story', file_name)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+def parse_search_params(query_params, user):
+    """keyword arguments of search.search, raise ValueError"""
+    limit = int(query_params.get('limit') or 20)
+    if not 0 < limit <= settings.SEARCH_MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {settings.SEARCH_MAX_LIMIT}")
+    offset = int(query_params.get('offset') or 0)
+    if offset < 0:
+        raise ValueError("offset must not be negative")
+    kinds = query_params.get('kind')
+    kinds = kinds.split(',') if kinds else list(search.KINDS)
+    unknown = set(kinds) - set(search.KINDS)
+    if unknown:
+        raise ValueError(f"kind must be one of {', '.join(search.KINDS)}")
+    if not user.is_tenant_admin:  # stories are listed to tenant admins only (StoryList)
+        kinds = [kind for kind in kinds if kind != 'story']
+    return {'query': query_params.get('q') or '', 'kinds': kinds, 'limit': limit, 'offset': offset}
+
+
+class SearchView(APIView):
+    """ranked full-text search over the reports and stories of the tenant, see core/search.py"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            params = parse_search_params(request.query_params, request.user)
+        except ValueError as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        results, next_offset = search.search(request.user.tenant, **params)
+        return Response({'results': results, 'next_offset': next_offset}, status=status.HTTP_200_OK)
+
+
 class ReleaseNoteViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
     queryset = models.ReleaseNote.objects.all()
     serializer_class = serializers.ReleaseNoteSerializer
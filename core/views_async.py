@@ -0,0 +1,192 @@
+"""asyncio versions of the read-heavy blob views
+
+They run on the daphne event loop and read the same REPORT_STORES as the sync views
+through the async store methods (aget, aopen, ...). With Azure they await
+azure.storage.blob.aio, so a single process keeps many blob reads in flight instead of
+blocking one worker thread per request. DRF views are sync only, authentication is done
+with the same DRF classes in a thread.
+"""
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse, JsonResponse
+from django.template import Context
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.clickjacking import xframe_options_exempt
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from core import http_cache
+from core import report_documents
+from core.blob_responses import astream_blob
+from core.image_variants import image_response
+from core.report_store import BlobNotFound, get_report_store
+from core.template_cache import get_base_template
+from core.views import list_stories_data, rewrite_img_src
+from core.views_editor import list_reports_data, parse_fetch_report_params, build_fetch_report_data
+
+logger = logging.getLogger(__name__)
+
+
+def _authenticate(request):
+    """JWT first (SPA), then the session user (admin, browsable API)"""
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except (AuthenticationFailed, InvalidToken):
+        return None
+    user = result[0] if result else request.user
+    if not user.is_authenticated:
+        return None
+    user.tenant  # load the relation here, lazy loading is not allowed on the event loop
+    return user
+
+
+class AsyncAPIView(View):
+    permission = None  # None, 'authenticated' or 'tenant_admin'
+
+    async def dispatch(self, request, *args, **kwargs):
+        if self.permission:
+            user = await sync_to_async(_authenticate)(request)
+            if user is None:
+                return JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                                    status=status.HTTP_401_UNAUTHORIZED)
+            if self.permission == 'tenant_admin' and not user.is_tenant_admin:
+                return JsonResponse({'detail': 'You do not have permission to perform this action.'},
+                                    status=status.HTTP_403_FORBIDDEN)
+            request.api_user = user
+        return await super().dispatch(request, *args, **kwargs)
+
+
+async def _get_report_properties(store, report_id):
+    """async report_documents.get_report_properties"""
+    return (await store.aget_properties(report_documents.manifest_name(report_id))
+            or await store.aget_properties(report_documents.legacy_name(report_id)))
+
+
+async def _read_report(store, report_id, parts=tuple(report_documents.PARTS), chunks_offset=0, chunks_limit=None):
+    """async report_documents.read_report, the parts are downloaded concurrently"""
+    try:
+        manifest = report_documents.parse_manifest(await store.aget(report_documents.manifest_name(report_id)))
+    except BlobNotFound:
+        data = await store.aget(report_documents.legacy_name(report_id))
+        return report_documents.parse_legacy(data, parts, chunks_offset, chunks_limit)
+    names = report_documents.blobs_to_read(manifest, parts, chunks_offset, chunks_limit)
+    contents = await asyncio.gather(*(store.aget(name) for name in names))
+    return report_documents.assemble(manifest, parts, dict(zip(names, contents)), chunks_offset, chunks_limit)
+
+
+class AsyncFetchReportView(AsyncAPIView):
+    permission = 'authenticated'
+
+    async def get(self, request, *args, **kwargs):
+        report_id = request.GET.get('report_id')
+        try:
+            parts, chunks_offset, chunks_limit = parse_fetch_report_params(request.GET)
+        except ValueError as e:
+            return JsonResponse({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        store = get_report_store('report')
+        try:
+            properties = await _get_report_properties(store, report_id)
+            if properties is None:
+                raise BlobNotFound(f"report {report_id} not found")
+            etag = http_cache.derived_etag(properties.etag, parts, chunks_offset, chunks_limit)
+            response = http_cache.not_modified(request, etag, properties.last_modified)
+            if response is None:
+                content = await _read_report(store, report_id, parts, chunks_offset, chunks_limit)
+                data = build_fetch_report_data(report_id, content, chunks_offset, chunks_limit)
+                response = JsonResponse(data, status=status.HTTP_200_OK)
+            return http_cache.set_validators(response, etag, properties.last_modified)
+        except Exception as e:
+            logger.error(f"Failed to fetch report: {e}")
+            return JsonResponse(f"Error: {str(e)}", status=status.HTTP_404_NOT_FOUND, safe=False)
+
+
+class AsyncFetchReportAsHtmlView(AsyncAPIView):
+
+    async def get(self, request, *args, **kwargs):
+        report_id = request.GET.get('report_id')
+        store = get_report_store('report')
+        try:
+            properties = await _get_report_properties(store, report_id)
+            if properties is None:
+                raise BlobNotFound(f"report {report_id} not found")
+            response = http_cache.not_modified(request, properties.etag, properties.last_modified)
+            if response is None:
+                content = await _read_report(store, report_id, parts=('content',))
+                response = HttpResponse(content['report_content'])
+            return http_cache.set_validators(response, properties.etag, properties.last_modified)
+        except Exception as e:
+            logger.error(f"Failed to fetch html report: {e}")
+            return HttpResponse(f"Error: {str(e)}")
+
+
+class AsyncReportListView(AsyncAPIView):
+    permission = 'authenticated'
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            data = await sync_to_async(list_reports_data)(request.api_user.tenant, request.GET)
+        except ValueError as e:
+            return JsonResponse({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return JsonResponse(data, status=status.HTTP_200_OK)
+
+
+class AsyncStoryList(AsyncAPIView):
+    permission = 'tenant_admin'
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            data = await sync_to_async(list_stories_data)(request.api_user.tenant, request.GET)
+        except ValueError as e:
+            return JsonResponse({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return JsonResponse(data, status=status.HTTP_200_OK)
+
+
+def _render_report_html(request, blob_content, category):
+    user_id = request.GET.get('user_id')
+    if user_id:
+        UserModel = get_user_model()
+        user = UserModel.objects.get(id=user_id)
+    else:
+        user = _authenticate(request)
+    template = get_base_template(user, category)
+    return template.render(Context({'blob_content': blob_content}))
+
+
+@method_decorator(xframe_options_exempt, name='dispatch')
+class AsyncDownloadView(AsyncAPIView):
+    """async DownloadView, see DownloadView"""
+
+    async def get(self, request, *args, **kwargs):
+        file_name = kwargs['name']
+        show_image = request.GET.get('show_image')
+        show_document = request.GET.get('show_document')
+        show_html = request.GET.get('show_html')
+        category = request.GET.get('category') or 'story'
+        is_portfolio_page = request.GET.get('is_portfolio_page')
+        blob_name = f"{kwargs['blob']}/{file_name}"
+
+        store_alias = 'chat_bot'
+        if is_portfolio_page:
+            store_alias = 'report'
+        if show_document:
+            store_alias = 'rag'
+        store = get_report_store(store_alias)
+
+        try:
+            if show_image:
+                # images are resized from the local blob cache, that part is sync
+                return await sync_to_async(image_response, thread_sensitive=False)(request, store_alias, blob_name)
+            elif show_html:
+                blob_content = await store.aget(blob_name)
+                blob_content = rewrite_img_src(blob_content.decode("utf-8"), kwargs['blob'], is_portfolio_page)
+                html = await sync_to_async(_render_report_html)(request, blob_content, category)
+                return HttpResponse(html)
+            return await astream_blob(request, store, blob_name, filename=file_name)
+        except Exception as e:
+            return HttpResponse(f"Error: {str(e)}", status=status.HTTP_404_NOT_FOUND)
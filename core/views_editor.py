@@ -1,25 +1,32 @@
-import io
 import os
+import base64
 import datetime
 import logging
 import re
-import json
 import requests
 import time
 from core import utils
 
 from django.conf import settings
-from django.core.files.base import ContentFile
 from django.http import JsonResponse, HttpResponse
-from django.core.files.storage import FileSystemStorage
+from django.utils.crypto import get_random_string
+from django.utils.text import get_valid_filename
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from azure.storage.blob import BlobServiceClient
 from rest_framework import status
 
 from core import models
 from core import serializers
+from authentication.permissions import CadenzaAdminPermission
+from core import exports
+from core import report_documents
+from core import report_index
+from core import search
+from core import http_cache
+from core.blob_cache import get_blob_cache
+from core.image_variants import cache_key, image_response
+from core.report_store import BlobNotFound, get_report_store
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +35,84 @@ def sanitize_metadata_value(value):
     return ''.join(char for char in value if ord(char) < 128)
 
 
+def get_available_blob_name(store, report_id, filename):
+    """`filename` made unique under `report_id/`, like FileSystemStorage.save() did for the local copy"""
+    filename = get_valid_filename(filename)
+    root, ext = os.path.splitext(filename)
+    while store.exists(f"{report_id}/{filename}"):
+        filename = f"{root}_{get_random_string(7)}{ext}"
+    return filename
+
+
+def encode_chunks_cursor(offset, limit):
+    return base64.urlsafe_b64encode(f"{offset}:{limit}".encode('utf-8')).decode('ascii')
+
+
+def decode_chunks_cursor(cursor):
+    try:
+        offset, limit = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split(':')
+        return int(offset), int(limit)
+    except ValueError:  # binascii.Error and UnicodeDecodeError are ValueErrors
+        raise ValueError("chunks_cursor is invalid")
+
+
+def _int_param(query_params, name):
+    value = query_params.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+
+
+def parse_fetch_report_params(query_params):
+    """`fields` (content,citations,chunks) and the research_chunks window of FetchReportView
+
+    return `(parts, chunks_offset, chunks_limit)`, raise ValueError
+    """
+    fields = query_params.get('fields')
+    parts = tuple(report_documents.PARTS)
+    if fields:
+        parts = tuple(field.strip() for field in fields.split(',') if field.strip())
+        unknown = set(parts) - set(report_documents.PARTS)
+        if unknown:
+            raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+
+    cursor = query_params.get('chunks_cursor')
+    if cursor:
+        chunks_offset, chunks_limit = decode_chunks_cursor(cursor)
+        if chunks_offset < 0 or not 0 < chunks_limit <= settings.REPORT_CHUNK_MAX_LIMIT:
+            raise ValueError("chunks_cursor is invalid")
+        return parts, chunks_offset, chunks_limit
+
+    chunks_offset = _int_param(query_params, 'chunks_offset') or 0
+    if chunks_offset < 0:
+        raise ValueError("chunks_offset must not be negative")
+    chunks_limit = _int_param(query_params, 'chunks_limit')
+    if chunks_limit is not None and not 0 < chunks_limit <= settings.REPORT_CHUNK_MAX_LIMIT:
+        raise ValueError(f"chunks_limit must be between 1 and {settings.REPORT_CHUNK_MAX_LIMIT}")
+    return parts, chunks_offset, chunks_limit
+
+
+def build_fetch_report_data(report_id, content, chunks_offset, chunks_limit):
+    data = {'report_id': report_id, 'report_title': content.get('report_title')}
+    if 'report_content' in content:
+        # Extract the title from the report content
+        data['report_title'] = utils.extract_title(content['report_content'])
+        data['report_content'] = content['report_content']
+    if 'report_citations' in content:
+        data['report_citations'] = content['report_citations']
+    if 'research_chunks' in content:
+        data['research_chunks'] = content['research_chunks']
+        data['research_chunks_total'] = content['research_chunks_total']
+        if chunks_limit is not None:
+            next_offset = chunks_offset + chunks_limit
+            has_more = next_offset < content['research_chunks_total']
+            data['next_cursor'] = encode_chunks_cursor(next_offset, chunks_limit) if has_more else None
+    return data
+
+
 class UploadReportView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -40,6 +125,7 @@ class UploadReportView(APIView):
         research_chunks = request.data.get('research_chunks', [])
         # Extract the title from the report content
         report_title = utils.extract_title(report_content)
+        manifest_title = report_title  # blob metadata only allows ASCII, the manifest keeps the original
 
 
         # Sanitize metadata values
@@ -71,8 +157,6 @@ class UploadReportView(APIView):
 
 
         current_time = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        filename = f"{report_id}/{report_id}.json"
-        
         metadata = {
             'Report_ID': report_id,
             'Report_Title': report_title,
@@ -81,21 +165,27 @@ class UploadReportView(APIView):
             'Last_Modified_At': current_time
         }
 
-        text = json.dumps({
+        report = {
             'report_content': report_content,
             'report_citations': report_citations,
             'research_chunks': research_chunks
-        })
-        data = io.BytesIO(text.encode('utf-8'))
+        }
 
         try:
-            blob_service_client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONNECTION_STRING)
-            container_client = blob_service_client.get_container_client(container=settings.AZURE_STORAGE_REPORT_CONTAINER_NAME)
-            container_client.upload_blob(name=filename, data=data, overwrite=True, metadata=metadata)
+            store = get_report_store('report')
+            report_documents.write_report(store, report_id, report, metadata, title=manifest_title)
+            report_index.sync_report(store, report_id, user.tenant)
+            search.index_report(user.tenant, report_id, manifest_title, report_content)
 
             instance.title = report_title
             instance.save()
 
+            if settings.EXPORT_PREWARM:
+                try:
+                    exports.prewarm_exports(instance, True, user)
+                except Exception as e:
+                    logger.error(f"Failed to queue the exports of report {report_id}: {e}")
+
             return Response({'message': 'Report uploaded successfully'}, status=status.HTTP_200_OK)
         except Exception as e:
             logger.error(f"Failed to upload report: {e}")
@@ -107,31 +197,24 @@ class FetchReportView(APIView):
 
     def get(self, request, *args, **kwargs):
         report_id = request.query_params.get('report_id')
-        file_name = f"{report_id}/{report_id}.json"
+        try:
+            parts, chunks_offset, chunks_limit = parse_fetch_report_params(request.query_params)
+        except ValueError as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+        store = get_report_store('report')
         try:
-            blob_service_client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONNECTION_STRING)
-            container_client = blob_service_client.get_container_client(container=settings.AZURE_STORAGE_REPORT_CONTAINER_NAME)
-            blob_client = container_client.get_blob_client(blob=file_name)
-
-            blob_data = blob_client.download_blob()
-            blob_content = blob_data.readall()
-            content = json.loads(blob_content.decode('utf-8'))
-
-            report_content = content['report_content']
-            report_citations = content['report_citations']
-            research_chunks = content['research_chunks']
-
-            # Extract the title from the report content
-            report_title = utils.extract_title(report_content)
-
-            return JsonResponse({
-                'report_id': report_id,
-                'report_title': report_title,
-                'report_content': report_content,
-                'report_citations': report_citations,
-                'research_chunks': research_chunks
-            }, status=status.HTTP_200_OK)
+            properties = report_documents.get_report_properties(store, report_id)
+            if properties is None:
+                raise BlobNotFound(report_id)
+            etag = http_cache.derived_etag(properties.etag, parts, chunks_offset, chunks_limit)
+            response = http_cache.not_modified(request, etag, properties.last_modified)
+            if response is None:
+                content = report_documents.read_report(store, report_id, parts=parts,
+                                                       chunks_offset=chunks_offset, chunks_limit=chunks_limit)
+                data = build_fetch_report_data(report_id, content, chunks_offset, chunks_limit)
+                response = JsonResponse(data, status=status.HTTP_200_OK)
+            return http_cache.set_validators(response, etag, properties.last_modified)
         except Exception as e:
             logger.error(f"Failed to fetch report: {e}")
             return Response(f"Error: {str(e)}", status=status.HTTP_404_NOT_FOUND)
@@ -142,48 +225,16 @@ class FetchReportImageView(APIView):
         if not (image_key):
             return Response({"message": "Report not exist."}, status=status.HTTP_404_NOT_FOUND)
         image_key = sanitize_metadata_value(image_key)
-        report_id = re.split(r'/', image_key)[0]
         image_file = re.split(r'/', image_key)[1]
 
         try:
-            # Find image exist in directory
-            fs = FileSystemStorage(location=os.path.join(settings.MEDIA_ROOT, f'portfolio_assets'))
-            directory_path = fs.path(report_id)
-            if not os.path.exists(directory_path):
-                os.makedirs(directory_path)
-            file_path = fs.path(image_key)
-
-            if not os.path.exists(file_path):
-                try:
-                    # Else download from azure
-                    blob_service_client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONNECTION_STRING)
-                    container_client = blob_service_client.get_container_client(container=settings.AZURE_STORAGE_REPORT_CONTAINER_NAME)
-                    blob_client = container_client.get_blob_client(blob=image_key)
-
-                    blob_data = blob_client.download_blob().readall()
-                    
-                    with open(file_path, 'wb') as f:
-                        f.write(blob_data)
-                except Exception as e:
-                    logger.error(f"Failed to fetch image: {e}")
-                    return Response(f"Error: {str(e)}", status=status.HTTP_404_NOT_FOUND)
-                    
-            if not os.path.exists(file_path):
-                return Response({"message": "Not found."}, status=status.HTTP_404_NOT_FOUND)
-
-            # Open the file for reading
-            # mime = magic.Magic(mime=True)
-            # content_type = mime.from_file(file_path)
-            content_type = 'image/jpeg'
-
-            with open(file_path, 'rb') as file:
-                file_data = file.read()
-
-            # Create a DRF Response object with file content
-            response = HttpResponse(file_data, content_type=content_type)
-            response['Content-Disposition'] = f'attachment; filename="{image_file}"'
-            return response
-
+            # local copy from the blob cache, in its real format or as the variant asked by `w`
+            return image_response(request, 'report', image_key, filename=image_file)
+        except BlobNotFound as e:
+            logger.error(f"Failed to fetch image: {e}")
+            return Response({"message": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        except ValueError as e:
+            return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.error(f"Failed to fetch report: {e}")
             return Response(f"Error: {str(e)}", status=status.HTTP_404_NOT_FOUND)
@@ -219,18 +270,16 @@ class UploadReportImageView(APIView):
         # Upload File
         # Save details to Portfolio assets
 
-        fs = FileSystemStorage(location=os.path.join(settings.MEDIA_ROOT, f'portfolio_assets/{report_id}'))
-        filename = fs.save(uploaded_file.name, uploaded_file)
-        # uploaded_file_path = fs.path(filename)
+        store = get_report_store('report')
+        filename = get_available_blob_name(store, report_id, uploaded_file.name)
         
         # Upload image to Azure
         try:
-            blob_service_client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONNECTION_STRING)
-            container_client = blob_service_client.get_container_client(container=settings.AZURE_STORAGE_REPORT_CONTAINER_NAME)
             uploaded_file.seek(0)
             data = uploaded_file.read()
             _filename = f"{report_id}/{filename}"
-            container_client.upload_blob(name=_filename, data=data, overwrite=True)
+            blob = store.put(_filename, data, content_type=uploaded_file.content_type)
+            get_blob_cache().put(cache_key('report', _filename), data, content_type=uploaded_file.content_type, etag=blob.etag)
 
             # Get public url
             return Response({'message': "Upload Successfully.", "data": _filename }, status=status.HTTP_200_OK)
@@ -280,20 +329,15 @@ class SaveReportImageFromUrlView(APIView):
         # Generate a file name and save the image
         filename = f'image_{int(time.time())}.{file_extension}'
 
-        # Save file to directory with new name
-        # Upload File
-        fs = FileSystemStorage(location=os.path.join(settings.MEDIA_ROOT, f'portfolio_assets/{report_id}'))
-        filename = fs.save(filename, ContentFile(response.content))
+        store = get_report_store('report')
+        filename = get_available_blob_name(store, report_id, filename)
         
         # Upload image to Azure
         try:
-            blob_service_client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONNECTION_STRING)
-            container_client = blob_service_client.get_container_client(container=settings.AZURE_STORAGE_REPORT_CONTAINER_NAME)
-            uploaded_file = ContentFile(response.content)
-            uploaded_file.seek(0)
-            data = uploaded_file.read()
+            data = response.content
             _filename = f"{report_id}/{filename}"
-            container_client.upload_blob(name=_filename, data=data, overwrite=True)
+            blob = store.put(_filename, data, content_type=content_type)
+            get_blob_cache().put(cache_key('report', _filename), data, content_type=content_type, etag=blob.etag)
 
             # Get public url
             return Response({'message': "Upload Successfully.", "data": _filename }, status=status.HTTP_200_OK)
@@ -301,39 +345,47 @@ class SaveReportImageFromUrlView(APIView):
             logger.error(f"Failed to upload report: {e}")
             return Response(f"Error: {str(e)}", status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def parse_report_list_params(query_params):
+    """keyword arguments of report_index.list_reports, raise ValueError"""
+    limit = int(query_params.get('limit') or 100)
+    if not 0 < limit <= settings.REPORT_LIST_MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {settings.REPORT_LIST_MAX_LIMIT}")
+    return {
+        'ordering': query_params.get('ordering') or '-created_at',
+        'cursor': query_params.get('continuation_token') or None,
+        'limit': limit,
+        'search': query_params.get('search') or None,
+        'created_by': query_params.get('created_by') or None,
+    }
+
+
+def list_reports_data(tenant, query_params):
+    """body of ReportListView, raise ValueError"""
+    params = parse_report_list_params(query_params)
+    entries, continuation_token = report_index.list_reports(tenant, **params)
+    data = {
+        'reports': [report_index.serialize_entry(entry) for entry in entries],
+        'continuation_token': continuation_token,
+    }
+    if query_params.get('count') == 'true':
+        data['count'] = report_index.count_reports(tenant, search=params['search'], created_by=params['created_by'])
+    return data
+
+
 class ReportListView(APIView):
+    """reports of the tenant from the ReportIndex table
+
+    `ordering` (-created_at, created_at, -last_modified, last_modified), `search` (title),
+    `created_by`, `limit`, `count=true`; `continuation_token` of the previous page
+    """
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        user = request.user
-        tenant_uuid = user.tenant.uuid
-        blob_service_client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONNECTION_STRING)
-        container_client = blob_service_client.get_container_client(container=settings.AZURE_STORAGE_REPORT_CONTAINER_NAME)
-
-        continuation_token = request.query_params.get('continuation_token') or None
-        blob_list = container_client.list_blobs(
-            name_starts_with=f"{tenant_uuid}/",
-            include=['metadata'],
-            results_per_page=100
-        )
-        blobs = blob_list.by_page(continuation_token)
-        response_data = []
-        current_page = next(blobs)
-        for blob in current_page:
-            response_data.append({
-                'file_name': blob.name,
-                'etag': blob.etag,
-                'report_id': blob.metadata.get('Report_ID'),
-                'report_title': blob.metadata.get('Report_Title'),
-                'created_at': blob.metadata.get('Created_At'),
-                'last_modified_at': blob.metadata.get('Last_Modified_At'),
-                'created_by': blob.metadata.get('Created_By_User'),
-            })
-
-        return Response({
-            'reports': response_data,
-            'continuation_token': blobs.continuation_token
-        }, status=status.HTTP_200_OK)
+        try:
+            data = list_reports_data(request.user.tenant, request.query_params)
+        except ValueError as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data, status=status.HTTP_200_OK)
 
 
 class FetchReportAsHtmlView(APIView):
@@ -341,20 +393,29 @@ class FetchReportAsHtmlView(APIView):
 
     def get(self, request, *args, **kwargs):
         report_id = request.query_params.get('report_id')
-        file_name = f"{report_id}/{report_id}.json"
 
+        store = get_report_store('report')
         try:
-            blob_service_client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONNECTION_STRING)
-            container_client = blob_service_client.get_container_client(container=settings.AZURE_STORAGE_REPORT_CONTAINER_NAME)
-            blob_client = container_client.get_blob_client(blob=file_name)
+            properties = report_documents.get_report_properties(store, report_id)
+            if properties is None:
+                raise BlobNotFound(report_id)
+            response = http_cache.not_modified(request, properties.etag, properties.last_modified)
+            if response is None:
+                # only the content part is downloaded
+                content = report_documents.read_report(store, report_id, parts=('content',))
+
+                report_content = content['report_content']
+
+                response = HttpResponse(report_content)
+            return http_cache.set_validators(response, properties.etag, properties.last_modified)
+        except Exception as e:
+            logger.error(f"Failed to fetch html report: {e}")
+            return HttpResponse(f"Error: {str(e)}")
 
-            blob_data = blob_client.download_blob()
-            blob_content = blob_data.readall()
-            content = json.loads(blob_content.decode('utf-8'))
 
-            report_content = content['report_content']
+class BlobCacheStatsView(APIView):
+    """hit / miss counters of the image cache in the process serving the request"""
+    permission_classes = [IsAuthenticated, CadenzaAdminPermission]
 
-            return HttpResponse(report_content)
-        except Exception as e:
-            logger.error(f"Failed to fetch html report: {e}")
-            return HttpResponse(f"Error: {str(e)}")
\ No newline at end of file
+    def get(self, request, *args, **kwargs):
+        return Response(get_blob_cache().stats(), status=status.HTTP_200_OK)
@@ -4,7 +4,7 @@ import json
 from datetime import datetime, timedelta
 
 from django.utils import timezone
-from django.core.cache import cache
+from django.core.cache import caches
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics
@@ -64,7 +64,7 @@ class DataSyncAuthorizationUrlView(APIView):
         for item in metadata:
             name = item['name']
             _kwargs[name] = request.data.get(name)
-            cache.set(f'{data_source_slug}_{name}_of_user_{request.user.id}', request.data.get(name))
+            caches['handshake'].set(f'{data_source_slug}_{name}_of_user_{request.user.id}', request.data.get(name))
         
         oauth_info = None
         if not data_source_instance.is_own_app:
@@ -80,7 +80,7 @@ class DataSyncAuthorizationUrlView(APIView):
                 'authorization_url': authorization_url,
                 'token_url': token_url
             }
-            cache.set(f'{data_source_slug}_oauth_data_of_user_{request.user.id}', oauth_info)
+            caches['handshake'].set(f'{data_source_slug}_oauth_data_of_user_{request.user.id}', oauth_info)
 
         state = generate_token()
         service = OAuthService(
@@ -92,7 +92,7 @@ class DataSyncAuthorizationUrlView(APIView):
         )
         result = service.get_authorization_url()
         authorization_url = result[0]
-        cache.set(f'{data_source_slug}_state_of_user_{request.user.id}', state)
+        caches['handshake'].set(f'{data_source_slug}_state_of_user_{request.user.id}', state)
         
         response = Response(authorization_url, status=status.HTTP_200_OK)
         return response
@@ -113,14 +113,14 @@ class DataSyncCallbackView(APIView):
         metadata = data_source_instance.metadata or []
         for item in metadata:
             name = item['name']
-            _kwargs[name] = cache.get(f'{data_source_slug}_{name}_of_user_{request.user.id}')
+            _kwargs[name] = caches['handshake'].get(f'{data_source_slug}_{name}_of_user_{request.user.id}')
 
-        state = cache.get(f'{data_source_slug}_state_of_user_{request.user.id}')
+        state = caches['handshake'].get(f'{data_source_slug}_state_of_user_{request.user.id}')
         callback_url = request.data['callback_url']
 
         oauth_info = None
         if not data_source_instance.is_own_app:
-            oauth_info = cache.get(f'{data_source_slug}_oauth_data_of_user_{request.user.id}')
+            oauth_info = caches['handshake'].get(f'{data_source_slug}_oauth_data_of_user_{request.user.id}')
 
         service = OAuthService(application_slug=data_source_slug, is_data_source=True, state=state, oauth_info=oauth_info, **_kwargs)
         result = service.get_token(callback_url)
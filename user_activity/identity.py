@@ -0,0 +1,61 @@
+"""client identity of the Visit rows, without creating server sessions
+
+UserVisitsMiddleware used to call request.session.create() for every request without a
+session, so each JWT call of the SPA and each anonymous story room call wrote a
+django_session row. The `session_key` of a Visit is now, in this order:
+
+- the session key, when the request already has a session (admin, allauth pages)
+- `user:<id>` of the access token of `Authorization: Bearer ...`, checked without a query
+- `visitor:<id>` of the signed VISIT_COOKIE_NAME cookie, set on the first response
+
+    key, user_id, new_cookie = identify(request)
+
+`manage.py clear_visit_sessions` deletes the empty session rows created before.
+"""
+import secrets
+
+from django.conf import settings
+from rest_framework_simplejwt.authentication import AUTH_HEADER_TYPE_BYTES
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+COOKIE_SALT = 'user_activity.visitor'
+
+
+def _token_user_id(request):
+    parts = request.META.get(jwt_settings.AUTH_HEADER_NAME, '').encode('iso-8859-1').split()
+    if len(parts) != 2 or parts[0] not in AUTH_HEADER_TYPE_BYTES:
+        return None
+    try:
+        token = AccessToken(parts[1].decode('iso-8859-1'))
+    except TokenError:
+        return None
+    return token.get(jwt_settings.USER_ID_CLAIM)
+
+
+def _visitor_id(request):
+    value = request.get_signed_cookie(settings.VISIT_COOKIE_NAME, default=None, salt=COOKIE_SALT,
+                                      max_age=settings.VISIT_COOKIE_AGE)
+    return value if value and len(value) == 32 else None
+
+
+def identify(request):
+    """`(session_key, user_id, new_visitor_id)` of the Visit of `request`"""
+    user_id = request.user.pk if request.user.is_authenticated else None
+    if request.session.session_key:
+        return request.session.session_key, user_id, None
+    token_user_id = _token_user_id(request)
+    if token_user_id is not None:
+        return f"user:{token_user_id}"[:40], user_id or token_user_id, None
+    visitor_id = _visitor_id(request)
+    if visitor_id:
+        return f"visitor:{visitor_id}", user_id, None
+    visitor_id = secrets.token_hex(16)
+    return f"visitor:{visitor_id}", user_id, visitor_id
+
+
+def set_visitor_cookie(response, visitor_id):
+    response.set_signed_cookie(
+        settings.VISIT_COOKIE_NAME, visitor_id, salt=COOKIE_SALT, max_age=settings.VISIT_COOKIE_AGE,
+        secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax')
@@ -0,0 +1,34 @@
+"""delete the empty session rows UserVisitsMiddleware created for visit tracking
+
+    python manage.py clear_visit_sessions [--batch-size 5000] [--dry-run]
+
+Expired sessions are deleted as by clearsessions, then the sessions without any data
+(nobody logged in, no messages, ...) in batches.
+"""
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Delete the expired and empty sessions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', help='count the empty sessions only')
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            SessionStore.clear_expired()
+        store, after, empty = SessionStore(), '', 0
+        while True:
+            rows = list(Session.objects.filter(session_key__gt=after)
+                        .order_by('session_key').values_list('session_key', 'session_data')[:options['batch_size']])
+            if not rows:
+                break
+            after = rows[-1][0]
+            keys = [key for key, data in rows if not store.decode(data)]
+            empty += len(keys)
+            if keys and not options['dry_run']:
+                Session.objects.filter(session_key__in=keys).delete()
+        self.stdout.write(f"{'found' if options['dry_run'] else 'deleted'} {empty} empty sessions")
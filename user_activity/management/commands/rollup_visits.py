@@ -0,0 +1,33 @@
+"""count the new visits into the hourly and daily rollup tables
+
+    python manage.py rollup_visits [--loop] [--rebuild]
+
+With `--loop` the command keeps running as the rollup job, `--rebuild` deletes the rollups
+and counts every visit again.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from user_activity import rollups
+
+
+class Command(BaseCommand):
+    help = 'Roll up visits per path, user and tenant'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='keep rolling up new visits')
+        parser.add_argument('--interval', type=int, default=60, help='seconds between runs with --loop')
+        parser.add_argument('--rebuild', action='store_true', help='count all the visits again')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            rollups.rebuild_rollups()
+        while True:
+            counted = rollups.rollup_visits()
+            pruned = rollups.prune_hourly_rollups()
+            if counted or pruned:
+                self.stdout.write(f"counted {counted} visits, pruned {pruned} hourly rollups")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
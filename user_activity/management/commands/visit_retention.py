@@ -0,0 +1,22 @@
+"""create the coming Visit partitions, archive and drop the expired months
+
+    python manage.py visit_retention [--no-archive]
+
+Run it daily, see user_activity/partitions.py.
+"""
+from django.core.management.base import BaseCommand
+
+from user_activity import partitions
+
+
+class Command(BaseCommand):
+    help = 'Manage the monthly Visit partitions and their retention'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-archive', action='store_true', help='drop expired months without archiving them')
+
+    def handle(self, *args, **options):
+        for name in partitions.ensure_partitions():
+            self.stdout.write(f"created partition {name}")
+        for month in partitions.expire_visits(archive=False if options['no_archive'] else None):
+            self.stdout.write(f"expired the visits of {month:%Y-%m}")
@@ -1,21 +1,35 @@
+from django.conf import settings
+from django.utils import timezone
 from django.utils.deprecation import MiddlewareMixin  
+from .identity import identify, set_visitor_cookie
 from .models import Visit  
+from .recorder import drop_missing_users, get_recorder, should_record
+
 
 class UserVisitsMiddleware(MiddlewareMixin):  
+    """log a Visit of the request, written in batches by user_activity/recorder.py"""
+
     def process_request(self, request):  
-        session_key = request.session.session_key  
-        if not session_key:  
-            request.session.create()  
-            session_key = request.session.session_key  
+        if not should_record(request.path):
+            return
+
+        # never creates a session, see user_activity/identity.py
+        session_key, user_id, request.new_visitor_id = identify(request)
+
+        visit = Visit(
+            user_id=user_id,
+            session_key=session_key,
+            path=request.path[:255],
+            timestamp=timezone.now(),
+        )
+        if settings.VISIT_BUFFERED:
+            get_recorder().record(visit)
+        else:
+            drop_missing_users([visit])
+            visit.save()
 
-        if request.user.is_authenticated:  
-            Visit.objects.create(  
-                user=request.user,  
-                session_key=session_key,  
-                path=request.path  
-            )  
-        else:  
-            Visit.objects.create(  
-                session_key=session_key,  
-                path=request.path  
-            )
\ No newline at end of file
+    def process_response(self, request, response):
+        visitor_id = getattr(request, 'new_visitor_id', None)
+        if visitor_id and settings.VISIT_COOKIE_NAME not in response.cookies:
+            set_visitor_cookie(response, visitor_id)
+        return response
@@ -0,0 +1,75 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0073_tenant_name_upper_idx'),
+        ('user_activity', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PathVisitRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=8)),
+                ('bucket', models.DateTimeField(help_text='start of the hour or day')),
+                ('visits', models.PositiveBigIntegerField(default=0)),
+                ('path', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TenantVisitRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=8)),
+                ('bucket', models.DateTimeField(help_text='start of the hour or day')),
+                ('visits', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserVisitRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=8)),
+                ('bucket', models.DateTimeField(help_text='start of the hour or day')),
+                ('visits', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VisitRollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_visit_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='pathvisitrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'bucket', 'path'), name='unique_path_visit_rollup'),
+        ),
+        migrations.AddField(
+            model_name='tenantvisitrollup',
+            name='tenant',
+            field=models.ForeignKey(db_column='tenant_uuid', on_delete=django.db.models.deletion.CASCADE, to='core.tenant'),
+        ),
+        migrations.AddField(
+            model_name='uservisitrollup',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='tenantvisitrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'bucket', 'tenant'), name='unique_tenant_visit_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='uservisitrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'bucket', 'user'), name='unique_user_visit_rollup'),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:42
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+# months of partitions created ahead, manage.py visit_retention keeps creating them
+MONTHS_AHEAD = 3
+
+
+def _months(first, last):
+    month = datetime.date(first.year, first.month, 1)
+    while month <= last:
+        yield month
+        month = datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _partition_sql(month):
+    following = datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+    return (f"CREATE TABLE user_activity_visit_p{month:%Y%m} PARTITION OF user_activity_visit "
+            f"FOR VALUES FROM ('{month.isoformat()} 00:00+00') TO ('{following.isoformat()} 00:00+00')")
+
+
+def partition_visits(apps, schema_editor):
+    """replace user_activity_visit by a table partitioned by month of timestamp (PostgreSQL only)
+
+    the primary key of a partitioned table has to include the partition key, it is
+    (id, timestamp), ids still come from one sequence. The indexes and foreign keys of the
+    old table are created again with their names.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT indexdef FROM pg_indexes "
+                       "WHERE tablename = 'user_activity_visit' AND indexname <> 'user_activity_visit_pkey'")
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                       "WHERE conrelid = 'user_activity_visit'::regclass AND contype = 'f'")
+        foreign_keys = cursor.fetchall()
+        cursor.execute('SELECT min("timestamp"), max(id) FROM user_activity_visit')
+        first, max_id = cursor.fetchone()
+
+    now = timezone.now()
+    last = datetime.date(now.year, now.month, 1) + datetime.timedelta(days=31 * MONTHS_AHEAD)
+    statements = [
+        "ALTER TABLE user_activity_visit RENAME TO user_activity_visit_unpartitioned",
+        'CREATE TABLE user_activity_visit (LIKE user_activity_visit_unpartitioned INCLUDING DEFAULTS, '
+        'PRIMARY KEY (id, "timestamp")) PARTITION BY RANGE ("timestamp")',
+        "CREATE SEQUENCE user_activity_visit_partitioned_id_seq OWNED BY user_activity_visit.id",
+        f"SELECT setval('user_activity_visit_partitioned_id_seq', {(max_id or 0) + 1}, false)",
+        "ALTER TABLE user_activity_visit ALTER COLUMN id SET DEFAULT nextval('user_activity_visit_partitioned_id_seq')",
+        # rows outside of the monthly partitions, e.g. when the command did not run
+        "CREATE TABLE user_activity_visit_default PARTITION OF user_activity_visit DEFAULT",
+        *(_partition_sql(month) for month in _months(first or now, last)),
+        "INSERT INTO user_activity_visit SELECT * FROM user_activity_visit_unpartitioned",
+        "DROP TABLE user_activity_visit_unpartitioned",
+        *indexes,
+        *(f"ALTER TABLE user_activity_visit ADD CONSTRAINT {name} {definition}" for name, definition in foreign_keys),
+    ]
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_activity', '0002_visit_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # the indexes below are created on the partitioned table, PostgreSQL adds them to every partition
+        migrations.RunPython(partition_visits, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['timestamp'], name='user_activi_timesta_a992e8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['user', 'timestamp'], name='user_activi_user_id_0c3f0c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['session_key', 'timestamp'], name='user_activi_session_df411c_idx'),
+        ),
+    ]
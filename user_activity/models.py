@@ -10,5 +10,62 @@ class Visit(models.Model):
     path = models.CharField(max_length=255)  
     timestamp = models.DateTimeField(default=timezone.now)  
 
+    class Meta:
+        # on PostgreSQL the table is partitioned by month of timestamp, see user_activity/partitions.py
+        indexes = [
+            models.Index(fields=["timestamp"]),
+            models.Index(fields=["user", "timestamp"]),
+            models.Index(fields=["session_key", "timestamp"]),
+        ]
+
     def __str__(self):  
-        return f"{self.user} visited {self.path} at {self.timestamp}"
\ No newline at end of file
+        return f"{self.user} visited {self.path} at {self.timestamp}"
+
+ROLLUP_PERIODS = (
+    ('hour', 'Hour'),
+    ('day', 'Day'),
+)
+
+
+class VisitRollup(models.Model):
+    """visits counted per hour or day (local time), maintained by user_activity/rollups.py"""
+    period = models.CharField(max_length=8, choices=ROLLUP_PERIODS)
+    bucket = models.DateTimeField(help_text='start of the hour or day')
+    visits = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class PathVisitRollup(VisitRollup):
+    path = models.CharField(max_length=255)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["period", "bucket", "path"], name="unique_path_visit_rollup"),
+        ]
+
+
+class UserVisitRollup(VisitRollup):
+    """visits of authenticated users, anonymous visits are only in PathVisitRollup"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["period", "bucket", "user"], name="unique_user_visit_rollup"),
+        ]
+
+
+class TenantVisitRollup(VisitRollup):
+    tenant = models.ForeignKey("core.Tenant", db_column="tenant_uuid", on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["period", "bucket", "tenant"], name="unique_tenant_visit_rollup"),
+        ]
+
+
+class VisitRollupState(models.Model):
+    """single row, the visits up to `last_visit_id` are counted in the rollups"""
+    last_visit_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
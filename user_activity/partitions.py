@@ -0,0 +1,200 @@
+"""monthly partitions and retention of the Visit table
+
+On PostgreSQL user_activity_visit is partitioned by month of `timestamp` (migration 0003),
+an expired month is dropped as a whole table instead of DELETEd row by row, which leaves
+nothing to vacuum. Other databases keep a plain table and DELETE in batches.
+
+Visits of a month without partition land in the default partition. Creating the partition
+moves them into it, the ones of expired months are DELETEd in batches.
+
+    ensure_partitions()          # partitions of this month and VISIT_PARTITIONS_AHEAD next ones
+    expire_visits()              # archive, then drop the months past VISIT_RETENTION_MONTHS
+
+`manage.py visit_retention` runs both, e.g. daily. With VISIT_ARCHIVE the rows of a month
+are first written to the VISIT_ARCHIVE_STORE report store as gzipped CSV parts of
+VISIT_ARCHIVE_PART_ROWS rows: `visit-archive/2024-05/part-0000.csv.gz`. A month whose
+visits are not all counted in the rollups yet is kept.
+"""
+import csv
+import datetime
+import gzip
+import io
+import logging
+import re
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from core.report_store import get_report_store
+from .models import Visit, VisitRollupState
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'user_activity_visit'
+DEFAULT_PARTITION = f'{TABLE}_default'
+PARTITION_NAME = re.compile(rf'^{TABLE}_p(\d{{4}})(\d{{2}})$')
+ARCHIVE_COLUMNS = ('id', 'user_id', 'session_key', 'path', 'timestamp')
+
+
+def next_month(month):
+    return datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def month_start(month):
+    return datetime.datetime(month.year, month.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def current_month():
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    return today.replace(day=1)
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def partitions():
+    """{month: partition name} of the monthly partitions"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = %s", [TABLE])
+        names = [row[0] for row in cursor.fetchall()]
+    months = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months[datetime.date(int(match[1]), int(match[2]), 1)] = name
+    return months
+
+
+def create_partition(month):
+    """create the partition of `month` with the rows the default partition holds for it
+
+    CREATE TABLE ... PARTITION OF fails when the default partition has rows of the month,
+    they are moved to a new table which is then attached
+    """
+    name = f"{TABLE}_p{month:%Y%m}"
+    bounds = [month_start(month), month_start(next_month(month))]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS)")
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+            f"INSERT INTO {name} SELECT * FROM moved", bounds)
+        # the indexes and foreign keys of the parent table are added to the partition
+        cursor.execute(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", bounds)
+    return name
+
+
+def ensure_partitions(months_ahead=None):
+    """create the missing partitions up to `months_ahead` months from now, return their names"""
+    if not is_partitioned():
+        return []
+    months_ahead = settings.VISIT_PARTITIONS_AHEAD if months_ahead is None else months_ahead
+    existing = partitions()
+    created = []
+    month = current_month()
+    for _ in range(months_ahead + 1):
+        if month not in existing:
+            created.append(create_partition(month))
+        month = next_month(month)
+    return created
+
+
+def default_partition_months(before):
+    """months of the rows in the default partition older than `before`"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', \"timestamp\" AT TIME ZONE 'UTC')::date FROM {DEFAULT_PARTITION} "
+            f'WHERE "timestamp" < %s', [month_start(before)])
+        return {row[0] for row in cursor.fetchall()}
+
+
+def _month_visits(month):
+    return Visit.objects.filter(timestamp__gte=month_start(month), timestamp__lt=month_start(next_month(month)))
+
+
+def _csv_part(rows):
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(ARCHIVE_COLUMNS)
+    writer.writerows(rows)
+    return gzip.compress(text.getvalue().encode('utf-8'))
+
+
+def archive_month(month):
+    """write the visits of `month` to the archive store, return the number of parts"""
+    store = get_report_store(settings.VISIT_ARCHIVE_STORE)
+    rows, part = [], 0
+    visits = _month_visits(month).order_by('pk').values_list(*ARCHIVE_COLUMNS)
+    for visit_id, user_id, session_key, path, timestamp in visits.iterator(chunk_size=10000):
+        rows.append((visit_id, user_id, session_key, path, timestamp.isoformat()))
+        if len(rows) >= settings.VISIT_ARCHIVE_PART_ROWS:
+            store.put(f"visit-archive/{month:%Y-%m}/part-{part:04d}.csv.gz", _csv_part(rows), content_type='application/gzip')
+            rows, part = [], part + 1
+    if rows:
+        store.put(f"visit-archive/{month:%Y-%m}/part-{part:04d}.csv.gz", _csv_part(rows), content_type='application/gzip')
+        part += 1
+    return part
+
+
+def _rolled_up(month):
+    state = VisitRollupState.objects.filter(pk=1).first()
+    last_visit_id = state.last_visit_id if state else 0
+    return not _month_visits(month).filter(pk__gt=last_visit_id).exists()
+
+
+def expired_months():
+    """months before the retention window that still have visits"""
+    cutoff = current_month()
+    for _ in range(settings.VISIT_RETENTION_MONTHS):
+        cutoff = (cutoff - datetime.timedelta(days=1)).replace(day=1)
+    if is_partitioned():
+        return sorted({month for month in partitions() if month < cutoff} | default_partition_months(cutoff))
+    first = Visit.objects.filter(timestamp__lt=month_start(cutoff)).order_by('timestamp').values_list('timestamp', flat=True).first()
+    if first is None:
+        return []
+    months, month = [], first.astimezone(datetime.timezone.utc).date().replace(day=1)
+    while month < cutoff:
+        if _month_visits(month).exists():
+            months.append(month)
+        month = next_month(month)
+    return months
+
+
+def drop_month(month):
+    if is_partitioned():
+        name = partitions().get(month)
+        if name:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE {name}")
+    # rows of a plain table, or of the default partition
+    visits = _month_visits(month)
+    while True:
+        ids = list(visits.values_list('pk', flat=True)[:settings.VISIT_RETENTION_DELETE_BATCH])
+        if not ids:
+            break
+        Visit.objects.filter(pk__in=ids).delete()
+
+
+def expire_visits(archive=None):
+    """archive and drop the months past the retention, return them"""
+    archive = settings.VISIT_ARCHIVE if archive is None else archive
+    expired = []
+    for month in expired_months():
+        if not _rolled_up(month):
+            logger.warning(f"visits of {month:%Y-%m} are not rolled up yet, they are kept")
+            continue
+        if archive:
+            parts = archive_month(month)
+            logger.info(f"archived the visits of {month:%Y-%m} in {parts} parts")
+        drop_month(month)
+        expired.append(month)
+    return expired
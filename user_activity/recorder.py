@@ -0,0 +1,120 @@
+"""buffered writes of the Visit rows of UserVisitsMiddleware
+
+The middleware used to INSERT one Visit per request. Visits are now appended to an
+in-process buffer and written with bulk_create by a background thread:
+
+    if should_record(request.path):
+        get_recorder().record(Visit(session_key=..., path=request.path))
+
+- the buffer is flushed every VISIT_FLUSH_INTERVAL seconds, or as soon as it holds
+  VISIT_FLUSH_SIZE visits, and when the process exits
+- past VISIT_BUFFER_MAX_SIZE visits (the database is down or too slow) new visits are dropped
+- VISIT_SAMPLE_RATE records a fraction of the requests, VISIT_INCLUDE_PATHS and
+  VISIT_EXCLUDE_PATHS are regular expressions matched at the start of the path
+
+Visits still in the buffer when a process is killed are lost.
+"""
+import atexit
+import logging
+import random
+import re
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections
+
+from .models import Visit
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=8)
+def _compile(patterns):
+    return [re.compile(pattern) for pattern in patterns]
+
+
+def should_record(path):
+    """whether a request of `path` is logged, after the path rules and sampling"""
+    if any(pattern.match(path) for pattern in _compile(tuple(settings.VISIT_EXCLUDE_PATHS))):
+        return False
+    include = _compile(tuple(settings.VISIT_INCLUDE_PATHS))
+    if include and not any(pattern.match(path) for pattern in include):
+        return False
+    return settings.VISIT_SAMPLE_RATE >= 1 or random.random() < settings.VISIT_SAMPLE_RATE
+
+
+def drop_missing_users(visits):
+    """clear the user of the visits whose user no longer exists, e.g. the access token of a
+    deleted account, its foreign key would fail the whole batch"""
+    user_ids = {visit.user_id for visit in visits if visit.user_id is not None}
+    if not user_ids:
+        return
+    existing = set(get_user_model().objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+    for visit in visits:
+        if visit.user_id is not None and visit.user_id not in existing:
+            visit.user_id = None
+
+
+class VisitRecorder:
+    """buffer of Visit rows, `background=False` leaves the flushes to the caller"""
+
+    def __init__(self, background=True):
+        self.background = background
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.dropped = 0
+
+    def record(self, visit):
+        with self._lock:
+            if len(self._buffer) >= settings.VISIT_BUFFER_MAX_SIZE:
+                self.dropped += 1
+                return
+            self._buffer.append(visit)
+            size = len(self._buffer)
+            if self.background and self._thread is None:
+                self._start()
+        if size >= settings.VISIT_FLUSH_SIZE:
+            self._wake.set()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='visit-recorder', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(settings.VISIT_FLUSH_INTERVAL)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """write the buffered visits, return their number"""
+        with self._lock:
+            visits, self._buffer = self._buffer, []
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            logger.warning(f"dropped {dropped} visits, the buffer was full")
+        if not visits:
+            return 0
+        try:
+            drop_missing_users(visits)
+            Visit.objects.bulk_create(visits, batch_size=settings.VISIT_FLUSH_SIZE)
+        except Exception:
+            logger.exception(f"failed to write {len(visits)} visits")
+            return 0
+        return len(visits)
+
+
+_recorder = VisitRecorder()
+
+
+def get_recorder():
+    return _recorder
@@ -0,0 +1,152 @@
+"""hourly and daily visit counts, so that the overview never reads the Visit table
+
+    rollup_visits()                      # manage.py rollup_visits [--loop], incremental
+    data = overview(start, end)          # user_activity_overview
+
+Visits are counted per path, per user and per tenant, in hours and days of TIME_ZONE.
+A run adds the visits written since the previous one (by id, VisitRollupState) in batches
+of VISIT_ROLLUP_BATCH_SIZE, each batch in one transaction with its high-water mark.
+Visits younger than VISIT_ROLLUP_SETTLE seconds are left to the next run, so that batches
+of the visit recorder still being written are not skipped. Hourly rows are kept
+VISIT_ROLLUP_HOURLY_RETENTION_DAYS, daily rows forever.
+"""
+import datetime
+import logging
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import PathVisitRollup, TenantVisitRollup, UserVisitRollup, Visit, VisitRollupState
+
+logger = logging.getLogger(__name__)
+
+# rollup model, its key field, the Visit lookup of the key
+DIMENSIONS = (
+    (PathVisitRollup, 'path', 'path'),
+    (UserVisitRollup, 'user_id', 'user_id'),
+    (TenantVisitRollup, 'tenant_id', 'user__tenant_id'),
+)
+
+MAX_RANGE_DAYS = 366
+
+
+def _day(hour):
+    return timezone.localtime(hour).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _counts(visits, lookup):
+    """{period: Counter of (bucket, key)} of `visits`"""
+    rows = (visits.filter(**{f'{lookup}__isnull': False})
+            .annotate(hour=TruncHour('timestamp')).values('hour', lookup)
+            .annotate(visits=Count('id')).order_by())
+    hourly, daily = Counter(), Counter()
+    for row in rows:
+        hourly[(row['hour'], row[lookup])] += row['visits']
+        daily[(_day(row['hour']), row[lookup])] += row['visits']
+    return {'hour': hourly, 'day': daily}
+
+
+def _add(model, field, period, counts):
+    if not counts:
+        return
+    buckets = {bucket for bucket, _ in counts}
+    keys = {key for _, key in counts}
+    existing = {
+        (row.bucket, getattr(row, field)): row
+        for row in model.objects.filter(period=period, bucket__in=buckets, **{f'{field}__in': keys})
+    }
+    created, updated = [], []
+    for (bucket, key), visits in counts.items():
+        row = existing.get((bucket, key))
+        if row is None:
+            created.append(model(period=period, bucket=bucket, visits=visits, **{field: key}))
+        else:
+            row.visits += visits
+            updated.append(row)
+    model.objects.bulk_update(updated, ['visits'], batch_size=1000)
+    model.objects.bulk_create(created, batch_size=1000)
+
+
+def _upper_id(after, batch_size):
+    """id of the last visit of the next batch, None when no visit is ready"""
+    ready = Visit.objects.filter(pk__gt=after, timestamp__lt=timezone.now() - datetime.timedelta(seconds=settings.VISIT_ROLLUP_SETTLE))
+    ids = list(ready.order_by('pk').values_list('pk', flat=True)[batch_size - 1:batch_size])
+    return ids[0] if ids else ready.aggregate(last=Max('pk'))['last']
+
+
+def rollup_visits(batch_size=None):
+    """count the visits written since the last run, return their number"""
+    batch_size = batch_size or settings.VISIT_ROLLUP_BATCH_SIZE
+    total = 0
+    while True:
+        with transaction.atomic():
+            state, _ = VisitRollupState.objects.select_for_update().get_or_create(pk=1)
+            upper = _upper_id(state.last_visit_id, batch_size)
+            if upper is None:
+                return total
+            visits = Visit.objects.filter(pk__gt=state.last_visit_id, pk__lte=upper)
+            for model, field, lookup in DIMENSIONS:
+                for period, counts in _counts(visits, lookup).items():
+                    _add(model, field, period, counts)
+            total += visits.count()
+            state.last_visit_id = upper
+            state.save()
+
+
+def prune_hourly_rollups():
+    """delete the hourly rows past their retention, return their number"""
+    before = timezone.now() - datetime.timedelta(days=settings.VISIT_ROLLUP_HOURLY_RETENTION_DAYS)
+    return sum(model.objects.filter(period='hour', bucket__lt=before).delete()[0] for model, _, _ in DIMENSIONS)
+
+
+def rebuild_rollups():
+    """delete every rollup, the next run counts all the visits again"""
+    with transaction.atomic():
+        for model, _, _ in DIMENSIONS:
+            model.objects.all().delete()
+        VisitRollupState.objects.update_or_create(pk=1, defaults={'last_visit_id': 0})
+
+
+def parse_range(params):
+    """`(start, end)` dates of the `start` / `end` parameters, the last 7 days by default, raise ValueError"""
+    end = datetime.date.fromisoformat(params['end']) if params.get('end') else timezone.localdate()
+    start = datetime.date.fromisoformat(params['start']) if params.get('start') else end - datetime.timedelta(days=6)
+    if start > end:
+        raise ValueError("start must not be after end")
+    if (end - start).days >= MAX_RANGE_DAYS:
+        raise ValueError(f"the range must be shorter than {MAX_RANGE_DAYS} days")
+    return start, end
+
+
+def _midnight(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time()))
+
+
+def overview(start, end, limit=20):
+    """visit counts of the days `start` to `end` (included), from the rollups only"""
+    hourly_since = timezone.localdate() - datetime.timedelta(days=settings.VISIT_ROLLUP_HOURLY_RETENTION_DAYS - 1)
+    period = 'hour' if (end - start).days < 2 and start >= hourly_since else 'day'
+    in_range = {'period': period, 'bucket__gte': _midnight(start),
+                'bucket__lt': _midnight(end + datetime.timedelta(days=1))}
+
+    def top(model, field):
+        return list(model.objects.filter(**in_range).values(field)
+                    .annotate(visits=Sum('visits')).order_by('-visits', field)[:limit])
+
+    paths = PathVisitRollup.objects.filter(**in_range)
+    state = VisitRollupState.objects.filter(pk=1).first()
+    return {
+        'start': start,
+        'end': end,
+        'period': period,
+        'total_visits': paths.aggregate(total=Sum('visits'))['total'] or 0,
+        'series': list(paths.values('bucket').annotate(visits=Sum('visits')).order_by('bucket')),
+        'visits_per_path': top(PathVisitRollup, 'path'),
+        'visits_per_user': top(UserVisitRollup, 'user__username'),
+        'visits_per_tenant': top(TenantVisitRollup, 'tenant__name'),
+        'rolled_up_at': state.updated_at if state else None,
+    }
@@ -1,3 +1,138 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.models import User
+from core.models import Tenant
+from core.report_store import get_report_store
+from . import partitions, rollups
+from .models import Visit
+from .recorder import VisitRecorder
+
+
+class VisitRecorderTestCase(TestCase):
+    def setUp(self):
+        self.recorder = VisitRecorder(background=False)
+        patcher = mock.patch('user_activity.middleware.get_recorder', return_value=self.recorder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(VISIT_EXCLUDE_PATHS=[r'/static/'], VISIT_INCLUDE_PATHS=[r'/api/'])
+    def test_visits_are_buffered_and_filtered(self):
+        for path in ('/api/core/search/', '/static/app.js', '/admin/', '/api/core/release-notes/'):
+            self.client.get(path)
+        self.assertFalse(Visit.objects.exists())  # nothing is written during the requests
+
+        self.assertEqual(self.recorder.flush(), 2)
+        self.assertEqual(sorted(Visit.objects.values_list('path', flat=True)), ['/api/core/release-notes/', '/api/core/search/'])
+        self.assertEqual(Visit.objects.values('session_key').distinct().count(), 1)
+
+    @override_settings(VISIT_SAMPLE_RATE=0.0)
+    def test_sampling(self):
+        self.client.get('/api/core/search/')
+        self.assertEqual(self.recorder.flush(), 0)
+
+    def test_visits_of_deleted_users_are_kept(self):
+        user = User.objects.create_user(username='gone', email='gone@example.com', password='pass')
+        token, user_id = AccessToken.for_user(user), user.pk
+        user.delete()
+        self.client.get('/api/core/release-notes/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.client.get('/api/core/release-notes/')
+        self.assertEqual(self.recorder.flush(), 2)
+        self.assertEqual(Visit.objects.filter(session_key=f'user:{user_id}', user=None).count(), 1)
+
+    @override_settings(VISIT_BUFFER_MAX_SIZE=1)
+    def test_full_buffer_drops_visits(self):
+        self.client.get('/api/core/search/')
+        self.client.get('/api/core/search/')
+        self.assertEqual((self.recorder.dropped, self.recorder.flush()), (1, 1))
+
+
+@override_settings(VISIT_ROLLUP_SETTLE=0, VISIT_BUFFERED=False)
+class VisitRollupTestCase(TestCase):
+    def test_incremental_rollups_and_overview(self):
+        tenant = Tenant.objects.create(name='Tenant', email='t@example.com', phone='1')
+        user = User.objects.create_user(email='u@example.com', username='ann', password='pw', tenant=tenant)
+        now = timezone.now()
+        Visit.objects.bulk_create([
+            Visit(user=user, session_key='s', path='/a/', timestamp=now - timedelta(days=1)),
+            Visit(user=user, session_key='s', path='/a/', timestamp=now - timedelta(minutes=1)),
+            Visit(session_key='t', path='/b/', timestamp=now - timedelta(minutes=1)),
+        ])
+        self.assertEqual(rollups.rollup_visits(batch_size=2), 3)
+        Visit.objects.create(user=user, session_key='s', path='/b/', timestamp=now - timedelta(minutes=1))
+        self.assertEqual(rollups.rollup_visits(), 1)  # only the new visit
+        self.assertEqual(rollups.rollup_visits(), 0)
+
+        today = timezone.localdate()
+        response = self.client.get('/user_activity/overview/', {'start': (today - timedelta(days=6)).isoformat()})
+        data = response.context
+        self.assertEqual((data['period'], data['total_visits']), ('day', 4))
+        self.assertEqual([(row['path'], row['visits']) for row in data['visits_per_path']], [('/a/', 2), ('/b/', 2)])
+        self.assertEqual([(row['user__username'], row['visits']) for row in data['visits_per_user']], [('ann', 3)])
+        self.assertEqual([(row['tenant__name'], row['visits']) for row in data['visits_per_tenant']], [('Tenant', 3)])
+
+        response = self.client.get('/user_activity/overview/', {'start': today.isoformat(), 'end': today.isoformat()})
+        self.assertEqual(response.context['period'], 'hour')
+        response = self.client.get('/user_activity/overview/', {'start': 'today'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(REPORT_STORES={'report': {'BACKEND': 'core.report_store.InMemoryReportStore'}},
+                   VISIT_RETENTION_MONTHS=1, VISIT_ARCHIVE_PART_ROWS=2, VISIT_ROLLUP_SETTLE=0)
+class VisitRetentionTestCase(TestCase):
+    def test_expired_months_are_archived_then_deleted(self):
+        old = partitions.month_start(partitions.current_month()) - timedelta(days=45)
+        Visit.objects.bulk_create([Visit(session_key='s', path=f'/{i}/', timestamp=old) for i in range(3)])
+        recent = Visit.objects.create(session_key='s', path='/new/')
+
+        self.assertEqual(partitions.expire_visits(), [])  # not rolled up yet
+        rollups.rollup_visits()
+        month = old.date().replace(day=1)
+        self.assertEqual(partitions.expire_visits(), [month])
+        self.assertEqual(list(Visit.objects.all()), [recent])
+
+        store = get_report_store('report')
+        blobs, _ = store.list(f'visit-archive/{month:%Y-%m}/')
+        self.assertEqual(len(blobs), 2)
+        rows = list(csv.reader(io.StringIO(gzip.decompress(store.get(blobs[0].name)).decode('utf-8'))))
+        self.assertEqual(rows[0], list(partitions.ARCHIVE_COLUMNS))
+        self.assertEqual([row[3] for row in rows[1:]], ['/0/', '/1/'])
+
+
+@override_settings(VISIT_BUFFERED=False)
+class VisitIdentityTestCase(TestCase):
+    def test_visits_do_not_create_sessions(self):
+        user = User.objects.create_user(username='jwt', email='jwt@example.com', password='pass')
+        token = AccessToken.for_user(user)
+        self.client.get('/api/core/release-notes/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        response = self.client.get('/api/core/release-notes/')
+        cookie = response.cookies[settings.VISIT_COOKIE_NAME].value
+        self.client.get('/api/core/release-notes/')
+
+        self.assertFalse(Session.objects.exists())
+        first, second, third = Visit.objects.order_by('pk')
+        self.assertEqual((first.session_key, first.user), (f'user:{user.pk}', user))
+        self.assertTrue(second.session_key.startswith('visitor:'))
+        self.assertIn(second.session_key[len('visitor:'):], cookie)
+        self.assertEqual(third.session_key, second.session_key)
+
+    def test_clear_visit_sessions(self):
+        empty = SessionStore()
+        empty.create()
+        used = SessionStore()
+        used['_auth_user_id'] = '1'
+        used.create()
+        call_command('clear_visit_sessions', stdout=io.StringIO())
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), [used.session_key])